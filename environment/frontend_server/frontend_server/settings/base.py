@@ -131,6 +131,21 @@ MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(os.path.dirname(BASE_DIR), "media_root")
 
 
+# Push channel to the Reverie backend server
+# (see reverie/backend_server/frontend_channel.py). The port has to match 
+# frontend_channel_port of the backend (e.g., 8932). None, the default, uses
+# the storage files only. 
+# REVERIE_CHANNEL_TIMEOUT is the number of seconds a query for the next 
+# movement waits for the backend before the browser asks again. 
+# REVERIE_CHANNEL_RETRY is the number of seconds the channel is not tried 
+# after the backend could not be reached (e.g., it is not running yet). 
+
+REVERIE_CHANNEL_HOST = "127.0.0.1"
+REVERIE_CHANNEL_PORT = None
+REVERIE_CHANNEL_TIMEOUT = 5
+REVERIE_CHANNEL_RETRY = 10
+
+
 # CORS_ORIGIN_WHITELIST = [
 # 'http://127.0.0.1:8080'
 # ]
@@ -10,6 +10,9 @@ from os import listdir
 import os
 
 import datetime
+import socket
+import time
+from django.conf import settings
 from django.shortcuts import render, redirect, HttpResponseRedirect
 from django.http import HttpResponse, JsonResponse
 from global_methods import *
@@ -238,6 +241,47 @@ def path_tester(request):
   return render(request, template, context)
 
 
+# <channel_down_until> is the time (of time.monotonic) until which the push
+# channel is not tried again, after the backend could not be reached. 
+channel_down_until = 0
+
+
+def send_to_backend(message, timeout): 
+  """
+  Sends a request to the backend server over the push channel (see 
+  reverie/backend_server/frontend_channel.py), and returns its response. 
+  If the backend can not be reached, the channel is not tried again for 
+  REVERIE_CHANNEL_RETRY seconds, so that the steps in between do not each 
+  wait for a connection that fails. 
+
+  ARGS:
+    message: the json request. 
+    timeout: the number of seconds to wait for the response. 
+  RETURNS: 
+    the json response, or None if the channel could not be reached (or is
+    turned off), in which case the caller uses the storage files. 
+  """
+  global channel_down_until
+  port = getattr(settings, "REVERIE_CHANNEL_PORT", None)
+  if not port or time.monotonic() < channel_down_until: 
+    return None
+  host = getattr(settings, "REVERIE_CHANNEL_HOST", "127.0.0.1")
+  try: 
+    sock = socket.create_connection((host, port), timeout=1)
+  except OSError: 
+    channel_down_until = (time.monotonic() 
+                          + getattr(settings, "REVERIE_CHANNEL_RETRY", 10))
+    return None
+  try: 
+    with sock: 
+      sock.settimeout(timeout)
+      sock.sendall((json.dumps(message) + "\n").encode("utf-8"))
+      with sock.makefile("rb") as infile: 
+        return json.loads(infile.readline())
+  except (OSError, ValueError): 
+    return None
+
+
 def process_environment(request): 
   """
   <FRONTEND to BACKEND> 
@@ -262,6 +306,13 @@ def process_environment(request):
   with open(f"storage/{sim_code}/environment/{step}.json", "w") as outfile:
     outfile.write(json.dumps(environment, indent=2))
 
+  # The file is kept for replays; the backend gets the environment pushed 
+  # over the channel if it is listening, and picks up the file otherwise. 
+  send_to_backend({"type": "environment", 
+                   "sim_code": sim_code, 
+                   "step": step, 
+                   "environment": environment}, 1)
+
   return HttpResponse("received")
 
 
@@ -286,6 +337,17 @@ def update_environment(request):
   step = data["step"]
   sim_code = data["sim_code"]
 
+  # Over the channel, the backend answers as soon as the movement of this 
+  # step is computed. If it does not have it (e.g., it was computed before 
+  # the channel was opened), we look for the file. 
+  timeout = getattr(settings, "REVERIE_CHANNEL_TIMEOUT", 5)
+  response_data = send_to_backend({"type": "movement", 
+                                   "sim_code": sim_code, 
+                                   "step": step, 
+                                   "timeout": timeout}, timeout + 1)
+  if response_data and response_data.get("<step>", -1) != -1: 
+    return JsonResponse(response_data)
+
   response_data = {"<step>": -1}
   if (check_if_file_exists(f"storage/{sim_code}/movement/{step}.json")):
     with open(f"storage/{sim_code}/movement/{step}.json") as json_file: 
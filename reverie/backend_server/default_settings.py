@@ -0,0 +1,253 @@
+"""
+File: default_settings.py
+Description: Default values for the optional settings of Reverie. The
+required settings (e.g., openai_api_key and fs_storage) live in utils.py,
+which every user writes for their own machine. Any of the settings below can
+be overridden by defining a variable with the same name in utils.py.
+"""
+import utils
+
+# ============================================================================
+# ###########################[SECTION 1: LLM CLIENT] #########################
+# ============================================================================
+
+# <llm_backend> is where the LLM requests go. "openai" sends them to the 
+# OpenAI APIs. "local" answers them with the deterministic stand-in of 
+# persona/prompt_template/local_llm.py, which needs no network access and 
+# is meant for load testing (see SECTION 4). 
+llm_backend = getattr(utils, "llm_backend", "openai")
+
+# <openai_api_base> is the endpoint that all OpenAI requests are sent to.
+# Point this to any OpenAI-compatible server to run Reverie against it. None
+# means OpenAI's own endpoint.
+# e.g., "http://localhost:8080/v1"
+openai_api_base = getattr(utils, "openai_api_base", None)
+
+# <llm_max_connections> is the size of the HTTP connection pool that is
+# shared by all requests of the process.
+llm_max_connections = getattr(utils, "llm_max_connections", 32)
+
+# <llm_model_concurrency> is the maximum number of requests that can be in
+# flight at the same time for each model. Models that are not listed here
+# use <llm_default_concurrency>.
+llm_model_concurrency = getattr(utils, "llm_model_concurrency",
+                                {"gpt-3.5-turbo": 16,
+                                 "gpt-4": 4,
+                                 "text-embedding-ada-002": 16})
+llm_default_concurrency = getattr(utils, "llm_default_concurrency", 8)
+
+# <llm_adaptive_concurrency> treats the limits above as ceilings: a model's 
+# limit is halved whenever the provider signals that it is overloaded (a 
+# rate limit error or a timeout), and grows back as requests succeed. 
+llm_adaptive_concurrency = getattr(utils, "llm_adaptive_concurrency", True)
+
+# <llm_rate_limits> are the requests-per-minute ("rpm") and tokens-per-minute
+# ("tpm") budgets of each model. Set them to the limits of your OpenAI 
+# account. Models that are not listed are not rate limited. 
+llm_rate_limits = getattr(utils, "llm_rate_limits", 
+                          {"gpt-3.5-turbo": {"rpm": 3500, "tpm": 90000}, 
+                           "gpt-4": {"rpm": 200, "tpm": 40000}, 
+                           "text-davinci-003": {"rpm": 3000, "tpm": 250000},
+                           "text-embedding-ada-002": {"rpm": 3000, 
+                                                      "tpm": 1000000}})
+
+# <llm_max_retries> is the number of times a request is sent again after it
+# failed because the provider was overloaded or could not be reached. The 
+# n-th retry waits a random time of up to <llm_backoff_base> * 2^(n-1) 
+# seconds, capped at <llm_backoff_max>. 
+llm_max_retries = getattr(utils, "llm_max_retries", 6)
+llm_backoff_base = getattr(utils, "llm_backoff_base", 1.0)
+llm_backoff_max = getattr(utils, "llm_backoff_max", 60.0)
+
+# <llm_request_timeout> is the number of seconds after which a request is
+# given up on. None uses the timeout of the openai package.
+llm_request_timeout = getattr(utils, "llm_request_timeout", None)
+
+# <llm_coalesce_requests> makes a request that is identical to one still in 
+# flight (e.g., two personas asking for the poignancy of the same event at 
+# the same time) wait for that one's response instead of being sent again. 
+llm_coalesce_requests = getattr(utils, "llm_coalesce_requests", True)
+
+# ============================================================================
+# #######################[SECTION 2: LLM RESPONSE CACHE] #####################
+# ============================================================================
+
+# <llm_cache_loc> is the SQLite file of the persistent LLM response cache. 
+# Responses that passed validation are stored there, keyed by (model, 
+# prompt, gpt_param), and reused by every later simulation. None turns the 
+# cache off. 
+# e.g., "../../environment/frontend_server/temp_storage/llm_cache.sqlite"
+llm_cache_loc = getattr(utils, "llm_cache_loc", None)
+
+# <llm_cache_ttl> is the number of seconds after which a cached response 
+# expires. None means that responses never expire. 
+llm_cache_ttl = getattr(utils, "llm_cache_ttl", None)
+
+# <llm_cache_max_mb> is the size the cache can grow to before the least 
+# recently used responses are evicted. None means no limit. 
+llm_cache_max_mb = getattr(utils, "llm_cache_max_mb", 512)
+
+# <llm_cache_read_only> makes the cache a fixed lookup table: misses still 
+# go to the API, but nothing is ever written back. Use this for reproducible
+# benchmarking. 
+llm_cache_read_only = getattr(utils, "llm_cache_read_only", False)
+
+# ============================================================================
+# ########################[SECTION 3: EMBEDDING STORE] #######################
+# ============================================================================
+
+# <embedding_store_loc> is the SQLite file that text embeddings are 
+# persisted to, so that they are shared by all personas and all simulations.
+# None keeps them in memory for the lifetime of the process only. 
+# e.g., "../../environment/frontend_server/temp_storage/embeddings.sqlite"
+embedding_store_loc = getattr(utils, "embedding_store_loc", None)
+
+# <embedding_store_memory_entries> is the number of embeddings kept in memory
+# (about 6KB each for text-embedding-ada-002). 
+embedding_store_memory_entries = getattr(utils, 
+                                         "embedding_store_memory_entries", 
+                                         10000)
+
+# <embedding_batch_size> is the maximum number of texts that get_embeddings 
+# sends in a single request. 
+embedding_batch_size = getattr(utils, "embedding_batch_size", 256)
+
+# ============================================================================
+# ######################[SECTION 4: LOCAL LLM STAND-IN] ######################
+# ============================================================================
+
+# <local_llm_latency> maps each kind of request ("chat", "completion" and 
+# "embeddings") to the distribution that the stand-in draws its latency 
+# from, so that load tests see realistic call shapes. A distribution is a 
+# number of seconds, or one of ("fixed", seconds), ("uniform", low, high), 
+# ("normal", mean, sd) and ("lognormal", median, sigma). None answers every
+# request right away. 
+local_llm_latency = getattr(utils, "local_llm_latency", 
+                            {"chat": ("lognormal", 1.0, 0.5), 
+                             "completion": ("lognormal", 0.7, 0.5), 
+                             "embeddings": ("lognormal", 0.15, 0.3)})
+
+# <local_llm_seed> changes all responses and latencies of the stand-in. The 
+# same seed always gives the same response to the same prompt. 
+# Note: the stand-in's responses and embeddings should not be mixed with 
+# real ones, so use a different <llm_cache_loc> and <embedding_store_loc> 
+# (or none) when running with it. 
+local_llm_seed = getattr(utils, "local_llm_seed", 0)
+
+# ============================================================================
+# #######################[SECTION 5: RECORD AND REPLAY] ######################
+# ============================================================================
+
+# <llm_record_loc> is the transcript file that every LLM request is appended
+# to, with its response and latency, one json object per line. None turns 
+# recording off. 
+# Note: requests that are answered by the LLM response cache or the 
+# embedding store never reach the backend, and are not recorded. Turn those
+# off (or make them read-only) for a complete transcript. 
+# e.g., "../../environment/frontend_server/temp_storage/transcript.jsonl"
+llm_record_loc = getattr(utils, "llm_record_loc", None)
+
+# <llm_replay_loc> is a transcript to serve all LLM requests from, instead 
+# of sending them anywhere. None turns replay off. 
+llm_replay_loc = getattr(utils, "llm_replay_loc", None)
+
+# <llm_replay_mode> is how requests are matched to the transcript: "hash" by
+# their content, or "order" by their position (which requires the personas 
+# to be stepped one after another, and parallel_action_prompts to be off). 
+llm_replay_mode = getattr(utils, "llm_replay_mode", "hash")
+
+# <llm_replay_latency> makes each replayed request take as long as it did 
+# when it was recorded. 
+llm_replay_latency = getattr(utils, "llm_replay_latency", False)
+
+# <simulation_seed> seeds the random choices that the personas make (e.g., 
+# which of the tiles of an object to walk to), so that a replayed simulation
+# takes the exact same steps as the recorded one. None leaves them unseeded.
+simulation_seed = getattr(utils, "simulation_seed", None)
+
+# ============================================================================
+# ###########################[SECTION 6: COGNITION] ##########################
+# ============================================================================
+
+# <persona_workers> is the maximum number of personas that can run their 
+# cognitive sequence at the same time in a concurrent run (see 
+# ReverieServer.move_personas_concurrently), or work ahead on the next step 
+# in a pipelined one. 
+persona_workers = getattr(utils, "persona_workers", 25)
+
+# <combined_action_resolution> resolves the address of a new action (sector,
+# arena and game object), its emoji and event triple, and the state of its 
+# game object in a single request, instead of a chain of up to eight. If the
+# response does not name a place that the persona knows about, the chain is 
+# used after all. 
+combined_action_resolution = getattr(utils, "combined_action_resolution", 
+                                     False)
+
+# <parallel_action_prompts> sends the requests of that chain that do not 
+# depend on each other at the same time, so that a new action takes about 
+# the latency of its longest run of dependent requests (five, instead of 
+# eight). It can not be used for a replay in "order" mode, since the order 
+# in which the requests are sent then depends on their latency. 
+parallel_action_prompts = getattr(utils, "parallel_action_prompts", False)
+
+# <task_graph_workers> is the number of threads that those requests are sent
+# from, shared by all personas. 
+task_graph_workers = getattr(utils, "task_graph_workers", 32)
+
+# <one_shot_hourly_schedule> generates a persona's hourly schedule for the 
+# day in a single request, instead of one request per waking hour (repeated 
+# up to three times when the day is not diverse enough). If the day is not 
+# diverse enough, only the hours of its most repeated activity are 
+# generated again. 
+one_shot_hourly_schedule = getattr(utils, "one_shot_hourly_schedule", False)
+
+# <background_reflection> runs a persona's reflection on a snapshot of its 
+# memory in the background, so that the persona (and the whole simulation 
+# step) does not wait for it. The thoughts are added to its memory at the 
+# first step after the reflection is done. Since that step depends on how 
+# long the requests take, runs with it on are not exactly reproducible. 
+background_reflection = getattr(utils, "background_reflection", False)
+
+# ============================================================================
+# ############################[SECTION 7: FRONTEND] ##########################
+# ============================================================================
+
+# <frontend_channel_port> is the local port that the backend listens on for 
+# the frontend server (see frontend_channel.py), which hands each step over
+# through it as soon as it is ready, instead of through files that both 
+# sides poll. It has to match REVERIE_CHANNEL_PORT in the settings of the 
+# frontend server. None (the default) turns the channel off, and the files 
+# are used. 
+# e.g., 8932
+frontend_channel_host = getattr(utils, "frontend_channel_host", "127.0.0.1")
+frontend_channel_port = getattr(utils, "frontend_channel_port", None)
+
+# ============================================================================
+# ###########################[SECTION 8: PATH FINDING] #######################
+# ============================================================================
+
+# <hierarchical_pathfinding> plans the walks of the personas over a graph of 
+# the doors between the arenas of the map, and only works out the tiles of 
+# each leg as the persona gets there (see navigator.py), instead of 
+# searching the whole map for every walk. The paths are a little longer 
+# than the shortest ones, and building the graph takes a moment when the map
+# is loaded, so this is meant for maps far bigger than the_ville. 
+hierarchical_pathfinding = getattr(utils, "hierarchical_pathfinding", False)
+
+# <navigator_cluster_size> is the size (in tiles) of the squares that the 
+# arenas are cut into for that graph, so that large open areas do not make
+# for large regions. 
+navigator_cluster_size = getattr(utils, "navigator_cluster_size", 32)
+
+# <distance_field_cache_size> is the number of distance fields (one per 
+# address that the personas walk to, see Maze.get_distance_field) that are 
+# kept for the next persona that heads there. Each takes 4 bytes per tile of
+# the map (about 56KB for the_ville). They are not used with the navigator. 
+distance_field_cache_size = getattr(utils, "distance_field_cache_size", 256)
+
+# <path_batch_max_tiles> caps the size of the arrays that the paths of a 
+# batched run (see ReverieServer.move_personas_in_two_phases) are searched 
+# with: the paths are searched for in chunks of no more than this many 
+# tiles, summed over the requests of a chunk (about 8 bytes each). None 
+# searches for all of them at once. 
+path_batch_max_tiles = getattr(utils, "path_batch_max_tiles", 2 ** 22)
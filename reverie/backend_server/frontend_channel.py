@@ -0,0 +1,125 @@
+"""
+File: frontend_channel.py
+Description: A local push channel between the frontend server (see
+translator/views.py) and ReverieServer. Without it, the two sides hand each
+step over through files that they both poll: the frontend writes
+environment/{step}.json and the backend checks for it every <server_sleep>
+seconds, and the browser asks for movement/{step}.json until it is there.
+With it, the frontend server sends each environment to the backend over a
+local socket the moment it gets it, and waits on the same socket for the
+movement of the step, which the backend pushes as soon as it is computed.
+
+The files are still written, so that replays keep working and so that the
+frontend falls back to them whenever the channel cannot be reached.
+
+The protocol is one json request per connection, answered with one json
+line:
+  {"type": "environment", "sim_code": ..., "step": ..., "environment": ...}
+    -> {"ok": true}
+  {"type": "movement", "sim_code": ..., "step": ..., "timeout": ...}
+    -> the movements of the step (as in movement/{step}.json), or
+       {"<step>": -1} if they were not ready within <timeout> seconds.
+"""
+import json
+import socketserver
+import threading
+import time
+
+
+class _ChannelServer(socketserver.ThreadingTCPServer):
+  daemon_threads = True
+  allow_reuse_address = True
+
+
+class _ChannelHandler(socketserver.StreamRequestHandler):
+  def handle(self):
+    channel = self.server.channel
+    try:
+      request = json.loads(self.rfile.readline())
+    except ValueError:
+      return
+    response = {"ok": False}
+    if request.get("sim_code") == channel.sim_code:
+      if request.get("type") == "environment":
+        channel.put_environment(request["step"], request["environment"])
+        response = {"ok": True}
+      elif request.get("type") == "movement":
+        response = channel.wait_for_movement(request["step"],
+                                             request.get("timeout", 0))
+        if response is None:
+          response = {"<step>": -1}
+    self.wfile.write((json.dumps(response) + "\n").encode("utf-8"))
+
+
+class FrontendChannel:
+  def __init__(self, sim_code, host="127.0.0.1", port=8932):
+    # <sim_code> is the simulation the backend is running. Requests for any
+    # other simulation are turned down, so the frontend uses the files.
+    self.sim_code = sim_code
+    # <environments> and <movements> hold the latest steps that were handed
+    # over, by step.
+    self.environments = dict()
+    self.movements = dict()
+    self._condition = threading.Condition()
+
+    self._server = _ChannelServer((host, port), _ChannelHandler)
+    self._server.channel = self
+    self._thread = threading.Thread(target=self._server.serve_forever,
+                                    daemon=True)
+    self._thread.start()
+
+
+  def _wait_for(self, steps, step, timeout):
+    deadline = time.monotonic() + timeout
+    with self._condition:
+      while step not in steps:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+          return None
+        self._condition.wait(remaining)
+      return steps[step]
+
+
+  def _put(self, steps, step, value):
+    with self._condition:
+      steps[step] = value
+      # Only the last few steps can still be asked for.
+      for old_step in [i for i in steps if i < step - 2]:
+        del steps[old_step]
+      self._condition.notify_all()
+
+
+  def put_environment(self, step, environment):
+    self._put(self.environments, step, environment)
+
+
+  def wait_for_environment(self, step, timeout):
+    """
+    Waits up to <timeout> seconds for the frontend to send the environment
+    of <step>.
+
+    INPUT
+      step: the step of the environment.
+      timeout: the number of seconds to wait.
+    OUTPUT
+      The environment, in the form of the environment/{step}.json files, or
+      None if it did not come in time.
+    """
+    return self._wait_for(self.environments, step, timeout)
+
+
+  def put_movement(self, step, movements):
+    self._put(self.movements, step, movements)
+
+
+  def wait_for_movement(self, step, timeout):
+    movements = self._wait_for(self.movements, step, timeout)
+    if movements is None:
+      return None
+    return dict(movements, **{"<step>": step})
+
+
+  def close(self):
+    self._server.shutdown()
+    self._server.server_close()
+
@@ -5,6 +5,7 @@ File: maze.py
 Description: Defines the Maze class, which represents the map of the simulated
 world in a 2-dimensional matrix. 
 """
+import collections
 import json
 import numpy
 import datetime
@@ -13,7 +14,10 @@ import time
 import math
 
 from global_methods import *
+from path_finder import *
+from navigator import *
 from utils import *
+from default_settings import *
 """
 这段代码定义了一个名为 Maze 的类，表示一个二维网格的迷宫（或游戏地图）。它的目的是模拟一个虚拟世界，
 包含各种不同的块（块可以是障碍物、房间、物体等）。
@@ -207,6 +211,26 @@ class Maze:
           else: 
             self.address_tiles[add] = set([(j, i)])
 
+    # <distance_fields> maps each address that was asked for to its distance
+    # field (see get_distance_field), keeping the 
+    # <distance_field_cache_size> that were used last. It is only good for 
+    # the passability grid it was computed with, <distance_field_grid>. 
+    self.distance_fields = collections.OrderedDict()
+    self.distance_field_grid = None
+
+    # <navigator> plans the walks of the personas over the doors between the
+    # arenas of the map, if <hierarchical_pathfinding> is on (see 
+    # navigator.py). 
+    self.navigator = None
+    if hierarchical_pathfinding: 
+      self.navigator = Navigator(self, collision_block_id, 
+                                 navigator_cluster_size)
+
+    # <event_changes> keeps track of the tiles whose events were changed, 
+    # while it is not None (see pop_changed_tiles). It maps each of these 
+    # tiles to the events it had before the first of these changes. 
+    self.event_changes = None
+
 
   def turn_coordinate_to_tile(self, px_coordinate): 
     """
@@ -327,6 +351,96 @@ class Maze:
     return nearby_tiles
 
 
+  def get_distance_field(self, address): 
+    """
+    Returns the distance field to the tiles of <address>: the number of 
+    steps from every tile of the maze to the closest of them (see 
+    path_finder.distance_field). Each field is computed once and reused 
+    until the collision maze changes, or until it is one of the least 
+    recently used when more than <distance_field_cache_size> are kept. 
+
+    INPUT: 
+      address: A string address in <address_tiles>. 
+    OUPUT: 
+      field: a flat array of distances, row after row. 
+    """
+    grid = get_passability_grid(self.collision_maze, collision_block_id)
+    if grid is not self.distance_field_grid: 
+      self.distance_fields = collections.OrderedDict()
+      self.distance_field_grid = grid
+
+    if address in self.distance_fields: 
+      self.distance_fields.move_to_end(address)
+    else: 
+      tiles = self.address_tiles[address]
+      self.distance_fields[address] = distance_field(
+                                        self.collision_maze, 
+                                        [(i[1], i[0]) for i in tiles],
+                                        collision_block_id)
+      if len(self.distance_fields) > distance_field_cache_size: 
+        self.distance_fields.popitem(last=False)
+    return self.distance_fields[address]
+
+
+  def get_path_to_address(self, start, address, excluded_tiles=()): 
+    """
+    Returns the shortest path from <start> to the closest tile of 
+    <address>, read off its distance field. If that tile is one of 
+    <excluded_tiles>, the path to the closest of the other tiles of the 
+    address is searched for instead. 
+
+    INPUT: 
+      start: The tile coordinate to start from in (x, y) form. 
+      address: A string address in <address_tiles>. 
+      excluded_tiles: The tiles of the address (in (x, y) form) that are 
+                      not to be headed to, e.g., because a persona is on 
+                      them. 
+    OUPUT: 
+      path: a list of (x, y) tile coordinates that starts with <start>, or 
+            [] if none of the tiles can be reached. 
+    """
+    field = self.get_distance_field(address)
+    path = path_from_distance_field(self.collision_maze, field, 
+                                    (start[1], start[0]))
+    path = [(i[1], i[0]) for i in path]
+    excluded_tiles = set((i[0], i[1]) for i in excluded_tiles)
+    if path and path[-1] in excluded_tiles: 
+      tiles = sorted(self.address_tiles[address] - excluded_tiles)
+      closest_tile, path = path_finder_multi(self.collision_maze, start, 
+                                             tiles, collision_block_id)
+    return path
+
+
+  def _record_event_change(self, tile): 
+    if self.event_changes is None: 
+      return
+    tile = (tile[0], tile[1])
+    if tile not in self.event_changes: 
+      self.event_changes[tile] = frozenset(self.tiles[tile[1]][tile[0]]
+                                                 ["events"])
+
+
+  def pop_changed_tiles(self): 
+    """
+    Returns the tiles whose events are different from what they were when 
+    this was last called, and starts keeping track of the changes again. 
+    A tile whose events were changed back and forth in between (e.g., an 
+    object that was turned idle and then used again) is not returned. 
+
+    INPUT: 
+      None
+    OUPUT: 
+      changed_tiles: a list of tile coordinates in (x, y) form. 
+    """
+    changed_tiles = []
+    if self.event_changes: 
+      for tile, events in self.event_changes.items(): 
+        if events != self.tiles[tile[1]][tile[0]]["events"]: 
+          changed_tiles += [tile]
+    self.event_changes = dict()
+    return changed_tiles
+
+
   def add_event_from_tile(self, curr_event, tile): 
     """
     Add an event triple to a tile.  
@@ -339,6 +453,7 @@ class Maze:
     OUPUT: 
       None
     """
+    self._record_event_change(tile)
     self.tiles[tile[1]][tile[0]]["events"].add(curr_event)
 
 
@@ -354,6 +469,7 @@ class Maze:
     OUPUT: 
       None
     """
+    self._record_event_change(tile)
     curr_tile_ev_cp = self.tiles[tile[1]][tile[0]]["events"].copy()
     for event in curr_tile_ev_cp: 
       if event == curr_event:  
@@ -361,6 +477,7 @@ class Maze:
 
 
   def turn_event_from_tile_idle(self, curr_event, tile):
+    self._record_event_change(tile)
     curr_tile_ev_cp = self.tiles[tile[1]][tile[0]]["events"].copy()
     for event in curr_tile_ev_cp: 
       if event == curr_event:  
@@ -379,6 +496,7 @@ class Maze:
     OUPUT: 
       None
     """
+    self._record_event_change(tile)
     curr_tile_ev_cp = self.tiles[tile[1]][tile[0]]["events"].copy()
     for event in curr_tile_ev_cp: 
       if event[0] == subject:  
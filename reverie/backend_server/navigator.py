@@ -0,0 +1,271 @@
+"""
+File: navigator.py
+Description: A hierarchical path finder for maps that are too big to search
+tile by tile for every walk of every persona (see path_finder.py).
+
+The map is split into regions: the walkable tiles of each arena (or of each
+sector, or of the open world, when there is no arena), cut into square
+clusters so that no region is very large. Where two regions touch, every
+stretch of the border gets one door -- a pair of tiles facing each other
+across it. The distances between the doors of each region are worked out
+when the map is loaded. A walk is then planned over the graph of the doors,
+which is much smaller than the map, and only comes down to tiles one leg (a
+region) at a time, as the persona gets there. The routes from each door to
+all others are cached, since most walks go through the same few doors.
+
+The paths are not always the shortest: they go through the middle of each
+door.
+"""
+import array
+import heapq
+
+from collections import deque
+
+from path_finder import *
+
+
+class Navigator:
+  def __init__(self, maze, collision_block_char, cluster_size=32):
+    self.collision_maze = maze.collision_maze
+    self.collision_block_char = collision_block_char
+    self.width = maze.maze_width
+    self.height = maze.maze_height
+    self.passable = get_passability_grid(maze.collision_maze,
+                                         collision_block_char)
+
+    # <region> is the region of every tile, as a flat array, row after row.
+    # Tiles that can not be walked on are in region -1.
+    self.region = array.array("i", [-1]) * (self.width * self.height)
+    region_count = 0
+    for index in range(self.width * self.height):
+      if self.passable[index] and self.region[index] == -1:
+        key = self._get_region_key(maze, index, cluster_size)
+        self.region[index] = region_count
+        queue = deque([index])
+        while queue:
+          for neighbor in self._get_neighbors(queue.popleft()):
+            if (self.passable[neighbor] and self.region[neighbor] == -1
+                and self._get_region_key(maze, neighbor, cluster_size)
+                    == key):
+              self.region[neighbor] = region_count
+              queue.append(neighbor)
+        region_count += 1
+
+    # <edges> maps every door tile to the (door tile, distance) pairs it is
+    # connected to: the door it faces, and the other doors of its region.
+    self.edges = dict()
+    region_doors = dict()
+    for tile_a, tile_b in self._find_doors():
+      for tile, other in [(tile_a, tile_b), (tile_b, tile_a)]:
+        self.edges.setdefault(tile, []).append((other, 1))
+        region_doors.setdefault(self.region[tile], set()).add(tile)
+    for region, doors in region_doors.items():
+      for door in doors:
+        dist = self._get_local_distances(door)
+        for other in doors:
+          if other != door and other in dist:
+            self.edges[door].append((other, dist[other]))
+    self.region_doors = {region: sorted(doors)
+                         for region, doors in region_doors.items()}
+
+    # <routes> caches the shortest routes from a door to every other door,
+    # as (distances, previous doors), by the door they start from.
+    self.routes = dict()
+
+
+  def _get_region_key(self, maze, index, cluster_size):
+    y, x = divmod(index, self.width)
+    tile = maze.tiles[y][x]
+    return (tile["sector"], tile["arena"],
+            x // cluster_size, y // cluster_size)
+
+
+  def _get_neighbors(self, index):
+    # In the order that path_finder tries them: up, left, down, right.
+    y, x = divmod(index, self.width)
+    neighbors = []
+    if y > 0: neighbors += [index - self.width]
+    if x > 0: neighbors += [index - 1]
+    if y < self.height - 1: neighbors += [index + self.width]
+    if x < self.width - 1: neighbors += [index + 1]
+    return neighbors
+
+
+  def _find_doors(self):
+    """
+    Returns a door for every stretch of border between two regions: the
+    pair of facing tiles in the middle of the stretch.
+    """
+    # <borders> maps (region, region, direction) to the tiles on the first
+    # side of that border.
+    borders = dict()
+    for index in range(self.width * self.height):
+      if self.region[index] == -1:
+        continue
+      y, x = divmod(index, self.width)
+      for step, is_last in [(1, x == self.width - 1),
+                            (self.width, y == self.height - 1)]:
+        if is_last:
+          continue
+        other = index + step
+        if (self.region[other] != -1
+            and self.region[other] != self.region[index]):
+          key = (self.region[index], self.region[other], step)
+          borders.setdefault(key, set()).add(index)
+
+    doors = []
+    for (region_a, region_b, step), tiles in sorted(borders.items()):
+      # A stretch is a run of border tiles that are next to each other.
+      along = self.width if step == 1 else 1
+      while tiles:
+        stretch = [min(tiles)]
+        tiles.remove(stretch[0])
+        while (stretch[-1] + along in tiles
+               and not (along == 1 and (stretch[-1] + 1) % self.width == 0)):
+          stretch += [stretch[-1] + along]
+          tiles.remove(stretch[-1])
+        middle = stretch[len(stretch) // 2]
+        doors += [(middle, middle + step)]
+    return doors
+
+
+  def _get_local_distances(self, start, end=None):
+    """
+    Returns the distance from <start> of every tile of its region (and of
+    <end>, if it is next to the region), as a dictionary.
+    """
+    region = self.region[start]
+    dist = {start: 0}
+    queue = deque([start])
+    while queue:
+      index = queue.popleft()
+      for neighbor in self._get_neighbors(index):
+        if neighbor not in dist and (self.region[neighbor] == region
+                                     or neighbor == end):
+          dist[neighbor] = dist[index] + 1
+          if neighbor != end:
+            queue.append(neighbor)
+    return dist
+
+
+  def _get_route(self, door):
+    if door not in self.routes:
+      dist = {door: 0}
+      previous = dict()
+      heap = [(0, door)]
+      while heap:
+        d, curr = heapq.heappop(heap)
+        if d > dist[curr]:
+          continue
+        for other, cost in self.edges[curr]:
+          if d + cost < dist.get(other, d + cost + 1):
+            dist[other] = d + cost
+            previous[other] = curr
+            heapq.heappush(heap, (d + cost, other))
+      self.routes[door] = (dist, previous)
+    return self.routes[door]
+
+
+  def find_route(self, start, ends):
+    """
+    Plans a walk from <start> to the closest of <ends> over the doors of the
+    map.
+
+    INPUT
+      start: the tile to start from in (x, y) form.
+      ends: a list of tiles in (x, y) form.
+    OUTPUT
+      (end, waypoints), where <end> is the closest of <ends> that can be
+      reached (the first one, if several are as close) and <waypoints> are
+      the tiles to walk through to get there, <start> and <end> included.
+      (None, []) if none of <ends> can be reached, and None if <start> is
+      not a tile that can be walked on.
+    """
+    start_index = start[1] * self.width + start[0]
+    if self.region[start_index] == -1:
+      return None
+
+    start_dist = self._get_local_distances(start_index)
+    start_doors = [(door, start_dist[door]) for door in
+                   self.region_doors.get(self.region[start_index], [])
+                   if door in start_dist]
+
+    best = None
+    for end in ends:
+      end_index = end[1] * self.width + end[0]
+      if self.region[end_index] == -1:
+        continue
+      # Walking there without leaving the region of <start>, ...
+      if end_index in start_dist:
+        total = start_dist[end_index]
+        if not best or total < best[0]:
+          best = (total, end, [start_index, end_index])
+      # ... or through the doors.
+      end_dist = self._get_local_distances(end_index)
+      end_doors = [(door, end_dist[door]) for door in
+                   self.region_doors.get(self.region[end_index], [])
+                   if door in end_dist]
+      for start_door, start_door_dist in start_doors:
+        route_dist, route_previous = self._get_route(start_door)
+        for end_door, end_door_dist in end_doors:
+          if end_door not in route_dist:
+            continue
+          total = start_door_dist + route_dist[end_door] + end_door_dist
+          if not best or total < best[0]:
+            doors = [end_door]
+            while doors[-1] != start_door:
+              doors += [route_previous[doors[-1]]]
+            best = (total, end, [start_index] + doors[::-1] + [end_index])
+
+    if not best:
+      return None, []
+    waypoints = []
+    for index in best[2]:
+      if not waypoints or waypoints[-1] != index:
+        waypoints += [index]
+    return best[1], [(index % self.width, index // self.width)
+                     for index in waypoints]
+
+
+  def extend_path(self, tile, waypoints):
+    """
+    Works out the tiles of the next leg of a walk planned by find_route.
+
+    INPUT
+      tile: the tile the persona is at (or will be at) in (x, y) form.
+      waypoints: the waypoints of the walk that are still ahead.
+    OUTPUT
+      (path, waypoints): the tiles of the next leg, <tile> not included, and
+      the waypoints that are still ahead after it.
+    """
+    while waypoints:
+      destination = waypoints[-1]
+      start_index = tile[1] * self.width + tile[0]
+      end_index = waypoints[0][1] * self.width + waypoints[0][0]
+      waypoints = waypoints[1:]
+      if start_index == end_index:
+        continue
+
+      dist = self._get_local_distances(start_index, end_index)
+      if end_index in dist:
+        # Walking back from the end, as path_finder does.
+        index = end_index
+        leg = [index]
+        while dist[index] > 1:
+          for neighbor in self._get_neighbors(index):
+            if dist.get(neighbor) == dist[index] - 1:
+              index = neighbor
+              break
+          leg += [index]
+        leg.reverse()
+        leg = [(index % self.width, index // self.width) for index in leg]
+      else:
+        # The waypoint can not be reached from the region of <tile> (e.g.,
+        # the persona was moved off its path), so we search the map for the
+        # rest of the walk.
+        leg = path_finder(self.collision_maze, tile, destination,
+                          self.collision_block_char)[1:]
+        waypoints = []
+      if leg:
+        return leg, waypoints
+    return [], []
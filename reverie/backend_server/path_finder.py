@@ -9,8 +9,16 @@ Some of the functions are defunct.
 """
 这段代码定义了一组用于在二维迷宫中找到路径的函数。通过迷宫、起点和终点坐标，函数可以生成从起点到终点的路径，避开障碍。
 """
+import array
+import heapq
 import numpy as np
 
+from collections import deque
+
+# <_passability_grids> keeps the compiled form of every collision maze that 
+# was searched (see get_passability_grid), by the id of the maze. 
+_passability_grids = dict()
+
 def print_maze(maze):
   for row in maze:
     for item in row:
@@ -169,13 +177,188 @@ def path_finder_v2(a, start, end, collision_block_char, verbose=False):
   return the_path
 
 
+# 把碰撞迷宫编译成一维的可通行表（每个迷宫只编译一次），供 path_finder_v3 使用。
+def get_passability_grid(maze, collision_block_char): 
+  # The grid is a flat list, row after row, of whether each tile can be 
+  # walked on. It is compiled on the first search of a maze and reused after
+  # that, so a maze must not be edited in place once it is searched (use 
+  # clear_passability_grids if it is). 
+  key = (id(maze), collision_block_char)
+  entry = _passability_grids.get(key)
+  if not entry or entry[0] is not maze: 
+    grid = [j != collision_block_char for row in maze for j in row]
+    entry = (maze, grid)
+    _passability_grids[key] = entry
+  return entry[1]
+
+
+def clear_passability_grids(): 
+  _passability_grids.clear()
+
+
+# 把可通行表转成 NumPy 布尔数组（高 x 宽），供批量的波前搜索使用。
+def get_passability_array(maze, collision_block_char): 
+  # Compiled from (and cached with) the passability grid of the maze. 
+  grid = get_passability_grid(maze, collision_block_char)
+  entry = _passability_grids[(id(maze), collision_block_char)]
+  if len(entry) < 3: 
+    passable = np.array(grid, dtype=bool).reshape(len(maze), len(maze[0]))
+    entry = entry[:2] + (passable,)
+    _passability_grids[(id(maze), collision_block_char)] = entry
+  return entry[2]
+
+
+# 使用 A* 算法（二叉堆 + 曼哈顿距离）查找路径。找不到路径时返回空列表。
+def path_finder_v3(maze, start, end, collision_block_char, verbose=False):
+  # Same (row, col) coordinates as path_finder_v2, and the same path: of the
+  # shortest paths, v2 takes the one it finds walking back from <end>, 
+  # trying up, left, down, and right in that order. Unlike v2, there is no 
+  # limit on the length of the path, and an <end> that can not be reached 
+  # gives [] instead of [end]. 
+  return path_finder_v3_multi(maze, start, [end], collision_block_char, 
+                              verbose)[1]
+
+
+# 多目标的 A* 查找：一次搜索就找到离起点最近的可达目标，以及到它的路径。
+def path_finder_v3_multi(maze, start, ends, collision_block_char, 
+                         verbose=False): 
+  # Returns the closest of <ends> that can be reached from <start>, and the 
+  # path to it, as (end, path), or (None, []) if none of them can be 
+  # reached. Of the ends that are equally close, the first one is taken, 
+  # and the path to it is the one path_finder_v3 gives for that end alone.
+  # To that end, we keep searching until every tile on a shortest path has
+  # its exact distance from <start>. 
+  height = len(maze)
+  width = len(maze[0])
+  passable = get_passability_grid(maze, collision_block_char)
+
+  start_index = start[0] * width + start[1]
+  # <end_orders> maps the index of each end to where it first is in <ends>.
+  end_orders = dict()
+  for order, (i, j) in enumerate(ends): 
+    end_orders.setdefault(i * width + j, order)
+  end_coordinates = [(i, j) for i, j in ends]
+  if not end_coordinates: 
+    return None, []
+
+  def heuristic(index): 
+    i, j = divmod(index, width)
+    return min(abs(i - end_i) + abs(j - end_j) 
+               for end_i, end_j in end_coordinates)
+
+  # <dist> is the distance from <start> of every tile reached so far. 
+  dist = {start_index: 0}
+  heap = [(heuristic(start_index), 0, start_index)]
+  end_dist = None
+  reached_ends = []
+  while heap: 
+    f, k, index = heapq.heappop(heap)
+    if end_dist is not None and f > end_dist: 
+      break
+    if k > dist[index]: 
+      continue
+    if index in end_orders: 
+      if end_dist is None: 
+        end_dist = k
+      reached_ends += [index]
+      continue
+    i, j = divmod(index, width)
+    neighbors = []
+    if i > 0: neighbors += [index - width]
+    if j > 0: neighbors += [index - 1]
+    if i < height - 1: neighbors += [index + width]
+    if j < width - 1: neighbors += [index + 1]
+    for neighbor in neighbors: 
+      if passable[neighbor] and k + 1 < dist.get(neighbor, k + 2): 
+        dist[neighbor] = k + 1
+        heapq.heappush(heap, (k + 1 + heuristic(neighbor), k + 1, neighbor))
+
+  if end_dist is None: 
+    if verbose: 
+      print ("No path from", start, "to any of", ends)
+    return None, []
+
+  end_index = min(reached_ends, key=lambda index: end_orders[index])
+  i, j = divmod(end_index, width)
+  k = end_dist
+  the_path = [(i, j)]
+  while k > 0: 
+    for n_i, n_j in [(i - 1, j), (i, j - 1), (i + 1, j), (i, j + 1)]: 
+      if (0 <= n_i < height and 0 <= n_j < width 
+          and dist.get(n_i * width + n_j) == k - 1): 
+        i, j = n_i, n_j
+        break
+    the_path.append((i, j))
+    k -= 1
+
+  the_path.reverse()
+  return ends[end_orders[end_index]], the_path
+
+
+# 从多个源点出发做一次广度优先搜索，得到迷宫里每个格子到最近源点的距离场。
+def distance_field(maze, sources, collision_block_char): 
+  # <sources> are (row, col) coordinates. The field is a flat array, row 
+  # after row, of the number of steps from each tile to the closest source
+  # that can be walked on, or -1 if there is none that can be reached. 
+  height = len(maze)
+  width = len(maze[0])
+  passable = get_passability_grid(maze, collision_block_char)
+
+  field = array.array("i", [-1]) * (height * width)
+  queue = deque()
+  for i, j in sources: 
+    index = i * width + j
+    if passable[index] and field[index] == -1: 
+      field[index] = 0
+      queue.append(index)
+
+  while queue: 
+    index = queue.popleft()
+    k = field[index] + 1
+    i, j = divmod(index, width)
+    neighbors = []
+    if i > 0: neighbors += [index - width]
+    if j > 0: neighbors += [index - 1]
+    if i < height - 1: neighbors += [index + width]
+    if j < width - 1: neighbors += [index + 1]
+    for neighbor in neighbors: 
+      if passable[neighbor] and field[neighbor] == -1: 
+        field[neighbor] = k
+        queue.append(neighbor)
+  return field
+
+
+# 沿着距离场从起点一路走到最近的源点，得到最短路径。走不到时返回空列表。
+def path_from_distance_field(maze, field, start): 
+  # Same (row, col) coordinates as path_finder_v3. The path starts at 
+  # <start> and ends at the closest source of <field>. 
+  height = len(maze)
+  width = len(maze[0])
+  i, j = start
+  k = field[i * width + j]
+  if k == -1: 
+    return []
+
+  the_path = [(i, j)]
+  while k > 0: 
+    for n_i, n_j in [(i - 1, j), (i, j - 1), (i + 1, j), (i, j + 1)]: 
+      if (0 <= n_i < height and 0 <= n_j < width 
+          and field[n_i * width + n_j] == k - 1): 
+        i, j = n_i, n_j
+        break
+    the_path.append((i, j))
+    k -= 1
+  return the_path
+
+
+# 对外的路径查找接口，输入输出都是 (x, y) 坐标。找不到路径时返回空列表。
 def path_finder(maze, start, end, collision_block_char, verbose=False):
   # EMERGENCY PATCH
   start = (start[1], start[0])
   end = (end[1], end[0])
   # END EMERGENCY PATCH
 
-  path = path_finder_v2(maze, start, end, collision_block_char, verbose)
+  path = path_finder_v3(maze, start, end, collision_block_char, verbose)
 
   new_path = []
   for i in path: 
@@ -185,6 +368,107 @@ def path_finder(maze, start, end, collision_block_char, verbose=False):
   return path
 
 
+# 多目标版本的 path_finder，输入输出都是 (x, y) 坐标：一次搜索找到最近的可达目标及其路径。
+def path_finder_multi(maze, start, ends, collision_block_char, verbose=False):
+  # Returns (end, path) for the closest of <ends> that can be reached (the
+  # first one, if several are as close), or (None, []). <end> is the item 
+  # of <ends> itself. 
+  start = (start[1], start[0])
+  flipped_ends = [(i[1], i[0]) for i in ends]
+
+  end, path = path_finder_v3_multi(maze, start, flipped_ends, 
+                                   collision_block_char, verbose)
+  if end is None: 
+    return None, []
+  end = ends[flipped_ends.index(end)]
+  return end, [(i[1], i[0]) for i in path]
+
+
+
+# 批量查找路径：用 NumPy 同时对所有请求做广度优先的波前扩展，然后逐个回溯出路径。
+def batch_path_finder(maze, requests, collision_block_char, max_tiles=None): 
+  # The batched version of path_finder_multi, in (x, y) coordinates: 
+  # <requests> is a list of (start, ends) pairs, and the result is a list of
+  # the (end, path) pairs that path_finder_multi returns for each of them. 
+  # The wavefronts of all requests are expanded together, one step at a 
+  # time, by shifting boolean masks of the whole maze; a request drops out 
+  # of the batch as soon as its wavefront gets to one of its ends (or can 
+  # not go any further). 
+  # The masks take a few bytes per tile of the maze for each request, so 
+  # with <max_tiles>, the requests are searched for in chunks of no more 
+  # than that many tiles (but at least one request) at a time. 
+  height = len(maze)
+  width = len(maze[0])
+  if max_tiles and len(requests) * height * width > max_tiles: 
+    chunk_size = max(1, max_tiles // (height * width))
+    results = []
+    for i in range(0, len(requests), chunk_size): 
+      results += batch_path_finder(maze, requests[i:i + chunk_size], 
+                                   collision_block_char)
+    return results
+  passable = get_passability_array(maze, collision_block_char)
+
+  results = [(None, [])] * len(requests)
+  # <rows> maps each layer of the arrays below to its request. 
+  rows = np.arange(len(requests))
+  frontier = np.zeros((len(requests), height, width), dtype=bool)
+  goals = np.zeros((len(requests), height, width), dtype=bool)
+  for row, (start, ends) in enumerate(requests): 
+    frontier[row, start[1], start[0]] = True
+    for end in ends: 
+      goals[row, end[1], end[0]] = True
+  visited = frontier.copy()
+  # <dist> is the distance from the start of every tile the wavefront got 
+  # to, -1 for the others. 
+  dist = np.where(frontier, 0, -1).astype(np.int32)
+
+  k = 0
+  while len(rows): 
+    done = (frontier & goals).any(axis=(1, 2))
+    for layer in np.flatnonzero(done): 
+      start, ends = requests[rows[layer]]
+      end = next(end for end in ends if frontier[layer, end[1], end[0]])
+      results[rows[layer]] = (end, _backtrack(dist[layer], end, k))
+    done |= ~frontier.any(axis=(1, 2))
+    if done.any(): 
+      keep = ~done
+      rows, frontier, goals, visited, dist = (rows[keep], frontier[keep], 
+                                              goals[keep], visited[keep], 
+                                              dist[keep])
+      if not len(rows): 
+        break
+
+    step = np.zeros_like(frontier)
+    step[:, 1:, :] |= frontier[:, :-1, :]
+    step[:, :-1, :] |= frontier[:, 1:, :]
+    step[:, :, 1:] |= frontier[:, :, :-1]
+    step[:, :, :-1] |= frontier[:, :, 1:]
+    step &= passable
+    step &= ~visited
+    k += 1
+    visited |= step
+    dist[step] = k
+    frontier = step
+  return results
+
+
+def _backtrack(dist, end, k): 
+  # Walks back from <end> (at distance <k>) to the start over a (row, col) 
+  # array of distances, the same way as path_finder_v3, and returns the 
+  # path in (x, y) coordinates. 
+  height, width = dist.shape
+  i, j = end[1], end[0]
+  the_path = [(j, i)]
+  while k > 0: 
+    for n_i, n_j in [(i - 1, j), (i, j - 1), (i + 1, j), (i, j + 1)]: 
+      if 0 <= n_i < height and 0 <= n_j < width and dist[n_i, n_j] == k - 1: 
+        i, j = n_i, n_j
+        break
+    the_path.append((j, i))
+    k -= 1
+  the_path.reverse()
+  return the_path
+
 
 #  找到距离当前坐标最近的坐标。
 def closest_coordinate(curr_coordinate, target_coordinates): 
@@ -226,9 +510,11 @@ def path_finder_2(maze, start, end, collision_block_char, verbose=False):
     if coordinate[0] >= 0 and coordinate[0] < maze_width and coordinate[1] >= 0 and coordinate[1] < maze_height: 
       target_coordinates += [coordinate]
 
-  target_coordinate = closest_coordinate(start, target_coordinates)
-
-  path = path_finder(maze, start, target_coordinate, collision_block_char, verbose=False)
+  # The closest of them is the one with the shortest path, which we find 
+  # with a single search for all of them. 
+  target_coordinate, path = path_finder_multi(maze, start, target_coordinates,
+                                              collision_block_char, 
+                                              verbose=False)
   return path
 
 
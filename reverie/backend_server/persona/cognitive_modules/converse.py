@@ -18,6 +18,7 @@ from global_methods import *
 from persona.memory_structures.spatial_memory import *
 from persona.memory_structures.associative_memory import *
 from persona.memory_structures.scratch import *
+from persona.cognitive_modules.perceive import generate_poig_scores
 from persona.cognitive_modules.retrieve import *
 from persona.prompt_template.run_gpt_prompt import *
 
@@ -248,8 +249,20 @@ def generate_poig_score(persona, event_type, description):
     return run_gpt_prompt_chat_poignancy(persona, 
                            persona.scratch.act_description)[0]
 
+
 # 加载历史事件，为角色的记忆添加内心想法和关联事件。
 def load_history_via_whisper(personas, whispers):
+  # The whispers to each persona are rated in a single request per persona.
+  persona_whispers = dict()
+  for row in whispers: 
+    persona_whispers.setdefault(row[0], []).append(row[1])
+  whisper_poignancy = dict()
+  for persona_name, curr_whispers in persona_whispers.items(): 
+    scores = generate_poig_scores(personas[persona_name], 
+                                  [("event", i) for i in curr_whispers])
+    for whisper, score in zip(curr_whispers, scores): 
+      whisper_poignancy[(persona_name, whisper)] = score
+
   for count, row in enumerate(whispers): 
     persona = personas[row[0]]
     whisper = row[1]
@@ -260,7 +273,7 @@ def load_history_via_whisper(personas, whispers):
     expiration = persona.scratch.curr_time + datetime.timedelta(days=30)
     s, p, o = generate_action_event_triple(thought, persona)
     keywords = set([s, p, o])
-    thought_poignancy = generate_poig_score(persona, "event", whisper)
+    thought_poignancy = whisper_poignancy[(row[0], whisper)]
     thought_embedding_pair = (thought, get_embedding(thought))
     persona.a_mem.add_thought(created, expiration, s, p, o, 
                               thought, keywords, thought_poignancy, 
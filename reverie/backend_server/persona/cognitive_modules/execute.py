@@ -39,6 +39,44 @@ def execute(persona, maze, personas, plan):
   OUTPUT: 
     execution
   """
+  # If the persona needs a new path, we find the shortest path to one of 
+  # the target tiles. 
+  request = request_path(persona, maze, personas, plan)
+  if request: 
+    curr_tile, target_tiles = request
+    # path_finder_multi takes a collision_mze and the curr_tile coordinate
+    # as an input, and returns the closest of the target tiles that can be
+    # reached, along with a list of coordinate tuples that becomes the 
+    # path ([] if none of them can be reached). 
+    # e.g., [(0, 1), (1, 1), (1, 2), (1, 3), (1, 4)...]
+    closest_target_tile, path = path_finder_multi(maze.collision_maze, 
+                                                  curr_tile, 
+                                                  target_tiles, 
+                                                  collision_block_id)
+    set_planned_path(persona, path)
+
+  return step_on_path(persona, maze)
+
+
+# 执行的第一步：如果角色需要一条新路径，选出它要去的目标格子。能直接得到路径时（距离场、导航器）就直接设置好。
+def request_path(persona, maze, personas, plan): 
+  """
+  Works out where the persona is to walk to for its plan, if it does not 
+  have a path for it yet. When the path can be had without searching the 
+  maze (a distance field or the navigator), it is set right away. 
+  Otherwise, the search is left to the caller, so that the searches of all
+  personas can be done together (see batch_path_finder). 
+
+  INPUT:
+    persona: Current <Persona> instance.  
+    maze: An instance of current <Maze>.
+    personas: A dictionary of all personas in the world. 
+    plan: This is a string address of the action we need to execute 
+          (see execute). 
+  OUTPUT: 
+    None, or the (curr_tile, target_tiles) pair to search a path for. The 
+    path is then set with set_planned_path. 
+  """
   if "<random>" in plan and persona.scratch.planned_path == []: 
     persona.scratch.act_path_set = False
 
@@ -48,6 +86,11 @@ def execute(persona, maze, personas, plan):
     # <target_tiles> is a list of tile coordinates where the persona may go 
     # to execute the current action. The goal is to pick one of them.
     target_tiles = None
+    # <whole_address> is True if all tiles of the target address are 
+    # candidates, and the path is read off the address's distance field 
+    # (see below). 
+    whole_address = False
+    persona.scratch.planned_waypoints = []
 
     print ('aldhfoaf/????')
     print (plan)
@@ -60,21 +103,16 @@ def execute(persona, maze, personas, plan):
                                    persona.scratch.curr_tile, 
                                    target_p_tile, 
                                    collision_block_id)
-      if len(potential_path) <= 2: 
+      if not potential_path: 
+        # The other persona can not be reached, so we stay where we are. 
+        target_tiles = [persona.scratch.curr_tile]
+      elif len(potential_path) <= 2: 
         target_tiles = [potential_path[0]]
       else: 
-        potential_1 = path_finder(maze.collision_maze, 
-                                persona.scratch.curr_tile, 
-                                potential_path[int(len(potential_path)/2)], 
-                                collision_block_id)
-        potential_2 = path_finder(maze.collision_maze, 
-                                persona.scratch.curr_tile, 
-                                potential_path[int(len(potential_path)/2)+1], 
-                                collision_block_id)
-        if len(potential_1) <= len(potential_2): 
-          target_tiles = [potential_path[int(len(potential_path)/2)]]
-        else: 
-          target_tiles = [potential_path[int(len(potential_path)/2+1)]]
+        # Of the two tiles in the middle of the path, we head to the one 
+        # that is closer. <potential_path> is a shortest path, so that is 
+        # the first one, and its distance is its index on the path. 
+        target_tiles = [potential_path[len(potential_path)//2]]
     
     elif "<waiting>" in plan: 
       # Executing interaction where the persona has decided to wait before 
@@ -87,7 +125,7 @@ def execute(persona, maze, personas, plan):
       # Executing a random location action.
       plan = ":".join(plan.split(":")[:-1])
       target_tiles = maze.address_tiles[plan]
-      target_tiles = random.sample(list(target_tiles), 1)
+      target_tiles = persona.rng.sample(list(target_tiles), 1)
 
     else: 
       # This is our default execution. We simply take the persona to the
@@ -99,14 +137,18 @@ def execute(persona, maze, personas, plan):
         maze.address_tiles["Johnson Park:park:park garden"] #ERRORRRRRRR
       else: 
         target_tiles = maze.address_tiles[plan]
+        whole_address = not maze.navigator
 
     # There are sometimes more than one tile returned from this (e.g., a tabe
     # may stretch many coordinates). So, we sample a few here. And from that 
-    # random sample, we will take the closest ones. 
-    if len(target_tiles) < 4: 
-      target_tiles = random.sample(list(target_tiles), len(target_tiles))
+    # random sample, we will take the closest ones. (With the distance field
+    # of the address, we simply take the closest of all of them.) 
+    if whole_address: 
+      target_tiles = list(target_tiles)
+    elif len(target_tiles) < 4: 
+      target_tiles = persona.rng.sample(list(target_tiles), len(target_tiles))
     else:
-      target_tiles = random.sample(list(target_tiles), 4)
+      target_tiles = persona.rng.sample(list(target_tiles), 4)
     # If possible, we want personas to occupy different tiles when they are 
     # headed to the same location on the maze. It is ok if they end up on the 
     # same time, but we try to lower that probability. 
@@ -131,33 +173,82 @@ def execute(persona, maze, personas, plan):
     collision_maze = maze.collision_maze
     closest_target_tile = None
     path = None
-    for i in target_tiles: 
-      # path_finder takes a collision_mze and the curr_tile coordinate as 
-      # an input, and returns a list of coordinate tuples that becomes the
-      # path. 
-      # e.g., [(0, 1), (1, 1), (1, 2), (1, 3), (1, 4)...]
-      curr_path = path_finder(maze.collision_maze, 
-                              curr_tile, 
-                              i, 
-                              collision_block_id)
-      if not closest_target_tile: 
-        closest_target_tile = i
-        path = curr_path
-      elif len(curr_path) < len(path): 
-        closest_target_tile = i
-        path = curr_path
-
-    # Actually setting the <planned_path> and <act_path_set>. We cut the 
-    # first element in the planned_path because it includes the curr_tile. 
-    persona.scratch.planned_path = path[1:]
-    persona.scratch.act_path_set = True
-  
+    # On a map with a navigator, the walk is planned over the doors between 
+    # its arenas. Only the first leg of it is worked out here; the rest is 
+    # worked out below as the persona gets to the end of each leg. 
+    # Otherwise, the path to the closest tile of a plain address is read off
+    # the address's distance field, which the maze keeps for the next 
+    # persona that heads there, instead of searching for each of them. If 
+    # the closest tile is one that was left out above because a persona is 
+    # on it, the other tiles are searched for. (On a map big enough for a 
+    # navigator, those fields would take too much memory.) 
+    # If the navigator finds no route (none of <target_tiles> can be reached
+    # over its graph, or the persona is not on a tile it knows), the path is
+    # searched for on the whole map instead. 
+    route = None
+    if maze.navigator: 
+      route = maze.navigator.find_route(curr_tile, target_tiles)
+    if route and route[0] is not None: 
+      closest_target_tile, waypoints = route
+      path = [curr_tile]
+      if waypoints: 
+        leg, persona.scratch.planned_waypoints = (
+          maze.navigator.extend_path(curr_tile, waypoints[1:]))
+        path += leg
+    elif whole_address: 
+      excluded_tiles = set(maze.address_tiles[plan]) - set(target_tiles)
+      path = maze.get_path_to_address(curr_tile, plan, excluded_tiles)
+    if path: 
+      set_planned_path(persona, path)
+    else: 
+      return curr_tile, target_tiles
+  return None
+
+
+# 设置角色的路径（去掉路径里的当前格子）。
+def set_planned_path(persona, path): 
+  """
+  Sets the path that the persona walks for its current action. 
+
+  INPUT:
+    persona: Current <Persona> instance.  
+    path: a list of tile coordinates that starts with the persona's current
+          tile, or [] if none of the target tiles can be reached. 
+  OUTPUT: 
+    None
+  """
+  # Actually setting the <planned_path> and <act_path_set>. We cut the 
+  # first element in the planned_path because it includes the curr_tile. 
+  # If none of the target tiles can be reached, we stay where we are. 
+  persona.scratch.planned_path = path[1:] if path else []
+  persona.scratch.act_path_set = True
+
+
+# 执行的最后一步：沿着路径走一格，并输出这一步的执行结果。
+def step_on_path(persona, maze): 
+  """
+  Moves the persona one tile along its path. 
+
+  INPUT:
+    persona: Current <Persona> instance.  
+    maze: An instance of current <Maze>.
+  OUTPUT: 
+    execution (see execute)
+  """
   # Setting up the next immediate step. We stay at our curr_tile if there is
   # no <planned_path> left, but otherwise, we go to the next tile in the path.
   ret = persona.scratch.curr_tile
   if persona.scratch.planned_path: 
     ret = persona.scratch.planned_path[0]
     persona.scratch.planned_path = persona.scratch.planned_path[1:]
+  # The next leg of a walk planned by the navigator is worked out as soon as
+  # the last one runs out, so that <planned_path> is only empty once the 
+  # persona gets to its destination. 
+  if (not persona.scratch.planned_path and persona.scratch.planned_waypoints
+      and maze.navigator): 
+    (persona.scratch.planned_path, 
+     persona.scratch.planned_waypoints) = maze.navigator.extend_path(
+                                     ret, persona.scratch.planned_waypoints)
 
   description = f"{persona.scratch.act_description}"
   description += f" @ {persona.scratch.act_address}"
@@ -23,6 +23,156 @@ def generate_poig_score(persona, event_type, description):
                            persona.scratch.act_description)[0]
 
 
+def generate_poig_scores(persona, items): 
+  """
+  The batched version of generate_poig_score. Rates all of <items> (a list 
+  of (event type, description) tuples) that are not idle in a single 
+  request, and returns their poignancy scores in order. 
+  """
+  scores = [1 if "is idle" in description else None 
+            for event_type, description in items]
+  to_rate = [item for item, score in zip(items, scores) if score is None]
+  if to_rate: 
+    rated = iter(run_gpt_prompt_poignancy_batch(persona, to_rate)[0])
+    scores = [next(rated) if score is None else score for score in scores]
+  return scores
+
+
+def perceive_events(persona, maze): 
+  """
+  Returns the events that the persona pays attention to at its current 
+  tile: the <att_bandwidth> closest events within its <vision_r> that take 
+  place in the same arena as the persona. 
+
+  INPUT: 
+    persona: An instance of <Persona> that represents the current persona. 
+    maze: An instance of <Maze> that represents the current maze in which the 
+          persona is acting in. 
+  OUTPUT: 
+    perceived_events: a list of tile events. 
+      e.g., [("double studio:double studio:bedroom 2:bed", None, None, None)]
+  """
+  nearby_tiles = maze.get_nearby_tiles(persona.scratch.curr_tile, 
+                                       persona.scratch.vision_r)
+
+  # We will perceive events that take place in the same arena as the
+  # persona's current arena. 
+  curr_arena_path = maze.get_tile_path(persona.scratch.curr_tile, "arena")
+  # We do not perceive the same event twice (this can happen if an object is
+  # extended across multiple tiles).
+  percept_events_set = set()
+  # We will order our percept based on the distance, with the closest ones
+  # getting priorities. 
+  percept_events_list = []
+  # First, we put all events that are occuring in the nearby tiles into the
+  # percept_events_list
+  for tile in nearby_tiles: 
+    tile_details = maze.access_tile(tile)
+    if tile_details["events"]: 
+      if maze.get_tile_path(tile, "arena") == curr_arena_path:  
+        # This calculates the distance between the persona's current tile, 
+        # and the target tile.
+        dist = math.dist([tile[0], tile[1]], 
+                         [persona.scratch.curr_tile[0], 
+                          persona.scratch.curr_tile[1]])
+        # Add any relevant events to our temp set/list with the distant info. 
+        # The events of a tile are a set, so we sort them to perceive them in
+        # the same order in every run. 
+        for event in sorted(tile_details["events"], key=str): 
+          if event not in percept_events_set: 
+            percept_events_list += [[dist, event]]
+            percept_events_set.add(event)
+
+  # We sort, and perceive only persona.scratch.att_bandwidth of the closest
+  # events. If the bandwidth is larger, then it means the persona can perceive
+  # more elements within a small area. 
+  percept_events_list = sorted(percept_events_list, key=itemgetter(0))
+  perceived_events = []
+  for dist, event in percept_events_list[:persona.scratch.att_bandwidth]: 
+    perceived_events += [event]
+
+  return perceived_events
+
+
+def get_event_description(event): 
+  """
+  Turns a perceived tile event into the triple, the description, and the 
+  text to embed that we store in the associative memory. 
+
+  INPUT: 
+    event: a tile event. e.g., ("Isabella Rodriguez", "is", "sleeping", 
+           "sleeping (resting in her bed)")
+  OUTPUT: 
+    (s, p, o), desc, and the str that is embedded for the event. 
+  """
+  s, p, o, desc = event
+  if not p: 
+    # If the object is not present, then we default the event to "idle".
+    p = "is"
+    o = "idle"
+    desc = "idle"
+  desc = f"{s.split(':')[-1]} is {desc}"
+
+  desc_embedding_in = desc
+  if "(" in desc: 
+    desc_embedding_in = (desc_embedding_in.split("(")[1]
+                                          .split(")")[0]
+                                          .strip())
+  return (s, p, o), desc, desc_embedding_in
+
+
+# 找出 perceive 在这一步中需要计算嵌入的文本，让服务器可以在所有角色移动之前一次性批量计算。
+def get_perceive_embedding_texts(persona, maze): 
+  """
+  Returns the texts that perceive is going to need embeddings for at the 
+  persona's current tile, so that the server can embed those of all 
+  personas in a few batched requests before anyone moves. 
+
+  INPUT: 
+    persona: An instance of <Persona> that represents the current persona. 
+    maze: An instance of <Maze> that represents the current maze in which the 
+          persona is acting in. 
+  OUTPUT: 
+    a list of str. 
+  """
+  texts = []
+  latest_events = persona.a_mem.get_summarized_latest_events(
+                                  persona.scratch.retention)
+  for event in perceive_events(persona, maze): 
+    p_event, desc, desc_embedding_in = get_event_description(event)
+    if p_event in latest_events: 
+      continue
+    if desc_embedding_in not in persona.a_mem.embeddings: 
+      texts += [desc_embedding_in]
+    if p_event[0] == f"{persona.name}" and p_event[1] == "chat with": 
+      if persona.scratch.act_description not in persona.a_mem.embeddings: 
+        texts += [persona.scratch.act_description]
+  return texts
+
+
+# 判断角色在当前位置感知时是否会记下任何新事件，供服务器决定角色这一步能否跳过认知序列。
+def perceives_new_events(persona, maze): 
+  """
+  Returns whether perceive would save any new event at the persona's 
+  current tile. If it would not, and nothing changes around the persona, 
+  perceiving again from the same tile does nothing. 
+
+  INPUT: 
+    persona: An instance of <Persona> that represents the current persona. 
+    maze: An instance of <Maze> that represents the current maze in which the 
+          persona is acting in. 
+  OUTPUT: 
+    Boolean. 
+  """
+  latest_events = persona.a_mem.get_summarized_latest_events(
+                                  persona.scratch.retention)
+  for event in perceive_events(persona, maze): 
+    p_event, desc, desc_embedding_in = get_event_description(event)
+    if p_event not in latest_events: 
+      return True
+  return False
+
+
 # perceive 函数，它是生成代理角色感知周围环境的模块，负责收集角色周围的事件和空间信息，并将这些信息存储到角色的记忆中。
 
 # 函数模拟角色在游戏世界中的感知过程，收集角色在其视野半径内的事件（例如聊天、动作）和空间（如房间、物品），
@@ -73,53 +223,31 @@ def perceive(persona, maze):
                                                              i["game_object"]]
 
   # PERCEIVE EVENTS. 
-  # We will perceive events that take place in the same arena as the
-  # persona's current arena. 
-  curr_arena_path = maze.get_tile_path(persona.scratch.curr_tile, "arena")
-  # We do not perceive the same event twice (this can happen if an object is
-  # extended across multiple tiles).
-  percept_events_set = set()
-  # We will order our percept based on the distance, with the closest ones
-  # getting priorities. 
-  percept_events_list = []
-  # First, we put all events that are occuring in the nearby tiles into the
-  # percept_events_list
-  for tile in nearby_tiles: 
-    tile_details = maze.access_tile(tile)
-    if tile_details["events"]: 
-      if maze.get_tile_path(tile, "arena") == curr_arena_path:  
-        # This calculates the distance between the persona's current tile, 
-        # and the target tile.
-        dist = math.dist([tile[0], tile[1]], 
-                         [persona.scratch.curr_tile[0], 
-                          persona.scratch.curr_tile[1]])
-        # Add any relevant events to our temp set/list with the distant info. 
-        for event in tile_details["events"]: 
-          if event not in percept_events_set: 
-            percept_events_list += [[dist, event]]
-            percept_events_set.add(event)
-
-  # We sort, and perceive only persona.scratch.att_bandwidth of the closest
-  # events. If the bandwidth is larger, then it means the persona can perceive
-  # more elements within a small area. 
-  percept_events_list = sorted(percept_events_list, key=itemgetter(0))
-  perceived_events = []
-  for dist, event in percept_events_list[:persona.scratch.att_bandwidth]: 
-    perceived_events += [event]
+  perceived_events = perceive_events(persona, maze)
+
+  # We rate the poignancy of all the events that are new to the persona 
+  # (and of the persona's own chat, if it is one of them) in one request, 
+  # before storing them below. 
+  latest_events = persona.a_mem.get_summarized_latest_events(
+                                  persona.scratch.retention)
+  poig_items = []
+  for p_event in perceived_events: 
+    p_event, desc, desc_embedding_in = get_event_description(p_event)
+    if p_event not in latest_events: 
+      poig_items += [("event", desc_embedding_in)]
+      if p_event[0] == f"{persona.name}" and p_event[1] == "chat with": 
+        poig_items += [("chat", persona.scratch.act_description)]
+  poig_items = list(dict.fromkeys(poig_items))
+  poig_scores = dict(zip(poig_items, 
+                         generate_poig_scores(persona, poig_items)))
 
   # Storing events. 
   # <ret_events> is a list of <ConceptNode> instances from the persona's 
   # associative memory. 
   ret_events = []
   for p_event in perceived_events: 
-    s, p, o, desc = p_event
-    if not p: 
-      # If the object is not present, then we default the event to "idle".
-      p = "is"
-      o = "idle"
-      desc = "idle"
-    desc = f"{s.split(':')[-1]} is {desc}"
-    p_event = (s, p, o)
+    p_event, desc, desc_embedding_in = get_event_description(p_event)
+    s, p, o = p_event
 
     # We retrieve the latest persona.scratch.retention events. If there is  
     # something new that is happening (that is, p_event not in latest_events),
@@ -138,11 +266,6 @@ def perceive(persona, maze):
       keywords.update([sub, obj])
 
       # Get event embedding
-      desc_embedding_in = desc
-      if "(" in desc: 
-        desc_embedding_in = (desc_embedding_in.split("(")[1]
-                                              .split(")")[0]
-                                              .strip())
       if desc_embedding_in in persona.a_mem.embeddings: 
         event_embedding = persona.a_mem.embeddings[desc_embedding_in]
       else: 
@@ -150,9 +273,11 @@ def perceive(persona, maze):
       event_embedding_pair = (desc_embedding_in, event_embedding)
       
       # Get event poignancy. 
-      event_poignancy = generate_poig_score(persona, 
-                                            "event", 
-                                            desc_embedding_in)
+      event_poignancy = poig_scores.get(("event", desc_embedding_in))
+      if event_poignancy is None: 
+        event_poignancy = generate_poig_score(persona, 
+                                              "event", 
+                                              desc_embedding_in)
 
       # If we observe the persona's self chat, we include that in the memory
       # of the persona here. 
@@ -167,8 +292,11 @@ def perceive(persona, maze):
                                                 .act_description)
         chat_embedding_pair = (persona.scratch.act_description, 
                                chat_embedding)
-        chat_poignancy = generate_poig_score(persona, "chat", 
-                                             persona.scratch.act_description)
+        chat_poignancy = poig_scores.get(("chat", 
+                                          persona.scratch.act_description))
+        if chat_poignancy is None: 
+          chat_poignancy = generate_poig_score(persona, "chat", 
+                                              persona.scratch.act_description)
         chat_node = persona.a_mem.add_chat(persona.scratch.curr_time, None,
                       curr_event[0], curr_event[1], curr_event[2], 
                       persona.scratch.act_description, keywords, 
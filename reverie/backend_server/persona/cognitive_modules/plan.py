@@ -9,6 +9,7 @@ Description: This defines the "Plan" module for generative agents.
 该文件是生成代理角色中用于计划和行动决策的核心模块。它通过生成日常计划、分解任务、执行行动以及处理事件反应来管理角色的行为。
 角色的行动和反应都是基于其感知、记忆和当前的状态来决定的，使得角色能够在复杂的环境中表现出智能化的行为。
 """
+import collections
 import datetime
 import math
 import random 
@@ -18,8 +19,10 @@ sys.path.append('../../')
 
 from global_methods import *
 from persona.prompt_template.run_gpt_prompt import *
+from persona.cognitive_modules.perceive import *
 from persona.cognitive_modules.retrieve import *
 from persona.cognitive_modules.converse import *
+from persona.cognitive_modules.task_graph import *
 
 ##############################################################################
 # CHAPTER 2: Generate
@@ -103,17 +106,39 @@ def generate_hourly_schedule(persona, wake_up_hour):
               "08:00 PM", "09:00 PM", "10:00 PM", "11:00 PM"]
   n_m1_activity = []
   diversity_repeat_count = 3
-  for i in range(diversity_repeat_count): 
-    n_m1_activity_set = set(n_m1_activity)
-    if len(n_m1_activity_set) < 5: 
-      n_m1_activity = []
-      for count, curr_hour_str in enumerate(hour_str): 
-        if wake_up_hour > 0: 
-          n_m1_activity += ["sleeping"]
-          wake_up_hour -= 1
-        else: 
-          n_m1_activity += [run_gpt_prompt_generate_hourly_schedule(
-                          persona, curr_hour_str, n_m1_activity, hour_str)[0]]
+  if one_shot_hourly_schedule: 
+    # The whole day is generated in a single request. If it is not diverse 
+    # enough, only the hours of its most repeated activity are generated 
+    # again (one hour at a time, following the hours before them), rather 
+    # than the whole day. 
+    sleeping_hours = max(0, min(len(hour_str), wake_up_hour))
+    waking_activity = generate_full_hourly_schedule(
+                        persona, hour_str[sleeping_hours:])
+    if waking_activity: 
+      n_m1_activity = ["sleeping"] * sleeping_hours + waking_activity
+      for i in range(diversity_repeat_count - 1): 
+        if len(set(n_m1_activity)) >= 5: 
+          break
+        waking_activity = n_m1_activity[sleeping_hours:]
+        most_repeated = collections.Counter(waking_activity).most_common(1)
+        first = n_m1_activity.index(most_repeated[0][0], sleeping_hours)
+        for count in range(first + 1, len(hour_str)): 
+          if n_m1_activity[count] == most_repeated[0][0]: 
+            n_m1_activity[count] = run_gpt_prompt_generate_hourly_schedule(
+                persona, hour_str[count], n_m1_activity[:count], hour_str)[0]
+
+  if not n_m1_activity: 
+    for i in range(diversity_repeat_count): 
+      n_m1_activity_set = set(n_m1_activity)
+      if len(n_m1_activity_set) < 5: 
+        n_m1_activity = []
+        for count, curr_hour_str in enumerate(hour_str): 
+          if wake_up_hour > 0: 
+            n_m1_activity += ["sleeping"]
+            wake_up_hour -= 1
+          else: 
+            n_m1_activity += [run_gpt_prompt_generate_hourly_schedule(
+                            persona, curr_hour_str, n_m1_activity, hour_str)[0]]
   
   # Step 1. Compressing the hourly schedule to the following format: 
   # The integer indicates the number of hours. They should add up to 24. 
@@ -144,6 +169,28 @@ def generate_hourly_schedule(persona, wake_up_hour):
 
   return n_m1_hourly_compressed
 
+def generate_full_hourly_schedule(persona, waking_hour_str): 
+  """
+  Generates the activities of all the waking hours of the persona in a 
+  single request (see generate_hourly_schedule). 
+
+  Persona state: identity stable set, daily_plan
+
+  INPUT: 
+    persona: The Persona class instance 
+    waking_hour_str: the list of the hours the persona is awake for. 
+  OUTPUT: 
+    a list of activities, one for each waking hour, or False if the request
+    did not give a valid schedule. 
+  EXAMPLE OUTPUT: 
+    ['waking up and starting her morning routine', 'eating breakfast',..
+  """
+  if debug: print ("GNS FUNCTION: <generate_full_hourly_schedule>")
+  if not waking_hour_str: 
+    return []
+  return run_gpt_prompt_generate_full_hourly_schedule(persona, 
+                                                      waking_hour_str)[0]
+
 # 将较大的任务（例如“完成晨间例行活动”）分解为多个小任务，并为每个小任务指定时长。
 def generate_task_decomp(persona, task, duration): 
   """
@@ -281,6 +328,24 @@ def generate_act_obj_event_triple(act_game_object, act_obj_desc, persona):
   return run_gpt_prompt_act_obj_event_triple(act_game_object, act_obj_desc, persona)[0]
 
 
+def generate_action_details(act_desp, persona, maze): 
+  """
+  Resolves the address, emoji and event triple of a new action, and the 
+  state, emoji and event triple of its game object, in one request (see 
+  run_gpt_prompt_action_details). 
+
+  INPUT: 
+    act_desp: the description of the action (e.g., "sleeping")
+    persona: The Persona class instance
+    maze: Current <Maze> instance. 
+  OUTPUT: 
+    a dictionary of the resolved details, or False if they could not be 
+    resolved in one request. 
+  """
+  if debug: print ("GNS FUNCTION: <generate_action_details>")
+  return run_gpt_prompt_action_details(act_desp, persona, maze)[0]
+
+
 def generate_convo(maze, init_persona, target_persona): 
   curr_loc = maze.access_tile(init_persona.scratch.curr_tile)
 
@@ -529,6 +594,133 @@ def _long_term_planning(persona, new_day):
 
 
 
+# 为一个行动找到目标地点，并生成行动及其物体状态的表情和事件三元组。
+def resolve_action_details(act_desp, persona, maze): 
+  """
+  Finds the target location of an action, and creates the action-related 
+  variables: its emoji and event triple, and the state of the game object it
+  uses with that state's emoji and event triple. 
+
+  With <combined_action_resolution>, we first try to get all of them in a 
+  single request, and only go through the chain of requests below if that 
+  does not give us a valid address. 
+
+  INPUT: 
+    act_desp: the description of the action (e.g., "sleeping")
+    persona: The Persona class instance 
+    maze: The Maze class of the current world. 
+  OUTPUT: 
+    a dictionary in the form of the output of generate_action_details. 
+  """
+  if combined_action_resolution: 
+    action_details = generate_action_details(act_desp, persona, maze)
+    if action_details: 
+      return action_details
+
+  # The requests of the chain form a dependency graph: the emoji and the
+  # event triple of the action only need the action description, so they
+  # are sent alongside the sector -> arena -> game object chain, and the 
+  # emoji and event triple of the object state go out together once its 
+  # description is back. 
+  act_world = maze.access_tile(persona.scratch.curr_tile)["world"]
+
+  def get_act_address(): 
+    # act_sector = maze.access_tile(persona.scratch.curr_tile)["sector"]
+    act_sector = generate_action_sector(act_desp, persona, maze)
+    act_arena = generate_action_arena(act_desp, persona, maze, act_world, 
+                                      act_sector)
+    act_address = f"{act_world}:{act_sector}:{act_arena}"
+    act_game_object = generate_action_game_object(act_desp, act_address,
+                                                  persona, maze)
+    return f"{act_address}:{act_game_object}"
+
+  tasks = {
+    "address": (get_act_address, []), 
+    "pronunciatio": (lambda: generate_action_pronunciatio(act_desp, persona), 
+                     []),
+    "event": (lambda: generate_action_event_triple(act_desp, persona), []),
+    # Persona's actions also influence the object states. We set those up 
+    # here. 
+    "obj_desc": (lambda address: generate_act_obj_desc(
+                   address.split(":")[-1], act_desp, persona), 
+                 ["address"]),
+    "obj_pronunciatio": (lambda obj_desc: generate_action_pronunciatio(
+                           obj_desc, persona), 
+                         ["obj_desc"]),
+    "obj_event": (lambda address, obj_desc: generate_act_obj_event_triple(
+                    address.split(":")[-1], obj_desc, persona), 
+                  ["address", "obj_desc"])}
+  return run_task_graph(tasks, parallel_action_prompts, task_graph_workers)
+
+
+class SpeculativePersona: 
+  def __init__(self, persona, curr_tile, curr_time): 
+    # A stand-in for <persona> as it will be at <curr_time> on <curr_tile>. 
+    # Its scratch is a snapshot (see Scratch.get_snapshot), so that nothing 
+    # of the persona changes, and the persona can keep changing while the 
+    # stand-in is used. Its memories are shared, and are only read. Its 
+    # random choices come from its own source, so that the persona's choices
+    # are not disturbed. 
+    # Note: it has to be made while nothing else changes the persona. 
+    self.name = persona.name
+    self.scratch = persona.scratch.get_snapshot()
+    # <prev_time> is the time of the persona when the stand-in was made. 
+    self.prev_time = persona.scratch.curr_time
+    self.scratch.curr_tile = curr_tile
+    self.scratch.curr_time = curr_time
+    self.s_mem = persona.s_mem
+    self.a_mem = persona.a_mem
+    self.rng = random.Random(f"{persona.name}:{curr_time}")
+
+
+# 在前端处理上一步时，预先为下一步即将结束当前行动的角色决定下一个行动的细节。
+def speculate_action(speculative_persona, maze): 
+  """
+  Works out ahead of time what the persona will need at the time and on the
+  tile of its <SpeculativePersona>. The embeddings of the events it will 
+  perceive there are fetched, and if its current action ends at that time, 
+  the details of its next action are resolved (see resolve_action_details). 
+
+  This only reads the persona's memories, which are shared with the 
+  stand-in, and can run while the persona moves on. 
+
+  INPUT: 
+    speculative_persona: The SpeculativePersona class instance of the 
+                         persona, made for the step to speculate on. 
+    maze: The Maze class of the current world. 
+  OUTPUT: 
+    None if there is no next action to resolve. Otherwise, a dictionary of 
+    the predicted action description ("act_desp"), the tile it was resolved 
+    from ("tile"), and its details ("details"). 
+  """
+  texts = get_perceive_embedding_texts(speculative_persona, maze)
+  if texts: 
+    get_embeddings(texts)
+
+  # A new day starts with long term planning, and a conversation ends with a
+  # reaction to it, so we only speculate on plain actions that end within 
+  # the same day. 
+  scratch = speculative_persona.scratch
+  if (not speculative_persona.prev_time 
+      or speculative_persona.prev_time.date() != scratch.curr_time.date()
+      or scratch.chatting_with
+      or not scratch.act_check_finished()): 
+    return None
+  curr_index = scratch.get_f_daily_schedule_index()
+  if curr_index >= len(scratch.f_daily_schedule): 
+    return None
+  act_desp, act_dura = scratch.f_daily_schedule[curr_index]
+  # Actions of an hour or more are usually decomposed before they start, so
+  # the action would not be the one we predicted. 
+  if act_dura >= 60: 
+    return None
+
+  return {"act_desp": act_desp, 
+          "tile": scratch.curr_tile, 
+          "details": resolve_action_details(act_desp, speculative_persona, 
+                                            maze)}
+
+
 # 根据当前的时间和已分解的每日计划，决定角色的下一个行动。比如，角色是继续执行之前的任务，还是开始新的任务。
 # 如果一个任务持续时间过长，系统会将其分解为多个子任务（例如，将“睡觉”分解为“上床睡觉”和“进入深度睡眠”）。
 def _determine_action(persona, maze): 
@@ -633,22 +825,25 @@ def _determine_action(persona, maze):
 
 
   # Finding the target location of the action and creating action-related
-  # variables.
-  act_world = maze.access_tile(persona.scratch.curr_tile)["world"]
-  # act_sector = maze.access_tile(persona.scratch.curr_tile)["sector"]
-  act_sector = generate_action_sector(act_desp, persona, maze)
-  act_arena = generate_action_arena(act_desp, persona, maze, act_world, act_sector)
-  act_address = f"{act_world}:{act_sector}:{act_arena}"
-  act_game_object = generate_action_game_object(act_desp, act_address,
-                                                persona, maze)
-  new_address = f"{act_world}:{act_sector}:{act_arena}:{act_game_object}"
-  act_pron = generate_action_pronunciatio(act_desp, persona)
-  act_event = generate_action_event_triple(act_desp, persona)
-  # Persona's actions also influence the object states. We set those up here. 
-  act_obj_desp = generate_act_obj_desc(act_game_object, act_desp, persona)
-  act_obj_pron = generate_action_pronunciatio(act_obj_desp, persona)
-  act_obj_event = generate_act_obj_event_triple(act_game_object, 
-                                                act_obj_desp, persona)
+  # variables. In a pipelined run, these may already have been worked out 
+  # while the frontend was busy with the previous step (see 
+  # speculate_action). We only use them if the persona is about to do the 
+  # action that was predicted, from the tile that was predicted. 
+  action_details = None
+  speculated = persona.speculated_action
+  persona.speculated_action = None
+  if (speculated and speculated["act_desp"] == act_desp 
+      and speculated["tile"] == persona.scratch.curr_tile): 
+    action_details = speculated["details"]
+  if not action_details: 
+    action_details = resolve_action_details(act_desp, persona, maze)
+
+  new_address = action_details["address"]
+  act_pron = action_details["pronunciatio"]
+  act_event = action_details["event"]
+  act_obj_desp = action_details["obj_desc"]
+  act_obj_pron = action_details["obj_pronunciatio"]
+  act_obj_event = action_details["obj_event"]
 
   # Adding the action to persona's queue. 
   persona.scratch.add_new_action(new_address, 
@@ -699,7 +894,7 @@ def _choose_retrieved(persona, retrieved):
         and curr_event.subject != persona.name): 
       priority += [rel_ctx]
   if priority: 
-    return random.choice(priority)
+    return persona.rng.choice(priority)
 
   # Skip idle. 
   for event_desc, rel_ctx in retrieved.items(): 
@@ -707,7 +902,7 @@ def _choose_retrieved(persona, retrieved):
     if "is idle" not in event_desc: 
       priority += [rel_ctx]
   if priority: 
-    return random.choice(priority)
+    return persona.rng.choice(priority)
   return None
 
 
@@ -889,6 +1084,41 @@ def _chat_react(maze, persona, focused_event, reaction_mode, personas):
   inserted_act = convo_summary
   inserted_act_dur = duration_min
 
+  # When the personas are stepped concurrently, the target persona may be in
+  # the middle of its own move. So rather than writing to it here, we queue 
+  # the reaction and let the server commit it at the end of the step. 
+  if init_persona.pending_reacts is not None: 
+    init_persona.pending_reacts += [[target_persona.name, convo, 
+                                     inserted_act, inserted_act_dur]]
+    return
+
+  commit_chat_react(init_persona, target_persona, convo, 
+                    inserted_act, inserted_act_dur)
+
+
+# 将对话的结果写入对话双方的日程中。并发模式下由服务器在每一步结束时按固定顺序调用。
+def commit_chat_react(init_persona, target_persona, convo, 
+                      inserted_act, inserted_act_dur): 
+  """
+  Writes a generated conversation into the schedules of both the initiating
+  and the target persona. 
+
+  INPUT: 
+    init_persona: The <Persona> who started the conversation. 
+    target_persona: The <Persona> who was approached. 
+    convo: The conversation as a list of [speaker, utterance] pairs. 
+    inserted_act: The summary of the conversation. 
+    inserted_act_dur: The duration of the conversation in minutes. 
+  OUTPUT: 
+    True if the conversation was committed, False if one of the two personas
+    has started another conversation in the meantime. 
+  """
+  # A reaction that was queued during a concurrent step can lose to another
+  # conversation that was committed before it in the same step. 
+  if (target_persona.scratch.chatting_with 
+      or init_persona.scratch.chatting_with): 
+    return False
+
   act_start_time = target_persona.scratch.act_start_time
 
   curr_time = target_persona.scratch.curr_time
@@ -921,6 +1151,7 @@ def _chat_react(maze, persona, focused_event, reaction_mode, personas):
       act_address, act_event, chatting_with, convo, chatting_with_buffer, chatting_end_time,
       act_pronunciatio, act_obj_description, act_obj_pronunciatio, 
       act_obj_event, act_start_time)
+  return True
 
 
 
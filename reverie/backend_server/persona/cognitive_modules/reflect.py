@@ -22,7 +22,9 @@ from numpy.linalg import norm
 from global_methods import *
 from persona.prompt_template.run_gpt_prompt import *
 from persona.prompt_template.gpt_structure import *
+from persona.cognitive_modules.perceive import generate_poig_scores
 from persona.cognitive_modules.retrieve import *
+from persona.cognitive_modules.task_graph import *
 
 # 通过角色的记忆检索最近重要的事件，并生成反思焦点（角色最近经历的关键事件，反映出对她产生影响的事物。）。
 # 这些焦点是角色接下来要深度反思的事件或想法。
@@ -95,7 +97,6 @@ def generate_poig_score(persona, event_type, description):
                            persona.scratch.act_description)[0]
 
 
-
 # 这两个函数是：当角色经历了对话后，系统会生成角色对该对话的反思想法和备忘录。这是角色对其与其他角色之间对话的总结和对未来行动的计划。
 def generate_planning_thought_on_convo(persona, all_utt):
   if debug: print ("GNS FUNCTION: <generate_planning_thought_on_convo>")
@@ -110,15 +111,17 @@ def generate_memo_on_convo(persona, all_utt):
 
 # 当反思被触发时，系统会生成反思的焦点、检索相关的记忆，并生成新的洞察。然后这些洞察会被存储到角色的长期记忆中，
 # 作为未来决策的参考。
-def run_reflect(persona):
+def generate_reflection(persona): 
   """
-  Run the actual reflection. We generate the focal points, retrieve any 
-  relevant nodes, and generate thoughts and insights. 
+  Generates the thoughts of a reflection, without adding them to the 
+  persona's memory. We generate the focal points, retrieve any relevant 
+  nodes, and generate thoughts and insights. 
 
   INPUT: 
-    persona: Current Persona object
+    persona: Current Persona object (or a ReflectionSnapshot of it)
   Output: 
-    None
+    a list of the arguments of AssociativeMemory.add_thought, one for each 
+    thought. 
   """
   # Reflection requires certain focal points. Generate that first. 
   focal_points = generate_focal_points(persona, 3)
@@ -126,24 +129,94 @@ def run_reflect(persona):
   # <retrieved> has keys of focal points, and values of the associated Nodes. 
   retrieved = new_retrieve(persona, focal_points)
 
-  # For each of the focal points, generate thoughts and save it in the 
-  # agent's memory. 
+  # For each of the focal points, generate thoughts. 
+  new_thoughts = []
   for focal_pt, nodes in retrieved.items(): 
     xx = [i.embedding_key for i in nodes]
     for xxx in xx: print (xxx)
 
     thoughts = generate_insights_and_evidence(persona, nodes, 5)
-    for thought, evidence in thoughts.items(): 
+    thought_poignancies = generate_poig_scores(persona, 
+                            [("thought", i) for i in thoughts])
+    for count, (thought, evidence) in enumerate(thoughts.items()): 
       created = persona.scratch.curr_time
       expiration = persona.scratch.curr_time + datetime.timedelta(days=30)
       s, p, o = generate_action_event_triple(thought, persona)
       keywords = set([s, p, o])
-      thought_poignancy = generate_poig_score(persona, "thought", thought)
+      thought_poignancy = thought_poignancies[count]
       thought_embedding_pair = (thought, get_embedding(thought))
 
-      persona.a_mem.add_thought(created, expiration, s, p, o, 
-                                thought, keywords, thought_poignancy, 
-                                thought_embedding_pair, evidence)
+      new_thoughts += [(created, expiration, s, p, o, 
+                        thought, keywords, thought_poignancy, 
+                        thought_embedding_pair, evidence)]
+  return new_thoughts
+
+
+def run_reflect(persona):
+  """
+  Run the actual reflection, and save the thoughts and insights it generates
+  in the agent's memory. 
+
+  INPUT: 
+    persona: Current Persona object
+  Output: 
+    None
+  """
+  for thought in generate_reflection(persona): 
+    persona.a_mem.add_thought(*thought)
+
+
+class ReflectionSnapshot: 
+  def __init__(self, persona): 
+    # Everything of the persona that a reflection reads, copied so that the
+    # reflection can run in the background while the persona keeps moving. 
+    self.name = persona.name
+    self.scratch = persona.scratch.get_snapshot()
+    self.a_mem = persona.a_mem.get_snapshot()
+
+
+def start_background_reflection(persona): 
+  """
+  Starts a reflection on a snapshot of the persona, on a background thread. 
+  Its thoughts are added to the persona's memory by 
+  merge_background_reflection once it is done. 
+
+  INPUT: 
+    persona: Current Persona object
+  Output: 
+    None
+  """
+  snapshot = ReflectionSnapshot(persona)
+  future = run_in_background(generate_reflection, snapshot, 
+                             max_workers=task_graph_workers)
+  persona.pending_reflection = (snapshot, future)
+
+
+def merge_background_reflection(persona, wait=False): 
+  """
+  Adds the thoughts of the persona's background reflection to its memory, if
+  the reflection is done. The nodes that the reflection retrieved from its 
+  snapshot are marked as accessed in the persona's memory too. 
+
+  INPUT: 
+    persona: Current Persona object
+    wait: whether to wait for the reflection if it is not done yet. 
+  Output: 
+    None
+  """
+  if not persona.pending_reflection: 
+    return
+  snapshot, future = persona.pending_reflection
+  if not wait and not future.done(): 
+    return
+  persona.pending_reflection = None
+
+  for thought in future.result(): 
+    persona.a_mem.add_thought(*thought)
+  for node_id, node in snapshot.a_mem.id_to_node.items(): 
+    curr_node = persona.a_mem.id_to_node[node_id]
+    if node.last_accessed > curr_node.last_accessed: 
+      curr_node.last_accessed = node.last_accessed
 
 
 # 确定是否需要触发反思。当角色经历了足够多的重要事件或想法后，系统会触发反思流程。
@@ -198,7 +271,14 @@ def reflect(persona):
   Output: 
     None
   """
-  if reflection_trigger(persona): 
+  if background_reflection: 
+    # The thoughts of a background reflection are merged at the first step 
+    # after it is done, and no new reflection starts while one is running. 
+    merge_background_reflection(persona)
+    if reflection_trigger(persona) and not persona.pending_reflection: 
+      start_background_reflection(persona)
+      reset_reflection_counter(persona)
+  elif reflection_trigger(persona): 
     run_reflect(persona)
     reset_reflection_counter(persona)
 
@@ -234,11 +314,18 @@ def reflect(persona):
       planning_thought = generate_planning_thought_on_convo(persona, all_utt)
       planning_thought = f"For {persona.scratch.name}'s planning: {planning_thought}"
 
+      memo_thought = generate_memo_on_convo(persona, all_utt)
+      memo_thought = f"{persona.scratch.name} {memo_thought}"
+
+      # Both thoughts are rated in a single request. 
+      planning_poignancy, memo_poignancy = generate_poig_scores(persona, 
+        [("thought", planning_thought), ("thought", memo_thought)])
+
       created = persona.scratch.curr_time
       expiration = persona.scratch.curr_time + datetime.timedelta(days=30)
       s, p, o = generate_action_event_triple(planning_thought, persona)
       keywords = set([s, p, o])
-      thought_poignancy = generate_poig_score(persona, "thought", planning_thought)
+      thought_poignancy = planning_poignancy
       thought_embedding_pair = (planning_thought, get_embedding(planning_thought))
 
       persona.a_mem.add_thought(created, expiration, s, p, o, 
@@ -247,14 +334,11 @@ def reflect(persona):
 
 
 
-      memo_thought = generate_memo_on_convo(persona, all_utt)
-      memo_thought = f"{persona.scratch.name} {memo_thought}"
-
       created = persona.scratch.curr_time
       expiration = persona.scratch.curr_time + datetime.timedelta(days=30)
       s, p, o = generate_action_event_triple(memo_thought, persona)
       keywords = set([s, p, o])
-      thought_poignancy = generate_poig_score(persona, "thought", memo_thought)
+      thought_poignancy = memo_poignancy
       thought_embedding_pair = (memo_thought, get_embedding(memo_thought))
 
       persona.a_mem.add_thought(created, expiration, s, p, o, 
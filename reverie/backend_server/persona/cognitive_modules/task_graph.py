@@ -0,0 +1,93 @@
+"""
+File: task_graph.py
+Description: A small executor for graphs of dependent prompts in the
+cognitive modules. Prompts that do not depend on each other's results are
+sent at the same time, so that a group of prompts costs about the latency of
+its longest chain of dependent prompts instead of the sum of all of them.
+"""
+import threading
+
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+# The thread pool that the tasks run on. It is shared by every graph of the
+# process (and so by every persona), and created on first use.
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor(max_workers):
+  global _executor
+  with _executor_lock:
+    if not _executor:
+      _executor = ThreadPoolExecutor(max_workers=max_workers,
+                                     thread_name_prefix="task-graph")
+  return _executor
+
+
+def run_task_graph(tasks, parallel=True, max_workers=32):
+  """
+  Runs every task of a dependency graph, each as soon as the tasks it depends
+  on are done, and returns their results. A task must not depend on itself
+  (or on any task that depends on it).
+
+  INPUT:
+    tasks: a dictionary that maps the name of each task to a (function,
+           dependencies) tuple, where dependencies is a list of the names of
+           other tasks. The function is called with the results of its
+           dependencies, in that order.
+           e.g., {"desc": (lambda: "being used", []),
+                  "emoji": (lambda desc: "🙂", ["desc"])}
+    parallel: False runs the tasks one at a time, in the calling thread.
+    max_workers: the size of the thread pool that the tasks run on.
+  OUTPUT:
+    a dictionary that maps the name of each task to its result.
+  """
+  results = dict()
+
+  def get_ready(pending):
+    return [name for name in pending
+            if all(i in results for i in tasks[name][1])]
+
+  def run(name):
+    function, dependencies = tasks[name]
+    return function(*[results[i] for i in dependencies])
+
+  pending = list(tasks)
+  if not parallel:
+    while pending:
+      ready = get_ready(pending)
+      if not ready:
+        raise ValueError(f"The tasks {pending} depend on each other.")
+      results[ready[0]] = run(ready[0])
+      pending.remove(ready[0])
+    return results
+
+  executor = _get_executor(max_workers)
+  running = dict()
+  while pending or running:
+    for name in get_ready(pending):
+      running[executor.submit(run, name)] = name
+      pending.remove(name)
+    if not running:
+      raise ValueError(f"The tasks {pending} depend on each other.")
+    done, _ = wait(running, return_when=FIRST_COMPLETED)
+    for future in done:
+      # A failed task fails the whole graph, as it would have if the tasks
+      # had been run one after another.
+      results[running.pop(future)] = future.result()
+  return results
+
+
+def run_in_background(function, *args, max_workers=32):
+  """
+  Runs function(*args) on the thread pool of the task graphs, without 
+  waiting for it. 
+
+  INPUT:
+    function: the function to run.
+    args: its arguments.
+    max_workers: the size of the thread pool (if it is not created yet).
+  OUTPUT:
+    a concurrent.futures.Future of its result.
+  """
+  return _get_executor(max_workers).submit(function, *args)
@@ -10,6 +10,7 @@ agents paper.
 import sys
 sys.path.append('../../')
 
+import copy
 import json
 import datetime
 
@@ -162,6 +163,38 @@ class AssociativeMemory:
       json.dump(self.embeddings, outfile)
 
 
+  def get_snapshot(self): 
+    """
+    Returns a copy of the memory that can be read (e.g., by a reflection 
+    running in the background) while this one keeps changing. The nodes are
+    copied too, so that retrieving from the snapshot does not change the 
+    <last_accessed> of the nodes here. The embeddings are shared, since they
+    are never changed once added. 
+
+    INPUT: 
+      None
+    OUTPUT: 
+      an AssociativeMemory. 
+    """
+    snapshot = AssociativeMemory.__new__(AssociativeMemory)
+    snapshot.id_to_node = {node_id: copy.copy(node) 
+                           for node_id, node in self.id_to_node.items()}
+    nodes = snapshot.id_to_node
+    snapshot.seq_event = [nodes[i.node_id] for i in self.seq_event]
+    snapshot.seq_thought = [nodes[i.node_id] for i in self.seq_thought]
+    snapshot.seq_chat = [nodes[i.node_id] for i in self.seq_chat]
+    snapshot.kw_to_event = {kw: [nodes[i.node_id] for i in v] 
+                            for kw, v in self.kw_to_event.items()}
+    snapshot.kw_to_thought = {kw: [nodes[i.node_id] for i in v] 
+                              for kw, v in self.kw_to_thought.items()}
+    snapshot.kw_to_chat = {kw: [nodes[i.node_id] for i in v] 
+                           for kw, v in self.kw_to_chat.items()}
+    snapshot.kw_strength_event = dict(self.kw_strength_event)
+    snapshot.kw_strength_thought = dict(self.kw_strength_thought)
+    snapshot.embeddings = dict(self.embeddings)
+    return snapshot
+
+
   def add_event(self, created, expiration, s, p, o, 
                       description, keywords, poignancy, 
                       embedding_pair, filling):
@@ -322,7 +355,10 @@ class AssociativeMemory:
       if i in self.kw_to_thought: 
         ret += self.kw_to_thought[i.lower()]
 
-    ret = set(ret)
+    # The nodes are returned from the most to the least recent, each of them
+    # once. (The order of a set of nodes depends on where they are in memory,
+    # and it ends up in the prompts, so it would make seeded runs differ.)
+    ret = sorted(set(ret), key=lambda node: node.node_count, reverse=True)
     return ret
 
 
@@ -334,7 +370,10 @@ class AssociativeMemory:
       if i in self.kw_to_event: 
         ret += self.kw_to_event[i]
 
-    ret = set(ret)
+    # The nodes are returned from the most to the least recent, each of them
+    # once. (The order of a set of nodes depends on where they are in memory,
+    # and it ends up in the prompts, so it would make seeded runs differ.)
+    ret = sorted(set(ret), key=lambda node: node.node_count, reverse=True)
     return ret
 
 
@@ -4,6 +4,7 @@ Author: Joon Sung Park (joonspk@stanford.edu)
 File: scratch.py
 Description: Defines the short-term memory module for generative agents.
 """
+import copy
 import datetime
 import json
 import sys
@@ -183,6 +184,10 @@ class Scratch:
     # destination tile. 
     # e.g., [(50, 10), (49, 10), (48, 10), ...]
     self.planned_path = []
+    # <planned_waypoints> are the waypoints of the walk that are still ahead
+    # of <planned_path>, when the walk is planned by the maze's navigator. 
+    # <planned_path> is then only worked out up to the next of them. 
+    self.planned_waypoints = []
 
     if check_if_file_exists(f_saved): 
       # If we have a bootstrap file, load that here. 
@@ -260,6 +265,7 @@ class Scratch:
 
       self.act_path_set = scratch_load["act_path_set"]
       self.planned_path = scratch_load["planned_path"]
+      self.planned_waypoints = scratch_load.get("planned_waypoints", [])
 
 
   def save(self, out_json):
@@ -333,10 +339,32 @@ class Scratch:
 
     scratch["act_path_set"] = self.act_path_set
     scratch["planned_path"] = self.planned_path
+    scratch["planned_waypoints"] = self.planned_waypoints
 
     with open(out_json, "w") as outfile:
       json.dump(scratch, outfile, indent=2) 
 
+# 返回短期记忆的一份拷贝，供后台线程读取（列表、字典和集合也一并复制，不与角色共享）。
+  def get_snapshot(self): 
+    """
+    Returns a copy of the scratch that can be read (e.g., by a reflection or
+    a speculation running in the background) while this one keeps changing.
+    Its lists, dictionaries and sets (e.g., the schedules and the 
+    conversation buffers) are copied too, since the persona changes them in 
+    place. 
+
+    INPUT: 
+      None
+    OUTPUT: 
+      a Scratch. 
+    """
+    snapshot = copy.copy(self)
+    for name, value in vars(snapshot).items(): 
+      if isinstance(value, (list, dict, set)): 
+        setattr(snapshot, name, copy.deepcopy(value))
+    return snapshot
+
+
 # 计算并返回代理当前计划的执行位置，这有助于在日常计划中找到当前代理正在执行或将要执行的任务。
   def get_f_daily_schedule_index(self, advance=0):
     """
@@ -574,21 +602,33 @@ class Scratch:
     """
     if not self.act_address: 
       return True
-      
-    if self.chatting_with: 
-      end_time = self.chatting_end_time
-    else: 
-      x = self.act_start_time
-      if x.second != 0: 
-        x = x.replace(second=0)
-        x = (x + datetime.timedelta(minutes=1))
-      end_time = (x + datetime.timedelta(minutes=self.act_duration))
 
+    end_time = self.act_end_time()
     if end_time.strftime("%H:%M:%S") == self.curr_time.strftime("%H:%M:%S"): 
       return True
     return False
 
 
+  def act_end_time(self): 
+    """
+    Returns the time at which the current action ends (see 
+    act_check_finished). 
+
+    INPUT
+      None
+    OUTPUT 
+      datetime instance of the end of the action. 
+    """
+    if self.chatting_with: 
+      return self.chatting_end_time
+
+    x = self.act_start_time
+    if x.second != 0: 
+      x = x.replace(second=0)
+      x = (x + datetime.timedelta(minutes=1))
+    return (x + datetime.timedelta(minutes=self.act_duration))
+
+
   def act_summarize(self):
     """
     Summarize the current action as a dictionary. 
@@ -52,6 +52,26 @@ class Persona:
     scratch_saved = f"{folder_mem_saved}/bootstrap_memory/scratch.json"
     self.scratch = Scratch(scratch_saved)
 
+    # PERSONA STEP STATE
+    # <pending_reacts> holds the conversations this persona started with other
+    # personas during a concurrent step, waiting to be committed by the
+    # server (see ReverieServer.move_personas_concurrently). It is None when
+    # the personas are stepped one after another.
+    # e.g., [["Maria Lopez", <convo>, <inserted_act>, <inserted_act_dur>]]
+    self.pending_reacts = None
+    # <rng> is the source of all random choices the persona makes. When 
+    # <simulation_seed> is set, the server reseeds it at every step, so that
+    # the choices do not depend on the order the personas run in. 
+    self.rng = random.Random()
+    # <pending_reflection> is the (snapshot, future) pair of the reflection 
+    # that is running in the background, if any (see 
+    # start_background_reflection in reflect.py). 
+    self.pending_reflection = None
+    # <speculated_action> is the next action of the persona as it was worked
+    # out ahead of time in a pipelined run, for this step only (see 
+    # speculate_action in plan.py). None if there is none. 
+    self.speculated_action = None
+
 
 # 代理的记忆可以存储为文件，包括空间记忆、联想记忆和短期记忆，保证代理在模拟过程中的状态可以被保存和重新加载。
   def save(self, save_folder): 
@@ -63,6 +83,10 @@ class Persona:
     OUTPUT: 
       None
     """
+    # A reflection that is still running in the background is part of the 
+    # persona's state, so we wait for it to finish first. 
+    merge_background_reflection(self, wait=True)
+
     # Spatial memory contains a tree in a json format. 
     # e.g., {"double studio": 
     #         {"double studio": 
@@ -219,6 +243,35 @@ class Persona:
         writing her next novel (editing her novel) 
         @ double studio:double studio:common room:sofa
     """
+    plan = self.decide(maze, personas, curr_tile, curr_time)
+
+    # <execution> is a triple set that contains the following components: 
+    # <next_tile> is a x,y coordinate. e.g., (58, 9)
+    # <pronunciatio> is an emoji. e.g., "\ud83d\udca4"
+    # <description> is a string description of the movement. e.g., 
+    #   writing her next novel (editing her novel) 
+    #   @ double studio:double studio:common room:sofa
+    return self.execute(maze, personas, plan)
+
+
+# 功能：运行认知序列中执行之前的部分（感知、检索、计划、反思），返回代理的计划。move 在此之后再执行计划。
+  def decide(self, maze, personas, curr_tile, curr_time):
+    """
+    Runs the persona's cognitive sequence up to (but not including) the 
+    execution of its plan. This lets the execution of all personas' plans be
+    done together, after all of them have decided (see 
+    ReverieServer.move_personas_in_two_phases). 
+
+    INPUT: 
+      maze: The Maze class of the current world. 
+      personas: A dictionary that contains all persona names as keys, and the 
+                Persona instance as values. 
+      curr_tile: A tuple that designates the persona's current tile location 
+                 in (row, col) form. e.g., (58, 39)
+      curr_time: datetime instance that indicates the game's current time. 
+    OUTPUT: 
+      The target action address of the persona (persona.scratch.act_address).
+    """
     # Updating persona's scratch memory with <curr_tile>. 
     self.scratch.curr_tile = curr_tile
 
@@ -239,14 +292,38 @@ class Persona:
     retrieved = self.retrieve(perceived)
     plan = self.plan(maze, personas, new_day, retrieved)
     self.reflect()
+    return plan
 
-    # <execution> is a triple set that contains the following components: 
-    # <next_tile> is a x,y coordinate. e.g., (58, 9)
-    # <pronunciatio> is an emoji. e.g., "\ud83d\udca4"
-    # <description> is a string description of the movement. e.g., 
-    #   writing her next novel (editing her novel) 
-    #   @ double studio:double studio:common room:sofa
-    return self.execute(maze, personas, plan)
+
+# 功能：在角色这一步没有任何需要决定的事情时，代替 move 让时间向前推进，而不运行认知序列。
+  def idle(self, maze, personas, curr_tile, curr_time, steps=1):
+    """
+    Moves the persona <steps> steps forward without running its cognitive 
+    sequence. This is only the same as calling move on each of these steps 
+    when the persona has nothing to decide on them: it is staying where it
+    is with an action that does not end yet, and nothing new happens around
+    it (see ReverieServer.get_idle_candidates). 
+
+    INPUT: 
+      maze: The Maze class of the current world. 
+      personas: A dictionary that contains all persona names as keys, and the 
+                Persona instance as values. 
+      curr_tile: A tuple that designates the persona's current tile location 
+                 in (row, col) form. e.g., (58, 39)
+      curr_time: datetime instance of the last of these steps. 
+      steps: the number of steps that the persona idles for. 
+    OUTPUT: 
+      execution: The same triple set as move. 
+    """
+    self.scratch.curr_tile = curr_tile
+    self.scratch.curr_time = curr_time
+
+    # The one thing that plan does on every step: conversation buffers 
+    # count down (see plan). 
+    for persona_name in self.scratch.chatting_with_buffer: 
+      self.scratch.chatting_with_buffer[persona_name] -= steps
+
+    return self.execute(maze, personas, self.scratch.act_address)
 
 
 # 功能：开启一个新的对话会话，进入对话模式（convo_mode），允许代理与其他代理或玩家进行互动。
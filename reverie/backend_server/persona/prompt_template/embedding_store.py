@@ -0,0 +1,143 @@
+"""
+File: embedding_store.py
+Description: A process-wide store of text embeddings that is shared by all
+personas. Vectors are kept as compact float32 arrays in an in-memory LRU,
+and optionally persisted to a SQLite file so that they are computed once per
+deployment rather than once per persona and per forked simulation.
+"""
+import sqlite3
+import threading
+
+from collections import OrderedDict
+
+import numpy as np
+
+
+def normalize_embedding_text(text):
+  """
+  Returns the form of <text> that is actually embedded (and that the store
+  is keyed by).
+
+  INPUT:
+    text: a str
+  OUTPUT:
+    a str without line breaks. e.g., "idle"
+  """
+  text = text.replace("\n", " ")
+  if not text:
+    text = "this is blank"
+  return text
+
+
+def _to_list(vector):
+  return vector.astype(float).tolist()
+
+
+class EmbeddingStore:
+  def __init__(self, db_file=None, max_memory_entries=10000):
+    # <db_file> is the SQLite file that the vectors are persisted to. None
+    # keeps them in memory only, for the lifetime of the process.
+    self.db_file = db_file
+    # <max_memory_entries> is the number of vectors kept in memory before the
+    # least recently used ones are dropped (they stay on disk).
+    self.max_memory_entries = max_memory_entries
+
+    # <hits> and <misses> count the lookups made through this instance.
+    self.hits = 0
+    self.misses = 0
+
+    # <memory> maps (model, normalized text) to a float32 numpy vector, in
+    # least to most recently used order.
+    self.memory = OrderedDict()
+    self._lock = threading.Lock()
+    self._conn = None
+    if db_file:
+      self._conn = sqlite3.connect(db_file, check_same_thread=False,
+                                   timeout=30)
+      self._conn.execute("PRAGMA journal_mode=WAL")
+      self._conn.execute("PRAGMA synchronous=NORMAL")
+      self._conn.execute("""CREATE TABLE IF NOT EXISTS embeddings (
+                              model TEXT,
+                              text TEXT,
+                              vector BLOB,
+                              PRIMARY KEY (model, text))""")
+      self._conn.commit()
+
+
+  def _remember(self, key, vector):
+    # Caller holds the lock.
+    self.memory[key] = vector
+    self.memory.move_to_end(key)
+    while len(self.memory) > self.max_memory_entries:
+      self.memory.popitem(last=False)
+
+
+  def get(self, text, model):
+    """
+    Returns the stored embedding of <text> as a list of floats, or None if
+    it has not been computed yet.
+
+    INPUT:
+      text: a normalized str (see normalize_embedding_text).
+      model: the name of the embedding model.
+    OUTPUT:
+      a list of float, or None.
+    """
+    key = (model, text)
+    with self._lock:
+      if key in self.memory:
+        self.memory.move_to_end(key)
+        self.hits += 1
+        return _to_list(self.memory[key])
+      if self._conn:
+        row = self._conn.execute(
+                "SELECT vector FROM embeddings WHERE model = ? AND text = ?",
+                key).fetchone()
+        if row:
+          vector = np.frombuffer(row[0], dtype=np.float32)
+          self._remember(key, vector)
+          self.hits += 1
+          return _to_list(vector)
+      self.misses += 1
+      return None
+
+
+  def put(self, text, model, embedding):
+    """
+    Stores the embedding of <text>, and returns it the way it is stored (so
+    that a vector reads the same whether or not it came from the store).
+
+    INPUT:
+      text: a normalized str (see normalize_embedding_text).
+      model: the name of the embedding model.
+      embedding: a list of float.
+    OUTPUT:
+      a list of float.
+    """
+    return self.put_many([text], model, [embedding])[0]
+
+
+  def put_many(self, texts, model, embeddings):
+    """
+    Stores the embeddings of several texts at once, in a single transaction
+    of the SQLite file, and returns them the way they are stored (see put).
+
+    INPUT:
+      texts: a list of normalized str (see normalize_embedding_text).
+      model: the name of the embedding model.
+      embeddings: a list of embeddings (each a list of float), in the order 
+                  of <texts>.
+    OUTPUT:
+      a list of embeddings (each a list of float).
+    """
+    vectors = [np.asarray(i, dtype=np.float32) for i in embeddings]
+    with self._lock:
+      for text, vector in zip(texts, vectors):
+        self._remember((model, text), vector)
+      if self._conn:
+        self._conn.executemany(
+          "INSERT OR REPLACE INTO embeddings VALUES (?,?,?)",
+          [(model, text, vector.tobytes())
+           for text, vector in zip(texts, vectors)])
+        self._conn.commit()
+    return [_to_list(vector) for vector in vectors]
@@ -3,33 +3,149 @@ Author: Joon Sung Park (joonspk@stanford.edu)
 
 File: gpt_structure.py
 Description: Wrapper functions for calling OpenAI APIs.
+
+Every request goes through <llm_client> (see llm_client.py), so the 
+functions here can be called from many threads at once. Each of them also 
+has an async variant (e.g., ChatGPT_request_async) that can be awaited 
+concurrently. 
 """
+import asyncio
 import json
 import random
 import openai
 import time 
 
 from utils import *
+from default_settings import *
+from persona.prompt_template.llm_client import *
+from persona.prompt_template.llm_cache import *
+from persona.prompt_template.embedding_store import *
+from persona.prompt_template.local_llm import LocalLLMBackend
+from persona.prompt_template.llm_transcript import *
+from persona.prompt_template.prompt_registry import *
+from persona.prompt_template.llm_telemetry import *
 
 openai.api_key = openai_api_key
 
+def create_llm_backend(backend_name): 
+  """
+  Returns the backend that sends the requests of <llm_client>. 
+  ARGS:
+    backend_name: "openai" for the OpenAI APIs (or the compatible server at 
+                  <openai_api_base>), or "local" for the deterministic 
+                  stand-in of local_llm.py. 
+  RETURNS: 
+    a backend object (see llm_client.py). 
+  """
+  if backend_name == "openai": 
+    return OpenAIBackend(openai_api_key, 
+                         api_base=openai_api_base, 
+                         max_connections=llm_max_connections, 
+                         request_timeout=llm_request_timeout)
+  if backend_name == "local": 
+    return LocalLLMBackend(latency=local_llm_latency, seed=local_llm_seed)
+  raise ValueError(f"Unknown llm_backend: {backend_name}")
+
+# A replayed transcript replaces the backend altogether, and recording wraps
+# whichever backend is in use (see llm_transcript.py). 
+if llm_replay_loc: 
+  _backend = ReplayBackend(llm_replay_loc, 
+                           mode=llm_replay_mode, 
+                           replay_latency=llm_replay_latency)
+else: 
+  _backend = create_llm_backend(llm_backend)
+if llm_record_loc: 
+  _backend = RecordingBackend(_backend, llm_record_loc)
+
+# <llm_client> sends all requests of this module. It keeps one connection 
+# pool for the whole process, keeps each model within its rate limits, and 
+# adapts the number of requests in flight to the provider's load, which 
+# replaces the fixed sleep we used to do before every call. Requests that 
+# fail because the provider is overloaded are retried with backoff there, 
+# rather than coming back as error strings that waste the retries of the 
+# safe_generate functions below. 
+# Identical requests that are in flight at the same time are sent only once; 
+# llm_client.coalesced counts the calls that were saved this way. 
+llm_client = LLMClient(_backend, 
+                       model_concurrency=llm_model_concurrency, 
+                       default_concurrency=llm_default_concurrency, 
+                       coalesce=llm_coalesce_requests, 
+                       rate_limits=llm_rate_limits, 
+                       adaptive_concurrency=llm_adaptive_concurrency, 
+                       max_retries=llm_max_retries, 
+                       backoff_base=llm_backoff_base, 
+                       backoff_max=llm_backoff_max)
+
+# <llm_cache> is the persistent LLM response cache (see llm_cache.py), or 
+# None when it is turned off. The safe_generate functions below look up 
+# their first attempt in it, and store every response that passes 
+# validation. 
+llm_cache = None
+if llm_cache_loc: 
+  llm_cache = LLMResponseCache(llm_cache_loc, 
+                               ttl=llm_cache_ttl, 
+                               max_size_mb=llm_cache_max_mb, 
+                               read_only=llm_cache_read_only)
+
+# <llm_telemetry> records every call of the safe_generate functions below 
+# (and every embedding request) by run_gpt_prompt function, model and 
+# persona (see llm_telemetry.py). 
+llm_telemetry = LLMTelemetry()
+
+# <prompt_registry> holds every prompt template, read and compiled once at 
+# startup (see prompt_registry.py). 
+prompt_registry = PromptRegistry()
+
+# <embedding_store> is shared by every caller of get_embedding in the process
+# (see embedding_store.py). 
+embedding_store = EmbeddingStore(embedding_store_loc, 
+                                 embedding_store_memory_entries)
+
+def get_cached_response(model, prompt, gpt_parameter=None): 
+  if not llm_cache: 
+    return None
+  return llm_cache.get(model, prompt, gpt_parameter)
+
+def cache_response(model, prompt, gpt_parameter, response): 
+  if llm_cache: 
+    llm_cache.put(model, prompt, gpt_parameter, response)
+
 def temp_sleep(seconds=0.1):
   time.sleep(seconds)
 
-def ChatGPT_single_request(prompt): 
-  temp_sleep()
+def print_request_error(error): 
+  # A request only fails once the LLM client has retried it for as long as 
+  # that is worth it (or if retrying it cannot help, e.g., when the prompt 
+  # is too long), so the safe_generate functions below give up on the call 
+  # (and return their fail safe) instead of sending it again. 
+  print (f"LLM REQUEST FAILED: {error!r}")
 
-  completion = openai.ChatCompletion.create(
-    model="gpt-3.5-turbo", 
-    messages=[{"role": "user", "content": prompt}]
-  )
-  return completion["choices"][0]["message"]["content"]
+async def ChatGPT_single_request_async(prompt): 
+  call = llm_telemetry.start_call("gpt-3.5-turbo", prompt)
+  response = await llm_client.chat(prompt, "gpt-3.5-turbo")
+  call.add_response(response)
+  call.finish()
+  return response
+
+def ChatGPT_single_request(prompt): 
+  call = llm_telemetry.start_call("gpt-3.5-turbo", prompt)
+  response = llm_client.run(llm_client.chat(prompt, "gpt-3.5-turbo"))
+  call.add_response(response)
+  call.finish()
+  return response
 
 
 # ============================================================================
 # #####################[SECTION 1: CHATGPT-3 STRUCTURE] ######################
 # ============================================================================
 
+async def GPT4_request_async(prompt): 
+  """
+  Async variant of GPT4_request. 
+  """
+  return await llm_client.chat(prompt, "gpt-4")
+
+
 def GPT4_request(prompt): 
   """
   Given a prompt and a dictionary of GPT parameters, make a request to OpenAI
@@ -41,19 +157,18 @@ def GPT4_request(prompt):
                    values.   
   RETURNS: 
     a str of GPT-3's response. 
+  RAISES: 
+    the error of the LLM client if the request failed even after the 
+    client's retries (see llm_client.py). 
   """
-  temp_sleep()
+  return llm_client.run(GPT4_request_async(prompt))
 
-  try: 
-    completion = openai.ChatCompletion.create(
-    model="gpt-4", 
-    messages=[{"role": "user", "content": prompt}]
-    )
-    return completion["choices"][0]["message"]["content"]
-  
-  except: 
-    print ("ChatGPT ERROR")
-    return "ChatGPT ERROR"
+
+async def ChatGPT_request_async(prompt): 
+  """
+  Async variant of ChatGPT_request. 
+  """
+  return await llm_client.chat(prompt, "gpt-3.5-turbo")
 
 
 def ChatGPT_request(prompt): 
@@ -67,18 +182,11 @@ def ChatGPT_request(prompt):
                    values.   
   RETURNS: 
     a str of GPT-3's response. 
+  RAISES: 
+    the error of the LLM client if the request failed even after the 
+    client's retries (see llm_client.py). 
   """
-  # temp_sleep()
-  try: 
-    completion = openai.ChatCompletion.create(
-    model="gpt-3.5-turbo", 
-    messages=[{"role": "user", "content": prompt}]
-    )
-    return completion["choices"][0]["message"]["content"]
-  
-  except: 
-    print ("ChatGPT ERROR")
-    return "ChatGPT ERROR"
+  return llm_client.run(ChatGPT_request_async(prompt))
 
 
 def GPT4_safe_generate_response(prompt, 
@@ -89,6 +197,28 @@ def GPT4_safe_generate_response(prompt,
                                    func_validate=None,
                                    func_clean_up=None,
                                    verbose=False): 
+  # The call runs on the client's event loop, where the stack no longer shows
+  # which run_gpt_prompt function it is for, so we look that up here. 
+  return llm_client.run(GPT4_safe_generate_response_async(
+                          prompt, example_output, special_instruction, 
+                          repeat, fail_safe_response, func_validate, 
+                          func_clean_up, verbose, caller=get_llm_caller()))
+
+
+async def GPT4_safe_generate_response_async(prompt, 
+                                            example_output,
+                                            special_instruction,
+                                            repeat=3,
+                                            fail_safe_response="error",
+                                            func_validate=None,
+                                            func_clean_up=None,
+                                            verbose=False, 
+                                            caller=None): 
+  """
+  Async variant of GPT4_safe_generate_response. <caller> is the 
+  (run_gpt_prompt function, persona name) pair that the call is recorded 
+  under in llm_telemetry; by default, it is found on the stack. 
+  """
   prompt = 'GPT-3 Prompt:\n"""\n' + prompt + '\n"""\n'
   prompt += f"Output the response to the prompt above in json. {special_instruction}\n"
   prompt += "Example output json:\n"
@@ -98,16 +228,29 @@ def GPT4_safe_generate_response(prompt,
     print ("CHAT GPT PROMPT")
     print (prompt)
 
+  call = llm_telemetry.start_call("gpt-4", prompt, caller=caller)
   for i in range(repeat): 
 
     try: 
-      curr_gpt_response = GPT4_request(prompt).strip()
-      end_index = curr_gpt_response.rfind('}') + 1
-      curr_gpt_response = curr_gpt_response[:end_index]
-      curr_gpt_response = json.loads(curr_gpt_response)["output"]
+      raw_response = None
+      if i == 0: 
+        raw_response = get_cached_response("gpt-4", prompt)
+      from_cache = raw_response is not None
+      if not from_cache: 
+        try: 
+          raw_response = await GPT4_request_async(prompt)
+        except Exception as e: 
+          print_request_error(e)
+          break
+      call.add_response(raw_response, from_cache)
+      curr_gpt_response = _parse_ChatGPT_output(raw_response)
       
       if func_validate(curr_gpt_response, prompt=prompt): 
-        return func_clean_up(curr_gpt_response, prompt=prompt)
+        if not from_cache: 
+          cache_response("gpt-4", prompt, None, raw_response)
+        curr_gpt_response = func_clean_up(curr_gpt_response, prompt=prompt)
+        call.finish()
+        return curr_gpt_response
       
       if verbose: 
         print ("---- repeat count: \n", i, curr_gpt_response)
@@ -117,9 +260,26 @@ def GPT4_safe_generate_response(prompt,
     except: 
       pass
 
+  call.finish(fail_safe=True)
   return False
 
 
+def _wrap_ChatGPT_prompt(prompt, example_output, special_instruction): 
+  # prompt = 'GPT-3 Prompt:\n"""\n' + prompt + '\n"""\n'
+  prompt = '"""\n' + prompt + '\n"""\n'
+  prompt += f"Output the response to the prompt above in json. {special_instruction}\n"
+  prompt += "Example output json:\n"
+  prompt += '{"output": "' + str(example_output) + '"}'
+  return prompt
+
+
+def _parse_ChatGPT_output(curr_gpt_response): 
+  curr_gpt_response = curr_gpt_response.strip()
+  end_index = curr_gpt_response.rfind('}') + 1
+  curr_gpt_response = curr_gpt_response[:end_index]
+  return json.loads(curr_gpt_response)["output"]
+
+
 def ChatGPT_safe_generate_response(prompt, 
                                    example_output,
                                    special_instruction,
@@ -128,30 +288,59 @@ def ChatGPT_safe_generate_response(prompt,
                                    func_validate=None,
                                    func_clean_up=None,
                                    verbose=False): 
-  # prompt = 'GPT-3 Prompt:\n"""\n' + prompt + '\n"""\n'
-  prompt = '"""\n' + prompt + '\n"""\n'
-  prompt += f"Output the response to the prompt above in json. {special_instruction}\n"
-  prompt += "Example output json:\n"
-  prompt += '{"output": "' + str(example_output) + '"}'
+  # The call runs on the client's event loop, where the stack no longer shows
+  # which run_gpt_prompt function it is for, so we look that up here. 
+  return llm_client.run(ChatGPT_safe_generate_response_async(
+                          prompt, example_output, special_instruction, 
+                          repeat, fail_safe_response, func_validate, 
+                          func_clean_up, verbose, caller=get_llm_caller()))
+
+
+async def ChatGPT_safe_generate_response_async(prompt, 
+                                               example_output,
+                                               special_instruction,
+                                               repeat=3,
+                                               fail_safe_response="error",
+                                               func_validate=None,
+                                               func_clean_up=None,
+                                               verbose=False, 
+                                               caller=None): 
+  """
+  Async variant of ChatGPT_safe_generate_response. <caller> is the 
+  (run_gpt_prompt function, persona name) pair that the call is recorded 
+  under in llm_telemetry; by default, it is found on the stack. 
+  """
+  prompt = _wrap_ChatGPT_prompt(prompt, example_output, special_instruction)
 
   if verbose: 
     print ("CHAT GPT PROMPT")
     print (prompt)
 
+  call = llm_telemetry.start_call("gpt-3.5-turbo", prompt, caller=caller)
   for i in range(repeat): 
 
     try: 
-      curr_gpt_response = ChatGPT_request(prompt).strip()
-      end_index = curr_gpt_response.rfind('}') + 1
-      curr_gpt_response = curr_gpt_response[:end_index]
-      curr_gpt_response = json.loads(curr_gpt_response)["output"]
-
-      # print ("---ashdfaf")
-      # print (curr_gpt_response)
-      # print ("000asdfhia")
+      # Only the first attempt can be served from the cache. Retries always
+      # go to the model. 
+      raw_response = None
+      if i == 0: 
+        raw_response = get_cached_response("gpt-3.5-turbo", prompt)
+      from_cache = raw_response is not None
+      if not from_cache: 
+        try: 
+          raw_response = await ChatGPT_request_async(prompt)
+        except Exception as e: 
+          print_request_error(e)
+          break
+      call.add_response(raw_response, from_cache)
+      curr_gpt_response = _parse_ChatGPT_output(raw_response)
       
       if func_validate(curr_gpt_response, prompt=prompt): 
-        return func_clean_up(curr_gpt_response, prompt=prompt)
+        if not from_cache: 
+          cache_response("gpt-3.5-turbo", prompt, None, raw_response)
+        curr_gpt_response = func_clean_up(curr_gpt_response, prompt=prompt)
+        call.finish()
+        return curr_gpt_response
       
       if verbose: 
         print ("---- repeat count: \n", i, curr_gpt_response)
@@ -161,6 +350,7 @@ def ChatGPT_safe_generate_response(prompt,
     except: 
       pass
 
+  call.finish(fail_safe=True)
   return False
 
 
@@ -174,11 +364,27 @@ def ChatGPT_safe_generate_response_OLD(prompt,
     print ("CHAT GPT PROMPT")
     print (prompt)
 
+  call = llm_telemetry.start_call("gpt-3.5-turbo", prompt)
   for i in range(repeat): 
     try: 
-      curr_gpt_response = ChatGPT_request(prompt).strip()
+      curr_gpt_response = None
+      if i == 0: 
+        curr_gpt_response = get_cached_response("gpt-3.5-turbo", prompt)
+      from_cache = curr_gpt_response is not None
+      if not from_cache: 
+        try: 
+          curr_gpt_response = ChatGPT_request(prompt)
+        except Exception as e: 
+          print_request_error(e)
+          break
+      call.add_response(curr_gpt_response, from_cache)
+      curr_gpt_response = curr_gpt_response.strip()
       if func_validate(curr_gpt_response, prompt=prompt): 
-        return func_clean_up(curr_gpt_response, prompt=prompt)
+        if not from_cache: 
+          cache_response("gpt-3.5-turbo", prompt, None, curr_gpt_response)
+        curr_gpt_response = func_clean_up(curr_gpt_response, prompt=prompt)
+        call.finish()
+        return curr_gpt_response
       if verbose: 
         print (f"---- repeat count: {i}")
         print (curr_gpt_response)
@@ -187,6 +393,7 @@ def ChatGPT_safe_generate_response_OLD(prompt,
     except: 
       pass
   print ("FAIL SAFE TRIGGERED") 
+  call.finish(fail_safe=True)
   return fail_safe_response
 
 
@@ -194,6 +401,13 @@ def ChatGPT_safe_generate_response_OLD(prompt,
 # ###################[SECTION 2: ORIGINAL GPT-3 STRUCTURE] ###################
 # ============================================================================
 
+async def GPT_request_async(prompt, gpt_parameter): 
+  """
+  Async variant of GPT_request. 
+  """
+  return await llm_client.completion(prompt, gpt_parameter)
+
+
 def GPT_request(prompt, gpt_parameter): 
   """
   Given a prompt and a dictionary of GPT parameters, make a request to OpenAI
@@ -205,23 +419,11 @@ def GPT_request(prompt, gpt_parameter):
                    values.   
   RETURNS: 
     a str of GPT-3's response. 
+  RAISES: 
+    the error of the LLM client if the request failed even after the 
+    client's retries (see llm_client.py). 
   """
-  temp_sleep()
-  try: 
-    response = openai.Completion.create(
-                model=gpt_parameter["engine"],
-                prompt=prompt,
-                temperature=gpt_parameter["temperature"],
-                max_tokens=gpt_parameter["max_tokens"],
-                top_p=gpt_parameter["top_p"],
-                frequency_penalty=gpt_parameter["frequency_penalty"],
-                presence_penalty=gpt_parameter["presence_penalty"],
-                stream=gpt_parameter["stream"],
-                stop=gpt_parameter["stop"],)
-    return response.choices[0].text
-  except: 
-    print ("TOKEN LIMIT EXCEEDED")
-    return "TOKEN LIMIT EXCEEDED"
+  return llm_client.run(GPT_request_async(prompt, gpt_parameter))
 
 
 def generate_prompt(curr_input, prompt_lib_file): 
@@ -241,15 +443,7 @@ def generate_prompt(curr_input, prompt_lib_file):
   if type(curr_input) == type("string"): 
     curr_input = [curr_input]
   curr_input = [str(i) for i in curr_input]
-
-  f = open(prompt_lib_file, "r")
-  prompt = f.read()
-  f.close()
-  for count, i in enumerate(curr_input):   
-    prompt = prompt.replace(f"!<INPUT {count}>!", i)
-  if "<commentblockmarker>###</commentblockmarker>" in prompt: 
-    prompt = prompt.split("<commentblockmarker>###</commentblockmarker>")[1]
-  return prompt.strip()
+  return prompt_registry.get(prompt_lib_file).fill(curr_input)
 
 
 def safe_generate_response(prompt, 
@@ -259,26 +453,136 @@ def safe_generate_response(prompt,
                            func_validate=None,
                            func_clean_up=None,
                            verbose=False): 
+  # The call runs on the client's event loop, where the stack no longer shows
+  # which run_gpt_prompt function it is for, so we look that up here. 
+  return llm_client.run(safe_generate_response_async(
+                          prompt, gpt_parameter, repeat, fail_safe_response, 
+                          func_validate, func_clean_up, verbose, 
+                          caller=get_llm_caller()))
+
+
+async def safe_generate_response_async(prompt, 
+                                       gpt_parameter,
+                                       repeat=5,
+                                       fail_safe_response="error",
+                                       func_validate=None,
+                                       func_clean_up=None,
+                                       verbose=False, 
+                                       caller=None): 
+  """
+  Async variant of safe_generate_response. <caller> is as in 
+  ChatGPT_safe_generate_response_async. 
+  """
   if verbose: 
     print (prompt)
 
+  call = llm_telemetry.start_call(gpt_parameter["engine"], prompt, 
+                                  caller=caller)
   for i in range(repeat): 
-    curr_gpt_response = GPT_request(prompt, gpt_parameter)
+    # Only the first attempt can be served from the cache. Retries always go
+    # to the model. 
+    curr_gpt_response = None
+    if i == 0: 
+      curr_gpt_response = get_cached_response(gpt_parameter["engine"], 
+                                              prompt, gpt_parameter)
+    from_cache = curr_gpt_response is not None
+    if not from_cache: 
+      try: 
+        curr_gpt_response = await GPT_request_async(prompt, gpt_parameter)
+      except Exception as e: 
+        print_request_error(e)
+        break
+    call.add_response(curr_gpt_response, from_cache)
     if func_validate(curr_gpt_response, prompt=prompt): 
+      if not from_cache: 
+        cache_response(gpt_parameter["engine"], prompt, gpt_parameter, 
+                       curr_gpt_response)
+      call.finish()
       return func_clean_up(curr_gpt_response, prompt=prompt)
     if verbose: 
       print ("---- repeat count: ", i, curr_gpt_response)
       print (curr_gpt_response)
       print ("~~~~")
+  call.finish(fail_safe=True)
   return fail_safe_response
 
 
+async def get_embedding_async(text, model="text-embedding-ada-002"):
+  """
+  Async variant of get_embedding. 
+  """
+  text = normalize_embedding_text(text)
+  embedding = embedding_store.get(text, model)
+  if embedding is None: 
+    call = llm_telemetry.start_call(model, [text], "get_embedding")
+    embedding = (await llm_client.embeddings([text], model))[0]
+    call.add_response(embedding)
+    call.finish()
+    embedding = embedding_store.put(text, model, embedding)
+  return embedding
+
+
 def get_embedding(text, model="text-embedding-ada-002"):
-  text = text.replace("\n", " ")
-  if not text: 
-    text = "this is blank"
-  return openai.Embedding.create(
-          input=[text], model=model)['data'][0]['embedding']
+  text = normalize_embedding_text(text)
+  embedding = embedding_store.get(text, model)
+  if embedding is None: 
+    call = llm_telemetry.start_call(model, [text], "get_embedding")
+    embedding = llm_client.run(llm_client.embeddings([text], model))[0]
+    call.add_response(embedding)
+    call.finish()
+    embedding = embedding_store.put(text, model, embedding)
+  return embedding
+
+
+async def _get_embedding_batch(batch, model): 
+  call = llm_telemetry.start_call(model, batch, "get_embeddings")
+  batch_embeddings = await llm_client.embeddings(batch, model)
+  call.add_response(batch_embeddings)
+  call.finish()
+  return batch_embeddings
+
+
+async def get_embeddings_async(texts, model="text-embedding-ada-002"):
+  """
+  Async variant of get_embeddings. 
+  """
+  texts = [normalize_embedding_text(i) for i in texts]
+
+  # Only the texts that are not in the embedding store yet are sent, each 
+  # of them once, in requests of at most <embedding_batch_size> inputs. 
+  embeddings = dict()
+  missing_texts = []
+  for text in texts: 
+    if text in embeddings: 
+      continue
+    embeddings[text] = embedding_store.get(text, model)
+    if embeddings[text] is None: 
+      missing_texts += [text]
+
+  batches = [missing_texts[i:i+embedding_batch_size] 
+             for i in range(0, len(missing_texts), embedding_batch_size)]
+  responses = await asyncio.gather(*[_get_embedding_batch(batch, model) 
+                                     for batch in batches])
+  for batch, batch_embeddings in zip(batches, responses): 
+    batch_embeddings = embedding_store.put_many(batch, model, 
+                                                batch_embeddings)
+    for text, embedding in zip(batch, batch_embeddings): 
+      embeddings[text] = embedding
+
+  return [embeddings[text] for text in texts]
+
+
+def get_embeddings(texts, model="text-embedding-ada-002"):
+  """
+  Embeds a list of texts using as few requests as possible. Texts that are 
+  already in the embedding store are not sent again. 
+  ARGS:
+    texts: a list of str
+    model: the name of the embedding model. 
+  RETURNS: 
+    a list of embeddings (each a list of float), in the order of <texts>. 
+  """
+  return llm_client.run(get_embeddings_async(texts, model))
 
 
 if __name__ == '__main__':
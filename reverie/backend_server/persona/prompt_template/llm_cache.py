@@ -0,0 +1,205 @@
+"""
+File: llm_cache.py
+Description: A persistent, content-addressed cache of LLM responses. Entries
+are keyed by (model, prompt, gpt_param) and stored in a SQLite file, so the
+same cache can be shared by every simulation (and every process) on a
+machine. gpt_structure.py consults it before sending a request, and only
+stores responses that passed the caller's validation.
+"""
+import atexit
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+# The number of hits whose last use is kept in memory before it is written 
+# to the file. 
+TOUCH_BATCH_SIZE = 256
+
+
+class LLMResponseCache:
+  def __init__(self, db_file, ttl=None, max_size_mb=None, read_only=False):
+    # <db_file> is the path to the SQLite file of the cache. It is created if
+    # it does not exist yet (unless <read_only> is on, in which case the 
+    # cache is simply empty).
+    self.db_file = db_file
+    # <ttl> is the number of seconds after which an entry expires. None means
+    # that entries never expire.
+    self.ttl = ttl
+    # <max_size> is the total size (in bytes) of the prompts and responses
+    # that the cache holds before the least recently used entries are
+    # evicted. None means that the cache is never trimmed.
+    self.max_size = None
+    if max_size_mb:
+      self.max_size = int(max_size_mb * 1024 * 1024)
+    # <read_only> turns the cache into a fixed lookup table -- nothing is
+    # added, expired, evicted or even touched. This is what we want for
+    # reproducible benchmarks.
+    self.read_only = read_only
+
+    # <hits> and <misses> count the lookups made through this instance.
+    self.hits = 0
+    self.misses = 0
+
+    # <touched> maps the keys of the entries that were hit since the last 
+    # flush to the time they were last used. Writing that time on every hit
+    # would make every lookup a write to the file, so it is written in 
+    # batches instead (see flush). 
+    self._touched = dict()
+
+    self._lock = threading.Lock()
+    if read_only and os.path.exists(db_file):
+      self._conn = sqlite3.connect(f"file:{db_file}?mode=ro", uri=True,
+                                   check_same_thread=False, timeout=30)
+    elif read_only:
+      # A read-only cache without a file is an empty lookup table. 
+      self._conn = sqlite3.connect(":memory:", check_same_thread=False)
+      self._create_table()
+    else:
+      if os.path.dirname(db_file):
+        os.makedirs(os.path.dirname(db_file), exist_ok=True)
+      self._conn = sqlite3.connect(db_file,
+                                   check_same_thread=False, timeout=30)
+      self._conn.execute("PRAGMA journal_mode=WAL")
+      self._conn.execute("PRAGMA synchronous=NORMAL")
+      self._create_table()
+      atexit.register(self.flush)
+    self._size = self._conn.execute(
+                   "SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+
+  def _create_table(self):
+    self._conn.execute("""CREATE TABLE IF NOT EXISTS responses (
+                              key TEXT PRIMARY KEY,
+                              model TEXT,
+                              prompt TEXT,
+                              params TEXT,
+                              response TEXT,
+                              size INTEGER,
+                              created REAL,
+                              last_used REAL)""")
+    self._conn.execute("""CREATE INDEX IF NOT EXISTS responses_last_used
+                          ON responses (last_used)""")
+    self._conn.commit()
+
+
+  def get_key(self, model, prompt, params):
+    """
+    Returns the content address of a request.
+
+    INPUT:
+      model: the name of the model. e.g., "gpt-3.5-turbo"
+      prompt: the str prompt that is sent to the model.
+      params: the gpt_parameter dictionary of the request (or None).
+    OUTPUT:
+      a hex str.
+    """
+    params = json.dumps(params, sort_keys=True)
+    key_str = json.dumps([model, prompt, params])
+    return hashlib.sha256(key_str.encode("utf-8")).hexdigest()
+
+
+  def get(self, model, prompt, params):
+    """
+    Returns the cached response to a request, or None if there is no (live)
+    entry for it.
+    """
+    key = self.get_key(model, prompt, params)
+    now = time.time()
+    with self._lock:
+      row = self._conn.execute(
+              "SELECT response, created FROM responses WHERE key = ?",
+              (key,)).fetchone()
+      if row and self.ttl and now - row[1] > self.ttl:
+        if not self.read_only:
+          self._touched.pop(key, None)
+          self._delete(key)
+          self._conn.commit()
+        row = None
+      if not row:
+        self.misses += 1
+        return None
+      if not self.read_only:
+        self._touched[key] = now
+        if len(self._touched) >= TOUCH_BATCH_SIZE:
+          self._flush_touched()
+          self._conn.commit()
+      self.hits += 1
+      return row[0]
+
+
+  def put(self, model, prompt, params, response):
+    """
+    Stores the response to a request. Does nothing in read-only mode.
+    """
+    if self.read_only:
+      return
+    key = self.get_key(model, prompt, params)
+    size = len(prompt) + len(response)
+    now = time.time()
+    with self._lock:
+      self._touched.pop(key, None)
+      self._delete(key)
+      self._conn.execute("INSERT INTO responses VALUES (?,?,?,?,?,?,?,?)",
+                         (key, model, prompt, json.dumps(params), response,
+                          size, now, now))
+      self._size += size
+      if self.max_size and self._size > self.max_size:
+        # The entries are evicted by their last use, so the ones that were 
+        # hit since the last flush have to be written first. 
+        self._flush_touched()
+        self._evict()
+      self._conn.commit()
+
+
+  def flush(self):
+    """
+    Writes the last use of the entries that were hit since the last flush to
+    the file. This is done every TOUCH_BATCH_SIZE hits, before entries are 
+    evicted, and when the process exits. 
+    """
+    with self._lock:
+      if self._touched:
+        self._flush_touched()
+        self._conn.commit()
+
+
+  def _flush_touched(self):
+    self._conn.executemany("UPDATE responses SET last_used = ? WHERE key = ?",
+                           [(last_used, key) for key, last_used
+                            in self._touched.items()])
+    self._touched = dict()
+
+
+  def _delete(self, key):
+    row = self._conn.execute("SELECT size FROM responses WHERE key = ?",
+                             (key,)).fetchone()
+    if row:
+      self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+      self._size -= row[0]
+
+
+  def _evict(self):
+    # Other processes may be writing to the same file, so we start from the
+    # actual size on disk before trimming it down to 90% of <max_size>.
+    self._size = self._conn.execute(
+                   "SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+    target_size = int(self.max_size * 0.9)
+    rows = self._conn.execute(
+             "SELECT key, size FROM responses ORDER BY last_used")
+    evicted = []
+    for key, size in rows:
+      if self._size <= target_size:
+        break
+      evicted += [(key,)]
+      self._size -= size
+    self._conn.executemany("DELETE FROM responses WHERE key = ?", evicted)
+
+
+  def close(self):
+    self.flush()
+    atexit.unregister(self.flush)
+    with self._lock:
+      self._conn.close()
@@ -0,0 +1,435 @@
+"""
+File: llm_client.py
+Description: An asyncio client for the LLM APIs that gpt_structure.py is
+built on. All requests of the process go through one event loop that runs in
+a background thread, so they share the per-model concurrency limits (and the
+backend's connection pool), no matter whether they were made from the
+synchronous functions in gpt_structure.py or awaited from their async
+variants.
+
+The requests themselves are sent by a backend object. OpenAIBackend below
+talks to the OpenAI APIs (or any server that is compatible with them), and
+LocalLLMBackend in local_llm.py is a deterministic stand-in that needs no
+network access. A backend is any object with the following coroutines:
+  chat(prompt, model) -> str
+  completion(prompt, gpt_parameter) -> str
+  embeddings(texts, model) -> list of embedding vectors
+  close()
+A backend can return its str responses as LLMResponse objects, to pass along
+the token counts that the provider reported.
+
+The client keeps each model within its rate limits (see rate_limiter.py),
+and retries requests that failed because the provider was overloaded or
+unreachable, with exponential backoff.
+"""
+import asyncio
+import json
+import threading
+
+import aiohttp
+import openai
+
+from persona.prompt_template.rate_limiter import *
+
+
+# The errors that are worth retrying: the provider is overloaded, or could
+# not be reached. Anything else (e.g., an invalid request) fails right away.
+RETRYABLE_ERRORS = (openai.error.RateLimitError,
+                    openai.error.Timeout,
+                    openai.error.APIConnectionError,
+                    openai.error.ServiceUnavailableError,
+                    openai.error.TryAgain,
+                    aiohttp.ClientError,
+                    asyncio.TimeoutError)
+# The subset of them that means we are sending too much, which makes the
+# client lower its concurrency.
+OVERLOAD_ERRORS = (openai.error.RateLimitError,
+                   openai.error.Timeout,
+                   openai.error.ServiceUnavailableError,
+                   asyncio.TimeoutError)
+
+
+def get_retry_after(error):
+  """
+  Returns the number of seconds the provider asked us to wait in the
+  Retry-After header of <error>, or None if it did not.
+  """
+  headers = getattr(error, "headers", None) or dict()
+  try:
+    return float(headers.get("retry-after"))
+  except (TypeError, ValueError):
+    return None
+
+
+class LLMResponse(str):
+  """
+  A str response of a chat or completion request, along with the <usage>
+  that the provider reported for it (a dictionary with the "prompt_tokens"
+  and "completion_tokens" keys). It is used wherever a str is.
+  """
+  def __new__(cls, text, usage=None):
+    response = super().__new__(cls, text)
+    response.usage = usage
+    return response
+
+
+class OpenAIBackend:
+  def __init__(self,
+               api_key,
+               api_base=None,
+               max_connections=32,
+               request_timeout=None):
+    # <api_key> and <api_base> are passed along with every request. When
+    # <api_base> is None, the default endpoint of the openai package is used.
+    self.api_key = api_key
+    self.api_base = api_base
+    # <request_timeout> is the number of seconds before a request is given
+    # up on. None uses the default of the openai package.
+    self.request_timeout = request_timeout
+
+    # <max_connections> is the size of the shared aiohttp connection pool.
+    # The pool is created lazily on the event loop of the LLMClient.
+    self.max_connections = max_connections
+    self._session = None
+
+
+  def _get_session(self):
+    # Only ever called from the client's loop, so there is no race here.
+    if not self._session or self._session.closed:
+      connector = aiohttp.TCPConnector(limit=self.max_connections)
+      self._session = aiohttp.ClientSession(connector=connector)
+    return self._session
+
+
+  def _request_kwargs(self):
+    kwargs = {"api_key": self.api_key}
+    if self.api_base:
+      kwargs["api_base"] = self.api_base
+    if self.request_timeout:
+      kwargs["request_timeout"] = self.request_timeout
+    return kwargs
+
+
+  async def chat(self, prompt, model):
+    openai.aiosession.set(self._get_session())
+    completion = await openai.ChatCompletion.acreate(
+                   model=model,
+                   messages=[{"role": "user", "content": prompt}],
+                   **self._request_kwargs())
+    return LLMResponse(completion["choices"][0]["message"]["content"],
+                       completion.get("usage"))
+
+
+  async def completion(self, prompt, gpt_parameter):
+    openai.aiosession.set(self._get_session())
+    response = await openai.Completion.acreate(
+                 model=gpt_parameter["engine"],
+                 prompt=prompt,
+                 temperature=gpt_parameter["temperature"],
+                 max_tokens=gpt_parameter["max_tokens"],
+                 top_p=gpt_parameter["top_p"],
+                 frequency_penalty=gpt_parameter["frequency_penalty"],
+                 presence_penalty=gpt_parameter["presence_penalty"],
+                 stream=gpt_parameter["stream"],
+                 stop=gpt_parameter["stop"],
+                 **self._request_kwargs())
+    return LLMResponse(response.choices[0].text, response.get("usage"))
+
+
+  async def embeddings(self, texts, model):
+    openai.aiosession.set(self._get_session())
+    response = await openai.Embedding.acreate(input=texts,
+                                              model=model,
+                                              **self._request_kwargs())
+    return [i["embedding"] for i in response["data"]]
+
+
+  async def close(self):
+    if self._session:
+      await self._session.close()
+      self._session = None
+
+
+class LLMClient:
+  def __init__(self,
+               backend,
+               model_concurrency=None,
+               default_concurrency=8,
+               coalesce=True,
+               rate_limits=None,
+               adaptive_concurrency=True,
+               max_retries=6,
+               backoff_base=1.0,
+               backoff_max=60.0):
+    # <backend> sends the actual requests (see the description at the top of
+    # this file). e.g., OpenAIBackend(openai_api_key)
+    self.backend = backend
+
+    # <model_concurrency> maps a model name to the number of requests that
+    # can be in flight at the same time for that model. Models that are not
+    # listed use <default_concurrency>. With <adaptive_concurrency>, these
+    # are the ceilings: the actual limit is halved whenever the provider
+    # signals that it is overloaded, and grows back as requests succeed.
+    # e.g., {"gpt-3.5-turbo": 16, "gpt-4": 4}
+    self.model_concurrency = dict(model_concurrency or {})
+    self.default_concurrency = default_concurrency
+    self.adaptive_concurrency = adaptive_concurrency
+
+    # <rate_limits> maps a model name to its budgets of requests per minute
+    # ("rpm") and tokens per minute ("tpm"). Either can be left out, and
+    # models that are not listed are not rate limited.
+    # e.g., {"gpt-3.5-turbo": {"rpm": 3500, "tpm": 90000}}
+    self.rate_limits = dict(rate_limits or {})
+
+    # A request that fails with one of the RETRYABLE_ERRORS is retried up to
+    # <max_retries> times, after a jittered exponential backoff of
+    # <backoff_base> * 2^attempt seconds at most (capped at <backoff_max>),
+    # or after as long as the provider asked us to wait.
+    self.max_retries = max_retries
+    self.backoff_base = backoff_base
+    self.backoff_max = backoff_max
+
+    # <coalesce> makes a request that is identical to one that is still in
+    # flight (same kind, model, prompt and parameters) wait for the response
+    # of that one, instead of being sent again.
+    self.coalesce = coalesce
+    # <requests> counts the requests made to the client, and <coalesced> the
+    # ones among them that were answered by an identical in-flight request,
+    # i.e., the calls that were saved.
+    self.requests = 0
+    self.coalesced = 0
+    # <retries> counts the requests that were sent again after a retryable
+    # error, and <overloads> the errors among them that lowered the
+    # concurrency.
+    self.retries = 0
+    self.overloads = 0
+
+    # The event loop, its thread, and the loop-bound objects below are all
+    # created lazily on the first request.
+    self._loop = None
+    self._thread = None
+    self._concurrency = dict()
+    self._buckets = dict()
+    self._in_flight = dict()
+    self._start_lock = threading.Lock()
+
+
+  def _get_loop(self):
+    """
+    Returns the client's event loop, starting its background thread if this
+    is the first time the client is used.
+    """
+    with self._start_lock:
+      if not self._loop:
+        loop = asyncio.new_event_loop()
+        thread = threading.Thread(target=loop.run_forever,
+                                  name="llm-client",
+                                  daemon=True)
+        thread.start()
+        self._loop = loop
+        self._thread = thread
+    return self._loop
+
+
+  def run(self, coro):
+    """
+    Runs a coroutine on the client's event loop and blocks until it is done.
+    This is how the synchronous functions of gpt_structure.py use the
+    client. It must not be called from the client's own loop.
+
+    INPUT:
+      coro: The coroutine to run.
+    OUTPUT:
+      The return value of <coro>.
+    """
+    loop = self._get_loop()
+    if threading.current_thread() is self._thread:
+      coro.close()
+      raise RuntimeError("LLMClient.run() cannot be called from the client's "
+                         + "event loop. Await the async variant instead.")
+    return asyncio.run_coroutine_threadsafe(coro, loop).result()
+
+
+  async def _on_loop(self, coro):
+    """
+    Awaits <coro> on the client's event loop. Callers that are running in
+    another event loop are bridged over, so the connection pool and the
+    concurrency limits are shared by everyone.
+    """
+    loop = self._get_loop()
+    if asyncio.get_running_loop() is loop:
+      return await coro
+    return await asyncio.wrap_future(
+                   asyncio.run_coroutine_threadsafe(coro, loop))
+
+
+  def _get_concurrency(self, model):
+    # Only ever called from the client's loop, so there is no race here.
+    if model not in self._concurrency:
+      limit = self.model_concurrency.get(model, self.default_concurrency)
+      self._concurrency[model] = AdaptiveConcurrency(limit)
+    return self._concurrency[model]
+
+
+  def _get_buckets(self, model):
+    # Returns the (requests, tokens) buckets of <model>, either of which can
+    # be None.
+    if model not in self._buckets:
+      limits = self.rate_limits.get(model) or dict()
+      self._buckets[model] = [TokenBucket(limits[i]) if limits.get(i) else None
+                              for i in ("rpm", "tpm")]
+    return self._buckets[model]
+
+
+  async def _send(self, model, tokens, send):
+    """
+    Sends a request within the rate limits and the concurrency limit of
+    <model>, retrying it with backoff when it fails with a retryable error.
+
+    INPUT:
+      model: the name of the model the request is for.
+      tokens: the estimated number of tokens the request uses (its prompt
+              and its response).
+      send: a function that returns a new coroutine of the request each time
+            it is called.
+    OUTPUT:
+      The response of the request.
+    """
+    requests_bucket, tokens_bucket = self._get_buckets(model)
+    concurrency = self._get_concurrency(model)
+    for attempt in range(self.max_retries + 1):
+      if requests_bucket:
+        await requests_bucket.acquire(1)
+      if tokens_bucket:
+        await tokens_bucket.acquire(tokens)
+      async with concurrency:
+        epoch = concurrency.epoch
+        try:
+          response = await send()
+          if self.adaptive_concurrency:
+            concurrency.on_success()
+          return response
+        except RETRYABLE_ERRORS as e:
+          if attempt == self.max_retries:
+            raise
+          if isinstance(e, OVERLOAD_ERRORS):
+            self.overloads += 1
+            if self.adaptive_concurrency:
+              concurrency.on_overload(epoch)
+          delay = get_retry_after(e)
+      if delay is None:
+        delay = get_backoff(attempt, self.backoff_base, self.backoff_max)
+      self.retries += 1
+      await asyncio.sleep(delay)
+
+
+  async def _single_flight(self, key, coro):
+    """
+    Awaits <coro>, unless a request with the same <key> is already in flight,
+    in which case <coro> is dropped and the response of that request is
+    returned (or its exception raised) instead. Only ever called from the
+    client's loop, so there is no race here.
+    """
+    self.requests += 1
+    if not self.coalesce:
+      return await coro
+    future = self._in_flight.get(key)
+    if future:
+      coro.close()
+      self.coalesced += 1
+    else:
+      future = asyncio.ensure_future(coro)
+      self._in_flight[key] = future
+      def _forget(done, key=key):
+        if self._in_flight.get(key) is done:
+          del self._in_flight[key]
+      future.add_done_callback(_forget)
+    # Shielded, so that a caller that is cancelled does not cancel the
+    # request for everyone else who is waiting on it.
+    return await asyncio.shield(future)
+
+
+  async def _chat(self, prompt, model):
+    # The length of a chat response is not known in advance, so we budget as
+    # many tokens for it as for the prompt.
+    return await self._send(model, 2 * estimate_tokens(prompt),
+                            lambda: self.backend.chat(prompt, model))
+
+
+  async def _completion(self, prompt, gpt_parameter):
+    tokens = estimate_tokens(prompt) + gpt_parameter["max_tokens"]
+    return await self._send(gpt_parameter["engine"], tokens,
+                            lambda: self.backend.completion(prompt,
+                                                            gpt_parameter))
+
+
+  async def _embeddings(self, texts, model):
+    return await self._send(model, estimate_tokens(texts),
+                            lambda: self.backend.embeddings(texts, model))
+
+
+  async def chat(self, prompt, model):
+    """
+    Sends <prompt> as a single user message to a chat model.
+
+    INPUT:
+      prompt: a str prompt
+      model: the name of the chat model. e.g., "gpt-3.5-turbo"
+    OUTPUT:
+      a str of the model's response.
+    """
+    key = json.dumps(["chat", model, prompt])
+    return await self._on_loop(self._single_flight(key,
+                                                   self._chat(prompt, model)))
+
+
+  async def completion(self, prompt, gpt_parameter):
+    """
+    Sends <prompt> to a completion model.
+
+    INPUT:
+      prompt: a str prompt
+      gpt_parameter: a python dictionary with the keys indicating the names
+                     of the parameter and the values indicating the parameter
+                     values. The model is given by its "engine" key.
+    OUTPUT:
+      a str of the model's response.
+    """
+    key = json.dumps(["completion", prompt, gpt_parameter], sort_keys=True)
+    return await self._on_loop(
+                   self._single_flight(key,
+                                       self._completion(prompt, gpt_parameter)))
+
+
+  async def embeddings(self, texts, model):
+    """
+    Embeds all of <texts> in a single request.
+
+    INPUT:
+      texts: a list of str
+      model: the name of the embedding model.
+    OUTPUT:
+      a list of embedding vectors, in the same order as <texts>.
+    """
+    key = json.dumps(["embeddings", model, texts])
+    return await self._on_loop(
+                   self._single_flight(key, self._embeddings(texts, model)))
+
+
+  def close(self):
+    """
+    Closes the backend (e.g., its connection pool) and stops the client's
+    event loop. The client starts a new loop if it is used again afterwards.
+    """
+    with self._start_lock:
+      loop = self._loop
+      self._loop = None
+    if not loop:
+      return
+    asyncio.run_coroutine_threadsafe(self.backend.close(), loop).result()
+    self._concurrency = dict()
+    self._buckets = dict()
+    self._in_flight = dict()
+    loop.call_soon_threadsafe(loop.stop)
+    self._thread.join()
+    loop.close()
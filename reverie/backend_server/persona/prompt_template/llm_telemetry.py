@@ -0,0 +1,299 @@
+"""
+File: llm_telemetry.py
+Description: Per-call telemetry of the LLM layer. Every call of the
+safe_generate functions in gpt_structure.py (and every embedding request) is
+recorded with the run_gpt_prompt function and the persona it was made for,
+its model, its token counts, its latency, the number of attempts it took and
+whether it ended in the fail-safe. The calls are aggregated into histograms
+by function, by model and by persona, which can be printed from open_server
+and are saved to the metrics folder of the simulation after every run.
+"""
+import bisect
+import json
+import sys
+import threading
+import time
+
+from persona.prompt_template.rate_limiter import estimate_tokens
+
+
+# The upper bounds of the buckets of the latency (in seconds) and token
+# histograms. The last bucket of each has no upper bound.
+LATENCY_BUCKETS = [0.05, 0.1, 0.25, 0.5, 1, 2, 4, 8, 16, 32, 64]
+TOKEN_BUCKETS = [16, 32, 64, 128, 256, 512, 1024, 2048, 4096, 8192]
+
+
+def get_llm_caller(max_depth=16):
+  """
+  Walks up the stack to the run_gpt_prompt function that made the current
+  LLM call, and returns its name and the name of the persona it was called
+  for.
+
+  INPUT:
+    max_depth: the number of frames to look through.
+  OUTPUT:
+    a (function name, persona name) tuple. Either is None if it could not be
+    found. e.g., ("run_gpt_prompt_wake_up_hour", "Isabella Rodriguez")
+  """
+  frame = sys._getframe(1)
+  for _ in range(max_depth):
+    if not frame:
+      break
+    function_name = frame.f_code.co_name
+    if function_name.startswith("run_gpt_prompt"):
+      persona = (frame.f_locals.get("persona")
+                 or frame.f_locals.get("init_persona"))
+      return function_name, getattr(persona, "name", None)
+    frame = frame.f_back
+  return None, None
+
+
+def get_token_counts(prompt, response):
+  """
+  Returns the prompt and completion token counts of a response. These are
+  the counts the provider reported when the response carries them (see
+  LLMResponse in llm_client.py), and estimates otherwise.
+
+  INPUT:
+    prompt: the str prompt (or the list of texts that were embedded).
+    response: the response of the LLM client.
+  OUTPUT:
+    a (prompt tokens, completion tokens) tuple of int.
+  """
+  usage = getattr(response, "usage", None)
+  if usage:
+    return usage["prompt_tokens"], usage.get("completion_tokens", 0)
+  if isinstance(response, str):
+    return estimate_tokens(prompt), estimate_tokens(response)
+  return estimate_tokens(prompt), 0
+
+
+class Histogram:
+  def __init__(self, bounds):
+    # <bounds> are the upper bounds of the buckets, in increasing order.
+    # <counts> has one more entry than <bounds>, for the values above the
+    # last bound.
+    self.bounds = bounds
+    self.counts = [0] * (len(bounds) + 1)
+    self.count = 0
+    self.total = 0
+    self.min = None
+    self.max = None
+
+
+  def add(self, value):
+    self.counts[bisect.bisect_left(self.bounds, value)] += 1
+    self.count += 1
+    self.total += value
+    self.min = value if self.min is None else min(self.min, value)
+    self.max = value if self.max is None else max(self.max, value)
+
+
+  def get_percentile(self, q):
+    """
+    Returns an upper bound of the <q>-th percentile (e.g., 0.95): the upper
+    bound of the bucket it falls into (or the largest value seen, for the
+    last bucket).
+    """
+    if not self.count:
+      return None
+    rank = q * self.count
+    seen = 0
+    for i, count in enumerate(self.counts):
+      seen += count
+      if seen >= rank and count:
+        if i == len(self.bounds):
+          return self.max
+        return min(self.bounds[i], self.max)
+    return self.max
+
+
+  def to_dict(self):
+    return {"count": self.count,
+            "total": self.total,
+            "mean": self.total / self.count if self.count else None,
+            "min": self.min,
+            "max": self.max,
+            "p50": self.get_percentile(0.5),
+            "p95": self.get_percentile(0.95),
+            "bounds": self.bounds,
+            "counts": self.counts}
+
+
+class CallStats:
+  def __init__(self):
+    # <calls> counts the calls, <requests> the requests they sent to the
+    # model (a call that is retried sends several), <cache_hits> the calls
+    # answered by the LLM response cache, and <fail_safes> the calls whose
+    # every attempt failed validation.
+    self.calls = 0
+    self.requests = 0
+    self.retries = 0
+    self.cache_hits = 0
+    self.fail_safes = 0
+    self.prompt_tokens = 0
+    self.completion_tokens = 0
+    self.latency = Histogram(LATENCY_BUCKETS)
+    self.tokens = Histogram(TOKEN_BUCKETS)
+
+
+  def add(self, call):
+    self.calls += 1
+    self.requests += call.requests
+    self.retries += max(0, call.attempts - 1)
+    self.cache_hits += int(call.from_cache)
+    self.fail_safes += int(call.fail_safe)
+    self.prompt_tokens += call.prompt_tokens
+    self.completion_tokens += call.completion_tokens
+    self.latency.add(call.latency)
+    self.tokens.add(call.prompt_tokens + call.completion_tokens)
+
+
+  def to_dict(self):
+    return {"calls": self.calls,
+            "requests": self.requests,
+            "retries": self.retries,
+            "cache_hits": self.cache_hits,
+            "fail_safes": self.fail_safes,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "latency": self.latency.to_dict(),
+            "tokens": self.tokens.to_dict()}
+
+
+class LLMCall:
+  def __init__(self, telemetry, model, prompt, function=None, caller=None):
+    self.telemetry = telemetry
+    self.model = model
+    self.prompt = prompt
+    self.function, self.persona = caller or get_llm_caller()
+    if function:
+      self.function = function
+    self.start = time.perf_counter()
+
+    self.attempts = 0
+    self.requests = 0
+    self.from_cache = False
+    self.fail_safe = False
+    self.prompt_tokens = 0
+    self.completion_tokens = 0
+    self.latency = 0
+
+
+  def add_response(self, response, from_cache=False):
+    """
+    Records one attempt of the call and the response it got.
+
+    INPUT:
+      response: the response of the LLM client (or of the cache).
+      from_cache: whether the response came from the LLM response cache.
+    OUTPUT:
+      None
+    """
+    self.attempts += 1
+    if from_cache:
+      self.from_cache = True
+      return
+    self.requests += 1
+    prompt_tokens, completion_tokens = get_token_counts(self.prompt, response)
+    self.prompt_tokens += prompt_tokens
+    self.completion_tokens += completion_tokens
+
+
+  def finish(self, fail_safe=False):
+    self.fail_safe = fail_safe
+    self.latency = time.perf_counter() - self.start
+    self.telemetry.record(self)
+
+
+class LLMTelemetry:
+  def __init__(self):
+    self._lock = threading.Lock()
+    self.reset()
+
+
+  def reset(self):
+    """
+    Forgets every call recorded so far. Reverie does this at the start of
+    every run, so that each metrics file covers a single run.
+    """
+    with self._lock:
+      self.start_time = time.time()
+      self.total = CallStats()
+      self.by_function = dict()
+      self.by_model = dict()
+      self.by_persona = dict()
+
+
+  def start_call(self, model, prompt, function=None, caller=None):
+    """
+    Starts recording a call. The caller adds the response of every attempt
+    to the returned LLMCall and finishes it when the call is done.
+
+    INPUT:
+      model: the name of the model. e.g., "gpt-3.5-turbo"
+      prompt: the str prompt (or the list of texts to embed).
+      function: the name to record the call under. By default, the
+                run_gpt_prompt function that made the call.
+      caller: the (function name, persona name) pair of the call, as
+              returned by get_llm_caller, for calls that are recorded away
+              from the thread that made them. By default, it is looked up
+              on the stack.
+    OUTPUT:
+      an LLMCall.
+    """
+    return LLMCall(self, model, prompt, function, caller)
+
+
+  def record(self, call):
+    with self._lock:
+      self.total.add(call)
+      for stats, key in [(self.by_function, call.function or "unknown"),
+                         (self.by_model, call.model),
+                         (self.by_persona, call.persona or "none")]:
+        if key not in stats:
+          stats[key] = CallStats()
+        stats[key].add(call)
+
+
+  def to_dict(self):
+    with self._lock:
+      return {"start_time": self.start_time,
+              "end_time": time.time(),
+              "total": self.total.to_dict(),
+              "by_function": {k: v.to_dict()
+                              for k, v in self.by_function.items()},
+              "by_model": {k: v.to_dict() for k, v in self.by_model.items()},
+              "by_persona": {k: v.to_dict()
+                             for k, v in self.by_persona.items()}}
+
+
+  def save(self, outfile_path):
+    with open(outfile_path, "w") as outfile:
+      outfile.write(json.dumps(self.to_dict(), indent=2))
+
+
+  def get_str_summary(self):
+    """
+    Returns a table of the calls recorded so far by function, with the
+    functions that took the most total latency first.
+    """
+    summary = self.to_dict()
+    rows = sorted(summary["by_function"].items(),
+                  key=lambda i: -i[1]["latency"]["total"])
+    rows += [("TOTAL", summary["total"])]
+
+    ret_str = (f"{'function':<52}{'calls':>7}{'reqs':>7}{'cache':>7}"
+               + f"{'retry':>7}{'fail':>6}{'in tok':>9}{'out tok':>9}"
+               + f"{'total s':>9}{'p50 s':>8}{'p95 s':>8}\n")
+    for function, stats in rows:
+      latency = stats["latency"]
+      ret_str += (f"{function[:51]:<52}{stats['calls']:>7}"
+                  + f"{stats['requests']:>7}{stats['cache_hits']:>7}"
+                  + f"{stats['retries']:>7}{stats['fail_safes']:>6}"
+                  + f"{stats['prompt_tokens']:>9}"
+                  + f"{stats['completion_tokens']:>9}"
+                  + f"{latency['total']:>9.1f}"
+                  + f"{latency['p50'] or 0:>8.2f}"
+                  + f"{latency['p95'] or 0:>8.2f}\n")
+    return ret_str
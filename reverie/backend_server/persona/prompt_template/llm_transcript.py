@@ -0,0 +1,193 @@
+"""
+File: llm_transcript.py
+Description: Record and replay of LLM transcripts. RecordingBackend wraps
+any backend of the LLMClient (see llm_client.py) and appends every request
+it sends, with its response and latency, to a transcript file (one json
+object per line). ReplayBackend serves the responses of such a transcript
+back without any network access, so that a recorded simulation can be run
+again as a fixed workload, e.g., to benchmark pathfinding, retrieval or
+persistence.
+"""
+import asyncio
+import collections
+import hashlib
+import json
+import time
+
+
+def get_request_key(kind, model, prompt, params=None):
+  """
+  Returns the content address of a request.
+
+  INPUT:
+    kind: "chat", "completion" or "embeddings"
+    model: the name of the model. e.g., "gpt-3.5-turbo"
+    prompt: the str prompt (or the list of texts to embed).
+    params: the gpt_parameter dictionary of the request (or None).
+  OUTPUT:
+    a hex str.
+  """
+  key_str = json.dumps([kind, model, prompt, params], sort_keys=True)
+  return hashlib.sha256(key_str.encode("utf-8")).hexdigest()
+
+
+class ReplayMismatchError(Exception):
+  pass
+
+
+class RecordingBackend:
+  def __init__(self, backend, transcript_file):
+    # <backend> is the backend whose requests are recorded.
+    self.backend = backend
+    # <transcript_file> is appended to, so that several runs (e.g., several
+    # "run" commands of the same simulation) make up a single transcript.
+    self.transcript_file = transcript_file
+    self._outfile = None
+
+
+  def _write(self, entry):
+    # Only ever called from the client's loop, so the lines never interleave.
+    if not self._outfile:
+      self._outfile = open(self.transcript_file, "a", encoding="utf-8")
+    self._outfile.write(json.dumps(entry) + "\n")
+    self._outfile.flush()
+
+
+  async def _record(self, kind, model, prompt, params, coro):
+    entry = {"key": get_request_key(kind, model, prompt, params),
+             "kind": kind,
+             "model": model,
+             "prompt": prompt,
+             "params": params}
+    start = time.perf_counter()
+    try:
+      entry["response"] = await coro
+      return entry["response"]
+    except Exception as e:
+      # Failed requests are part of the workload too. They are replayed as
+      # errors.
+      entry["response"] = None
+      entry["error"] = repr(e)
+      raise
+    finally:
+      entry["latency"] = time.perf_counter() - start
+      self._write(entry)
+
+
+  async def chat(self, prompt, model):
+    return await self._record("chat", model, prompt, None,
+                              self.backend.chat(prompt, model))
+
+
+  async def completion(self, prompt, gpt_parameter):
+    return await self._record("completion", gpt_parameter["engine"], prompt,
+                              gpt_parameter,
+                              self.backend.completion(prompt, gpt_parameter))
+
+
+  async def embeddings(self, texts, model):
+    return await self._record("embeddings", model, texts, None,
+                              self.backend.embeddings(texts, model))
+
+
+  async def close(self):
+    await self.backend.close()
+    if self._outfile:
+      self._outfile.close()
+      self._outfile = None
+
+
+class ReplayBackend:
+  def __init__(self, transcript_file, mode="hash", replay_latency=False):
+    # <mode> is how a request is matched to the transcript.
+    #   "hash": by the content of the request. Identical requests get their
+    #           recorded responses in order, and the last one once those run
+    #           out. Embeddings are matched text by text, so they can be
+    #           batched differently than when they were recorded.
+    #   "order": the n-th request gets the n-th response, and must be the
+    #            same request that was recorded. This only works when the
+    #            personas are stepped one after another.
+    self.mode = mode
+    # <replay_latency> makes every request wait as long as it took when it
+    # was recorded.
+    self.replay_latency = replay_latency
+
+    self.entries = []
+    with open(transcript_file, encoding="utf-8") as infile:
+      for line in infile:
+        if line.strip():
+          self.entries += [json.loads(line)]
+    self._by_key = dict()
+    self._embeddings = dict()
+    for entry in self.entries:
+      self._by_key.setdefault(entry["key"], collections.deque()).append(entry)
+      if entry["kind"] == "embeddings" and "error" not in entry:
+        for text, embedding in zip(entry["prompt"], entry["response"]):
+          self._embeddings[(entry["model"], text)] = embedding
+    self._next = 0
+
+    # <replayed> counts the requests that were served from the transcript,
+    # and <mismatches> the ones that were not in it.
+    self.replayed = 0
+    self.mismatches = 0
+
+
+  def _mismatch(self, message):
+    self.mismatches += 1
+    print (f"REPLAY MISMATCH: {message}")
+    return ReplayMismatchError(message)
+
+
+  def _get_entry(self, kind, model, prompt, params):
+    key = get_request_key(kind, model, prompt, params)
+    if self.mode == "order":
+      if self._next >= len(self.entries):
+        raise self._mismatch(f"the transcript ended before this {kind} "
+                             + "request")
+      entry = self.entries[self._next]
+      if entry["key"] != key:
+        raise self._mismatch(f"request {self._next} is a different {kind} "
+                             + "request than the one recorded")
+      self._next += 1
+    else:
+      queue = self._by_key.get(key)
+      if not queue:
+        raise self._mismatch(f"this {kind} request is not in the transcript")
+      entry = queue[0]
+      if len(queue) > 1:
+        queue.popleft()
+    self.replayed += 1
+    return entry
+
+
+  async def _replay(self, kind, model, prompt, params):
+    entry = self._get_entry(kind, model, prompt, params)
+    if self.replay_latency:
+      await asyncio.sleep(entry["latency"])
+    if "error" in entry:
+      raise RuntimeError(f"Replayed error: {entry['error']}")
+    return entry["response"]
+
+
+  async def chat(self, prompt, model):
+    return await self._replay("chat", model, prompt, None)
+
+
+  async def completion(self, prompt, gpt_parameter):
+    return await self._replay("completion", gpt_parameter["engine"], prompt,
+                              gpt_parameter)
+
+
+  async def embeddings(self, texts, model):
+    if self.mode == "order":
+      return await self._replay("embeddings", model, texts, None)
+    missing = [i for i in texts if (model, i) not in self._embeddings]
+    if missing:
+      raise self._mismatch(f"{len(missing)} of the texts to embed are not in "
+                           + "the transcript")
+    self.replayed += 1
+    return [self._embeddings[(model, i)] for i in texts]
+
+
+  async def close(self):
+    pass
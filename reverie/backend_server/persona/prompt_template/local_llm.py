@@ -0,0 +1,712 @@
+"""
+File: local_llm.py
+Description: A local, deterministic stand-in for the OpenAI APIs that is
+used for offline load testing. LocalLLMBackend can be plugged into the
+LLMClient (see llm_client.py) in place of OpenAIBackend, and answers every
+prompt of run_gpt_prompt.py with a response that passes its validation.
+Embeddings are hashed bags of words, so texts that share words are still
+close to each other. Responses only depend on the prompt and the seed, and
+the latency of each request is drawn from a configurable distribution.
+
+The same stand-in can be served over HTTP as an OpenAI-compatible endpoint
+(point <openai_api_base> to it), which also exercises the real client:
+  python local_llm.py --port 8931
+"""
+import asyncio
+import hashlib
+import json
+import math
+import random
+import re
+
+import numpy as np
+
+
+def get_rng(*keys):
+  """
+  Returns a random.Random that is seeded by <keys>, so that the same keys
+  always give the same draws (unlike hash(), which is salted per process).
+  """
+  key_str = json.dumps(keys, sort_keys=True, default=str)
+  digest = hashlib.sha256(key_str.encode("utf-8")).digest()
+  return random.Random(int.from_bytes(digest[:8], "big"))
+
+
+def sample_latency(distribution, rng):
+  """
+  Draws the latency of a single request.
+
+  INPUT:
+    distribution: None or 0 for no latency, a number of seconds for a fixed
+                  latency, or a tuple of the form
+                    ("fixed", seconds)
+                    ("uniform", low, high)
+                    ("normal", mean, standard deviation)
+                    ("lognormal", median, sigma)
+    rng: a random.Random
+  OUTPUT:
+    the latency in seconds.
+  """
+  if not distribution:
+    return 0
+  if isinstance(distribution, (int, float)):
+    return distribution
+  kind, *params = distribution
+  if kind == "fixed":
+    return params[0]
+  if kind == "uniform":
+    return rng.uniform(params[0], params[1])
+  if kind == "normal":
+    return max(0, rng.gauss(params[0], params[1]))
+  if kind == "lognormal":
+    return params[0] * math.exp(rng.gauss(0, params[1]))
+  raise ValueError(f"Unknown latency distribution: {kind}")
+
+
+def hash_embedding(text, dimensions=1536):
+  """
+  Returns a unit-length embedding of <text> in which every word is hashed
+  into one of <dimensions> signed buckets.
+
+  INPUT:
+    text: a str
+    dimensions: the length of the embedding (1536 for text-embedding-ada-002)
+  OUTPUT:
+    a list of float
+  """
+  vector = np.zeros(dimensions, dtype=np.float32)
+  tokens = re.findall(r"[a-z0-9']+", text.lower()) or [text]
+  for token in tokens:
+    digest = hashlib.md5(token.encode("utf-8")).digest()
+    index = int.from_bytes(digest[:4], "little") % dimensions
+    if digest[4] & 1:
+      vector[index] += 1
+    else:
+      vector[index] -= 1
+  norm = np.linalg.norm(vector)
+  if norm == 0:
+    vector[0] = 1
+    norm = 1
+  return [round(float(i), 6) for i in vector / norm]
+
+
+# ============================================================================
+# ########################[SECTION 1: PROMPT HELPERS] ########################
+# ============================================================================
+
+def _last_match(pattern, text, default=None, flags=0):
+  matches = re.findall(pattern, text, flags)
+  if not matches:
+    return default
+  return matches[-1]
+
+
+def _split_options(options_str):
+  return [i.strip() for i in options_str.split(",") if i.strip()]
+
+
+def _clean(text):
+  # Keeps generated text clear of the characters that the parsers of
+  # run_gpt_prompt.py split on.
+  text = re.sub(r'["{}()\[\]]', "", text)
+  return text.replace(". ", ", ").strip().rstrip(".")
+
+
+def _get_hour(hour_str):
+  # <hour_str> is of the form "07:00 AM" (with "00:00 AM" for midnight).
+  hour = int(hour_str[:2]) % 12
+  if hour_str.strip().endswith("PM"):
+    hour += 12
+  return hour
+
+
+_HOURLY_ACTIVITIES = [(7, "sleeping"),
+                      (8, "waking up and completing the morning routine"),
+                      (9, "having breakfast"),
+                      (12, "working on the day's tasks"),
+                      (13, "having lunch"),
+                      (17, "working on the day's tasks"),
+                      (18, "taking a walk around town"),
+                      (19, "having dinner"),
+                      (22, "relaxing and reading a book"),
+                      (23, "getting ready for bed"),
+                      (24, "sleeping")]
+
+_EMOJIS = [("sleep", "😴"), ("bed", "😴"), ("breakfast", "🍳"),
+           ("lunch", "🍽"), ("dinner", "🍽"), ("eat", "🍽"), ("cook", "🍳"),
+           ("coffee", "☕"), ("work", "💼"), ("read", "📖"), ("stud", "📚"),
+           ("walk", "🚶"), ("talk", "💬"), ("convers", "💬"), ("chat", "💬"),
+           ("shower", "🚿"), ("bath", "🛁"), ("paint", "🎨"), ("music", "🎵"),
+           ("write", "✍"), ("clean", "🧹"), ("shop", "🛒")]
+
+_EMOTIVE_KEYWORDS = ["calm", "content", "curious", "busy", "cheerful",
+                     "tired", "focused", "relaxed"]
+
+_STOPWORDS = {"about", "after", "with", "that", "this", "from", "their",
+              "there", "they", "have", "will", "were", "what", "when", "into"}
+
+
+# ============================================================================
+# #####################[SECTION 2: COMPLETION RESPONDERS] ####################
+# ============================================================================
+# Each responder gets the full prompt of a completion request (see the v1 and
+# v2 templates) and returns the text that continues it.
+
+def _wake_up_hour(prompt, rng):
+  return " " + rng.choice(["6am", "7am", "7am", "8am"])
+
+
+def _daily_plan(prompt, rng):
+  plan = ["have breakfast at 8:00 am",
+          "work on the day's tasks from 9:00 am to 12:00 pm",
+          "have lunch at 12:00 pm",
+          "continue working from 1:00 pm to 5:00 pm",
+          "take a walk around town at 5:00 pm",
+          "have dinner at 6:00 pm",
+          "relax and read a book from 7:00 pm to 10:00 pm"]
+  response = ""
+  for count, i in enumerate(plan):
+    response += f" {i}, {count + 3})"
+  return response + " go to bed at 11:00 pm."
+
+
+def _get_hourly_activity(hour):
+  for end_hour, activity in _HOURLY_ACTIVITIES:
+    if hour < end_hour:
+      return activity
+  return "sleeping"
+
+
+def _hourly_schedule(prompt, rng):
+  hour_str = _last_match(r"-- (\d\d:\d\d [AP]M)\] Activity:", prompt,
+                         "00:00 AM")
+  return " " + _get_hourly_activity(_get_hour(hour_str))
+
+
+def _task_decomp(prompt, rng):
+  match = _last_match(r"list the subtasks .*? does when .*? is (.*) from .* "
+                      + r"\(total duration in minutes (\d+)\):", prompt)
+  task, duration = match if match else ("doing the task", "60")
+  task = _clean(task)
+  duration = max(5, int(duration) - int(duration) % 5)
+  first_name = _last_match(r"\n1\) (\S+) is$", prompt.rstrip(), "")
+
+  count = min(duration // 5, rng.randint(2, 6))
+  cuts = sorted(rng.sample(range(5, duration, 5), count - 1))
+  durations = [j - i for i, j in zip([0] + cuts, cuts + [duration])]
+  subtasks = [f"getting ready for {task}"]
+  subtasks += [rng.choice([task, f"continuing {task}"])
+               for _ in range(count - 2)]
+  subtasks += [f"wrapping up {task}"]
+  if count == 1:
+    subtasks = [task]
+
+  lines = []
+  minutes_left = duration
+  for i, (subtask, subtask_duration) in enumerate(zip(subtasks, durations)):
+    minutes_left -= subtask_duration
+    line = f"{subtask}. (duration in minutes: {subtask_duration}, "
+    line += f"minutes left: {minutes_left})"
+    if i == 0:
+      lines += [" " + line]
+    else:
+      lines += [f"{i + 1}) {first_name} is {line}"]
+  return "\n".join(lines)
+
+
+def _action_sector(prompt, rng):
+  options = _split_options(_last_match(r"Area options: \{(.*?)\}", prompt, ""))
+  current = _last_match(r"is currently in \{(.*?)\}", prompt)
+  home = _last_match(r"lives in \{(.*?)\}", prompt)
+  if home in options and "sleep" in prompt.split("\n")[-1]:
+    return home + "}"
+  if current in options and rng.random() < 0.6:
+    return current + "}"
+  return rng.choice(options or ["kitchen"]) + "}"
+
+
+def _action_arena(prompt, rng):
+  options = _last_match(r"\(MUST pick one of \{(.*?)\}\):", prompt, "")
+  return rng.choice(_split_options(options) or ["kitchen"]) + "}"
+
+
+def _action_game_object(prompt, rng):
+  options = _last_match(r"Objects available: \{(.*?)\}", prompt, "")
+  return " " + rng.choice(_split_options(options) or ["bed"])
+
+
+def _event_triple(prompt, rng):
+  line = prompt.split("Input: ")[-1].split("\n")[0].strip().rstrip(".")
+  action = line.split(" is ", 1)[-1]
+  words = action.replace(",", "").split()
+  if len(words) <= 1:
+    return f" is, {(words or ['idle'])[0]})"
+  return f" {words[0]}, {' '.join(words[1:])})"
+
+
+def _new_decomp_schedule(prompt, rng):
+  end_time = _last_match(r"schedule from .*? to (\d\d:\d\d) .. accordingly",
+                         prompt, "23:59")
+  start_time = prompt.rstrip().split("\n")[-1].split("~")[0].strip()
+  original_plan = re.findall(r"^(\d\d:\d\d) ~ (\d\d:\d\d) -- (.*)$",
+                             prompt.split("The revised schedule:")[0],
+                             re.M)
+  action = original_plan[-1][2] if original_plan else "idle"
+  for plan_start, plan_end, plan_action in original_plan:
+    if plan_start <= start_time < plan_end:
+      action = plan_action
+      break
+  return f" {end_time} -- {action}"
+
+
+def _decide_to_talk(prompt, rng):
+  names = _last_match(r"Question: Would (.*?) initiate a conversation with "
+                      + r"(.*?)\?", prompt, ("They", "each other"))
+  answer = "yes" if rng.random() < 0.35 else "no"
+  response = f" {names[0]} and {names[1]} are in the same place right now."
+  return response + f"\n\nAnswer in yes or no: {answer}"
+
+
+def _decide_to_react(prompt, rng):
+  option = "1" if rng.random() < 0.2 else "2"
+  response = "Their actions do not need the same space at the same time."
+  return response + f"\nAnswer: Option {option}"
+
+
+def _create_conversation(prompt, rng):
+  names = _last_match(r"\n(.*?) and (.*?) are in .*?\. What would they "
+                      + r"talk about now\?", prompt, ("A", "B"))
+  a, b = names
+  response = f'Hi {b}, how is your day going?"\n'
+  response += f'{b}: "Hi {a}! It is going well, thanks for asking."\n'
+  response += f'{a}: "Glad to hear it. See you later!"\n'
+  response += f'{b}: "See you!"'
+  return response
+
+
+def _extract_keywords(prompt, rng):
+  description = prompt.split("Description of an event or a conversation: ")
+  words = re.findall(r"[a-z']+", description[-1].split("\n")[0].lower())
+  factual = []
+  for i in words:
+    if len(i) > 3 and i not in _STOPWORDS and i not in factual:
+      factual += [i]
+  emotive = rng.sample(_EMOTIVE_KEYWORDS, 2)
+  return f" {', '.join(factual[:4])}\nEmotive keywords: {', '.join(emotive)}"
+
+
+def _keyword_to_thoughts(prompt, rng):
+  keyword = _last_match(r'happened about "(.*?)"', prompt, "this")
+  name = _last_match(r"Here is what (.*?) thinks about these", prompt, "They")
+  return f" {name} thinks that {keyword} is part of an ordinary day."
+
+
+def _convo_to_thoughts(prompt, rng):
+  names = _last_match(r"Summarize what (.*?) thought about (.*?) in one "
+                      + r"short sentence", prompt, ("They", "it"))
+  return f" {names[0]} thought that {names[1]} was pleasant to talk to."
+
+
+def _get_focal_points(prompt, rng):
+  n = int(_last_match(r"what are (\d+) most salient", prompt, "3"))
+  statements = prompt.split("\n\nGiven only the information above")[0]
+  statements = [_clean(i) for i in statements.split("\n") if i.strip()]
+  questions = []
+  for i in range(n):
+    statement = rng.choice(statements or ["this"])
+    questions += [f"What does it mean that {statement}"]
+  return questions
+
+
+def _focal_pt(prompt, rng):
+  questions = _get_focal_points(prompt, rng)
+  response = " " + questions[0]
+  for count, i in enumerate(questions[1:]):
+    response += f"\n{count + 2}) {i}"
+  return response
+
+
+def _insight_and_evidence(prompt, rng):
+  n = int(_last_match(r"What (\d+) high-level insights", prompt, "5"))
+  statements = prompt.split("Input:\n")[-1].split("\n\nWhat ")[0]
+  statements = re.findall(r"^(\d+)\. (.*)$", statements, re.M) or [("0", "")]
+  response = ""
+  for i in range(n):
+    evidence = rng.sample(statements, min(len(statements),
+                                          rng.randint(1, 3)))
+    insight = _clean(evidence[0][1]).replace(", ", " and ")
+    insight = f"It matters that {insight}"
+    evidence = ", ".join(sorted(j[0] for j in evidence))
+    if i == 0:
+      response += f" {insight} (because of {evidence})"
+    else:
+      response += f"\n{i + 1}. {insight} (because of {evidence})"
+  return response
+
+
+def _generate_next_convo_line(prompt, rng):
+  return rng.choice(["That sounds great, let's talk more about it later.",
+                     "I have been keeping busy today.",
+                     "Good to see you!"]) + '"'
+
+
+def _whisper_inner_thought(prompt, rng):
+  name = _last_match(r"into a statement about (.*?)\. ", prompt, "They")
+  thought = _clean(_last_match(r'Thought: "(.*)"', prompt, "something"))
+  return f'{name} is thinking that {thought}."'
+
+
+def _planning_thought_on_convo(prompt, rng):
+  return ' should keep the conversation in mind when planning the day."'
+
+
+def _memo_on_convo(prompt, rng):
+  return ' found the conversation interesting."'
+
+
+# <completion_responders> maps a text that only occurs in one prompt template
+# to the responder of that template. The first match wins.
+completion_responders = [
+  ("'s wake up hour:", _wake_up_hour),
+  ("'s plan today in broad-strokes", _daily_plan),
+  ("Hourly schedule format:", _hourly_schedule),
+  ("In 5 min increments, list the subtasks", _task_decomp),
+  ("should go to the following area: {", _action_sector),
+  ("(MUST pick one of {", _action_arena),
+  ("Pick ONE most relevant object from the objects available:",
+   _action_game_object),
+  ("Turn the input into (subject, predicate, object).", _event_triple),
+  ("The revised schedule:", _new_decomp_schedule),
+  ("initiate a conversation with", _decide_to_talk),
+  ("Option 2: Continue on to", _decide_to_react),
+  ("What would they talk about now?", _create_conversation),
+  ("Factually descriptive keywords:", _extract_keywords),
+  ("The following events/thoughts happened about", _keyword_to_thoughts),
+  ("in one short sentence. The sentence needs to be in third person",
+   _convo_to_thoughts),
+  ("most salient high-level questions", _focal_pt),
+  ("high-level insights can you infer", _insight_and_evidence),
+  ("(Note -- This is the only information that", _generate_next_convo_line),
+  ("Translate the following thought into a statement about",
+   _whisper_inner_thought),
+  ("need to remember for her planning", _planning_thought_on_convo),
+  ("might have found interesting from", _memo_on_convo),
+]
+
+
+def generate_completion_response(prompt, rng):
+  """
+  Returns the stand-in's continuation of a completion prompt.
+  """
+  for signature, responder in completion_responders:
+    if signature in prompt:
+      return responder(prompt, rng)
+  return " idle"
+
+
+# ============================================================================
+# ########################[SECTION 3: CHAT RESPONDERS] #######################
+# ============================================================================
+# Most chat prompts are v3_ChatGPT templates that ChatGPT_safe_generate_response
+# wrapped in a request for {"output": ...} json. Their responders get the
+# inner prompt and the example output, and return the value of "output".
+
+def _pronunciatio(prompt, example_output, rng):
+  action = prompt.split("Action description:")[-1].lower()
+  for keyword, emoji in _EMOJIS:
+    if keyword in action:
+      return emoji
+  return "🙂"
+
+
+def _act_obj_desc(prompt, example_output, rng):
+  return rng.choice(["being used", "in use", "occupied"])
+
+
+def _summarize_conversation(prompt, example_output, rng):
+  names = []
+  for i in re.findall(r'^(.*?): "', prompt, re.M):
+    if i not in names:
+      names += [i]
+  if len(names) < 2:
+    return "how the day is going"
+  return f"how the day is going between {names[0]} and {names[1]}"
+
+
+def _poignancy(prompt, example_output, rng):
+  return str(rng.choice([1, 2, 2, 3, 3, 3, 4, 4, 5, 6, 8]))
+
+
+def _poignancy_batch(prompt, example_output, rng):
+  items = re.findall(r"^\d+\. (?:Event|Conversation): ", prompt, re.M)
+  return [int(_poignancy(prompt, example_output, rng)) for _ in items]
+
+
+def _full_hourly_schedule(prompt, example_output, rng):
+  hours = re.findall(r"^\d+\. (\d\d:\d\d [AP]M)$", prompt, re.M)
+  return [_get_hourly_activity(_get_hour(i)) for i in hours]
+
+
+def _chat_focal_pt(prompt, example_output, rng):
+  return json.dumps(_get_focal_points(prompt, rng))
+
+
+def _agent_chat(prompt, example_output, rng):
+  names = re.findall(r"\(This is what is in (.*?)'s head:", prompt)
+  a, b = (names + ["A", "B"])[:2]
+  return [[a, f"Hi {b}, how is your day going?"],
+          [b, f"Hi {a}! It is going well, thanks for asking."],
+          [a, "Glad to hear it. See you later!"],
+          [b, "See you!"]]
+
+
+def _action_details(prompt, example_output, rng):
+  tree = json.loads(_last_match(r"the objects in each room:\n(.*?)\n", prompt,
+                                "{}"))
+  current = _last_match(r"is currently in \{(.*?)\}", prompt)
+  home = _last_match(r"lives in \{(.*?)\}", prompt)
+  action = _last_match(r"Action description: (.*?)\n", prompt, "idle")
+  if home in tree and "sleep" in action:
+    sector = home
+  elif current in tree and rng.random() < 0.6:
+    sector = current
+  else:
+    sector = rng.choice(sorted(tree) or ["kitchen"])
+  arenas = tree.get(sector) or {"kitchen": []}
+  arena = rng.choice(sorted(arenas))
+  game_object = rng.choice(arenas[arena] or ["<random>"])
+
+  words = action.split("(")[-1].rstrip(")").replace(",", "").split()
+  if len(words) <= 1:
+    event = ["is", (words or ["idle"])[0]]
+  else:
+    event = [words[0], " ".join(words[1:])]
+  state = _act_obj_desc(prompt, example_output, rng)
+  return {"sector": sector,
+          "arena": arena,
+          "game_object": game_object,
+          "emoji": _pronunciatio(f"Action description: {action}",
+                                 example_output, rng),
+          "event": event,
+          "object_state": state,
+          "object_emoji": "🙂",
+          "object_event": ["is", state]}
+
+
+# <chat_json_responders> maps a text that only occurs in one v3_ChatGPT
+# template to the responder of that template. The first match wins.
+chat_json_responders = [
+  ("Convert an action description to an emoji", _pronunciatio),
+  ("We want to understand the state of an object", _act_obj_desc),
+  ("This is a conversation about", _summarize_conversation),
+  ("Rate (return a number between 1 to 10):", _poignancy),
+  ("items above, in order (return a list of", _poignancy_batch),
+  ("Decide where", _action_details),
+  ("activities, one for each hour above", _full_hourly_schedule),
+  ("most salient high-level questions", _chat_focal_pt),
+  ("Here is their conversation.", _agent_chat),
+]
+
+
+def _iterative_convo(prompt, rng):
+  names = _last_match(r"what should (.*?) say to (.*?) next in the "
+                      + r"conversation", prompt, ("A", "B"))
+  a, b = names
+  convo = prompt.split("Here is their conversation so far: \n")[-1]
+  convo = convo.split("\n---\nTask:")[0]
+  turns = 0
+  if "[The conversation has not started yet" not in convo:
+    turns = len([i for i in convo.split("\n") if ": " in i])
+  length = get_rng(*sorted(names)).randint(3, 8)
+
+  if turns == 0:
+    utterance = f"Hi {b}! How is your day going?"
+  elif turns + 1 >= length:
+    utterance = "It was good talking to you, see you later!"
+  else:
+    utterance = rng.choice(["That sounds nice.",
+                            "I have been busy with work today.",
+                            "Do you have any plans for the evening?",
+                            "I was just thinking about that too."])
+  return json.dumps({a: utterance,
+                     f"Did the conversation end with {a}'s utterance?":
+                     str(turns + 1 >= length).lower()})
+
+
+def _safety_score(prompt, rng):
+  return json.dumps({"output": 1})
+
+
+def _revise_status(prompt, rng):
+  name = _last_match(r"write (.*?)'s status for", prompt, "They")
+  return f"Status: {name} is going about the usual routine."
+
+
+def _revise_daily_req(prompt, rng):
+  return ("1. wake up and complete the morning routine at 7:00 am, "
+          + "2. have breakfast at 8:00 am, "
+          + "3. work on the day's tasks from 9:00 am to 12:00 pm, "
+          + "4. have lunch at 12:00 pm, "
+          + "5. continue working from 1:00 pm to 5:00 pm, "
+          + "6. have dinner at 6:00 pm")
+
+
+# <chat_responders> handles the chat prompts that are not wrapped in a json
+# request (the _OLD ones, and the free-form prompts of plan.py).
+chat_responders = [
+  ("Did the conversation end with", _iterative_convo),
+  ("Rate the concern on a 1 to 10 scale", _safety_score),
+  ("Status: <new status>", _revise_status),
+  ("1. wake up and complete the morning routine at <time>",
+   _revise_daily_req),
+]
+
+
+def generate_chat_response(prompt, rng):
+  """
+  Returns the stand-in's response to a chat prompt.
+  """
+  match = re.match(r'"""\n(.*)\n"""\nOutput the response to the prompt above '
+                   + r'in json\..*\nExample output json:\n\{"output": "(.*)"\}$',
+                   prompt, re.S)
+  if match:
+    inner_prompt, example_output = match.groups()
+    output = example_output
+    for signature, responder in chat_json_responders:
+      if signature in inner_prompt:
+        output = responder(inner_prompt, example_output, rng)
+        break
+    return json.dumps({"output": output}, ensure_ascii=False)
+
+  for signature, responder in chat_responders:
+    if signature in prompt:
+      return responder(prompt, rng)
+  return "Nothing in particular comes to mind."
+
+
+# ============================================================================
+# ##########################[SECTION 4: THE BACKEND] #########################
+# ============================================================================
+
+class LocalLLMBackend:
+  def __init__(self, latency=None, seed=0, embedding_dimensions=1536):
+    # <latency> maps a kind of request ("chat", "completion" or
+    # "embeddings") to the distribution its latency is drawn from (see
+    # sample_latency). Kinds that are not listed are answered right away.
+    # e.g., {"chat": ("lognormal", 1.0, 0.5)}
+    self.latency = dict(latency or {})
+    # <seed> changes every response and latency of the stand-in at once.
+    self.seed = seed
+    self.embedding_dimensions = embedding_dimensions
+
+    # <calls> counts the requests of each kind that the stand-in answered,
+    # and <total_latency> the seconds it spent waiting on them.
+    self.calls = {"chat": 0, "completion": 0, "embeddings": 0}
+    self.total_latency = 0
+
+
+  async def _wait(self, kind, key):
+    delay = sample_latency(self.latency.get(kind),
+                           get_rng(self.seed, "latency", kind, key))
+    self.calls[kind] += 1
+    self.total_latency += delay
+    if delay > 0:
+      await asyncio.sleep(delay)
+
+
+  async def chat(self, prompt, model):
+    await self._wait("chat", prompt)
+    return generate_chat_response(prompt, get_rng(self.seed, model, prompt))
+
+
+  async def completion(self, prompt, gpt_parameter):
+    await self._wait("completion", prompt)
+    rng = get_rng(self.seed, gpt_parameter["engine"], prompt)
+    return generate_completion_response(prompt, rng)
+
+
+  async def embeddings(self, texts, model):
+    await self._wait("embeddings", texts)
+    return [hash_embedding(i, self.embedding_dimensions) for i in texts]
+
+
+  async def close(self):
+    pass
+
+
+def serve(host="127.0.0.1", port=8931, latency=None, seed=0):
+  """
+  Serves the stand-in as an OpenAI-compatible HTTP endpoint until the
+  process is stopped. Point <openai_api_base> to http://<host>:<port>/v1
+  to use it.
+  """
+  from aiohttp import web
+
+  backend = LocalLLMBackend(latency, seed)
+
+  def get_usage(prompt, response):
+    prompt_tokens = len(prompt.split())
+    completion_tokens = len(response.split())
+    return {"prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens}
+
+  async def chat_completions(request):
+    body = await request.json()
+    prompt = body["messages"][-1]["content"]
+    content = await backend.chat(prompt, body["model"])
+    return web.json_response({
+      "object": "chat.completion",
+      "model": body["model"],
+      "choices": [{"index": 0,
+                   "message": {"role": "assistant", "content": content},
+                   "finish_reason": "stop"}],
+      "usage": get_usage(prompt, content)})
+
+  async def completions(request):
+    body = await request.json()
+    prompt = body["prompt"]
+    text = await backend.completion(prompt, {"engine": body["model"]})
+    return web.json_response({
+      "object": "text_completion",
+      "model": body["model"],
+      "choices": [{"index": 0, "text": text, "finish_reason": "stop"}],
+      "usage": get_usage(prompt, text)})
+
+  async def embeddings(request):
+    body = await request.json()
+    texts = body["input"]
+    if isinstance(texts, str):
+      texts = [texts]
+    vectors = await backend.embeddings(texts, body["model"])
+    tokens = sum(len(i.split()) for i in texts)
+    return web.json_response({
+      "object": "list",
+      "model": body["model"],
+      "data": [{"object": "embedding", "index": count, "embedding": i}
+               for count, i in enumerate(vectors)],
+      "usage": {"prompt_tokens": tokens, "total_tokens": tokens}})
+
+  app = web.Application()
+  app.add_routes([web.post("/v1/chat/completions", chat_completions),
+                  web.post("/v1/completions", completions),
+                  web.post("/v1/embeddings", embeddings)])
+  web.run_app(app, host=host, port=port)
+
+
+if __name__ == '__main__':
+  import argparse
+
+  parser = argparse.ArgumentParser(
+             description="Serve the local LLM stand-in over HTTP.")
+  parser.add_argument("--host", default="127.0.0.1")
+  parser.add_argument("--port", type=int, default=8931)
+  parser.add_argument("--seed", type=int, default=0)
+  parser.add_argument("--latency", default=None,
+                      help='json, e.g. \'{"chat": ["lognormal", 1.0, 0.5]}\'')
+  args = parser.parse_args()
+
+  latency = None
+  if args.latency:
+    latency = json.loads(args.latency)
+  serve(args.host, args.port, latency, args.seed)
@@ -0,0 +1,109 @@
+"""
+File: prompt_registry.py
+Description: A registry of the prompt template files that generate_prompt
+(see gpt_structure.py) fills in. Every template under the template folders
+is read and compiled once, when the registry is created, instead of being
+read from disk on every LLM call.
+
+A template file holds a comment block, then the
+<commentblockmarker>###</commentblockmarker> line, then the prompt itself,
+with a !<INPUT n>! placeholder for each of its inputs.
+"""
+import os
+import re
+import threading
+
+
+COMMENT_BLOCK_MARKER = "<commentblockmarker>###</commentblockmarker>"
+PLACEHOLDER_PATTERN = re.compile(r"!<INPUT (\d+)>!")
+
+# The folders (relative to this file) whose templates are loaded up front.
+TEMPLATE_FOLDERS = ["v1", "v2", "v3_ChatGPT", "safety"]
+
+
+class PromptTemplate:
+  def __init__(self, template_file, text):
+    self.template_file = template_file
+
+    # Only the part after the comment block is ever sent, so that is all we
+    # keep.
+    if COMMENT_BLOCK_MARKER in text:
+      text = text.split(COMMENT_BLOCK_MARKER)[1]
+
+    # <segments> alternates between the literal text of the prompt (at the
+    # even positions) and the index of the input that goes between two
+    # literals (at the odd positions). e.g., for "Name: !<INPUT 0>!\n" it is
+    # ["Name: ", 0, "\n"]
+    self.segments = []
+    start = 0
+    for match in PLACEHOLDER_PATTERN.finditer(text):
+      self.segments += [text[start:match.start()], int(match.group(1))]
+      start = match.end()
+    self.segments += [text[start:]]
+
+    # <input_count> is the number of inputs the template needs.
+    indices = self.segments[1::2]
+    self.input_count = max(indices) + 1 if indices else 0
+
+
+  def fill(self, curr_input):
+    """
+    Returns the prompt with each !<INPUT n>! placeholder replaced by the n-th
+    input.
+
+    INPUT:
+      curr_input: a list of str inputs.
+    OUTPUT:
+      a str prompt.
+    """
+    if len(curr_input) < self.input_count:
+      raise ValueError(f"{self.template_file} takes {self.input_count} "
+                       + f"inputs, but only {len(curr_input)} were given.")
+    segments = list(self.segments)
+    for i in range(1, len(segments), 2):
+      segments[i] = curr_input[segments[i]]
+    return "".join(segments).strip()
+
+
+class PromptRegistry:
+  def __init__(self, template_folders=None):
+    # <templates> maps the absolute path of a template file to its
+    # PromptTemplate.
+    self.templates = dict()
+    self._lock = threading.Lock()
+
+    if template_folders is None:
+      base_dir = os.path.dirname(os.path.abspath(__file__))
+      template_folders = [os.path.join(base_dir, i) for i in TEMPLATE_FOLDERS]
+    for folder in template_folders:
+      for dir_path, _, file_names in os.walk(folder):
+        for file_name in sorted(file_names):
+          if file_name.endswith(".txt"):
+            self._load(os.path.join(dir_path, file_name))
+
+
+  def _load(self, template_file):
+    key = os.path.abspath(template_file)
+    with open(key, "r") as f:
+      template = PromptTemplate(template_file, f.read())
+    with self._lock:
+      self.templates[key] = template
+    return template
+
+
+  def get(self, template_file):
+    """
+    Returns the compiled template of <template_file>. Files that were not
+    loaded up front (e.g., a template outside the template folders) are
+    loaded on their first use.
+
+    INPUT:
+      template_file: the path to the template file, e.g.,
+                     "persona/prompt_template/v2/wake_up_hour_v1.txt"
+    OUTPUT:
+      a PromptTemplate.
+    """
+    template = self.templates.get(os.path.abspath(template_file))
+    if not template:
+      template = self._load(template_file)
+    return template
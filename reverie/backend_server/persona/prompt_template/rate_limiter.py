@@ -0,0 +1,141 @@
+"""
+File: rate_limiter.py
+Description: The building blocks that LLMClient (see llm_client.py) uses to
+stay within the rate limits of the LLM provider: token buckets for the
+request-per-minute and token-per-minute budgets of each model, a concurrency
+limit that adapts to the overload signals of the provider (additive
+increase, multiplicative decrease), and exponential backoff with jitter.
+
+Everything here is meant to be used from a single event loop (the client's),
+so none of it takes any locks.
+"""
+import asyncio
+import random
+import time
+
+
+def estimate_tokens(text):
+  """
+  Returns a rough estimate of the number of tokens in <text>, at about four
+  characters per token (the usual rule of thumb for English text).
+
+  INPUT:
+    text: a str, or a list of str.
+  OUTPUT:
+    an int.
+  """
+  if isinstance(text, str):
+    return len(text) // 4 + 1
+  return sum(estimate_tokens(i) for i in text)
+
+
+def get_backoff(attempt, base=1.0, maximum=60.0, rng=random):
+  """
+  Returns the number of seconds to wait before retrying a failed request,
+  using exponential backoff with full jitter: a uniform draw between zero
+  and base * 2^attempt (capped at <maximum>). The jitter keeps many callers
+  that failed at the same moment from retrying at the same moment.
+
+  INPUT:
+    attempt: the number of attempts that failed so far, minus one.
+    base: the cap of the first wait, in seconds.
+    maximum: the largest cap, in seconds.
+  OUTPUT:
+    a float of seconds.
+  """
+  return rng.uniform(0, min(maximum, base * 2 ** attempt))
+
+
+class TokenBucket:
+  def __init__(self, per_minute, capacity=None):
+    # <per_minute> is the budget of the bucket, e.g., 3500 requests or 90000
+    # tokens per minute. It refills continuously at that rate.
+    self.rate = per_minute / 60.0
+    # <capacity> is the largest burst the bucket allows. By default, a whole
+    # minute's worth of budget.
+    self.capacity = capacity or per_minute
+    self.tokens = self.capacity
+    self.updated = time.monotonic()
+
+
+  def _refill(self):
+    now = time.monotonic()
+    self.tokens = min(self.capacity,
+                      self.tokens + (now - self.updated) * self.rate)
+    self.updated = now
+
+
+  async def acquire(self, amount=1):
+    """
+    Takes <amount> out of the bucket, waiting until the bucket has refilled
+    enough if it has to. The amount is reserved right away (the bucket can
+    go into debt), so callers are served in the order they arrived.
+
+    INPUT:
+      amount: the number of requests or tokens to take.
+    OUTPUT:
+      None
+    """
+    self._refill()
+    self.tokens -= min(amount, self.capacity)
+    if self.tokens < 0:
+      await asyncio.sleep(-self.tokens / self.rate)
+
+
+class AdaptiveConcurrency:
+  def __init__(self, max_limit, min_limit=1):
+    # <limit> is the number of requests that can be in flight at the same
+    # time. It starts at <max_limit>, is halved when the provider signals
+    # that it is overloaded, and grows back by one for every <limit>
+    # requests that succeed.
+    self.max_limit = max_limit
+    self.min_limit = min_limit
+    self.limit = float(max_limit)
+    self.in_flight = 0
+
+    # <epoch> counts the decreases of the limit. A request that was sent
+    # before the last decrease cannot cause another one, so that a burst of
+    # errors from the same window only halves the limit once.
+    self.epoch = 0
+    self._condition = None
+
+
+  def _get_condition(self):
+    # Created lazily, so that it is bound to the loop it is used on.
+    if not self._condition:
+      self._condition = asyncio.Condition()
+    return self._condition
+
+
+  async def __aenter__(self):
+    condition = self._get_condition()
+    async with condition:
+      await condition.wait_for(lambda: self.in_flight < int(self.limit))
+      self.in_flight += 1
+
+
+  async def __aexit__(self, exc_type, exc, tb):
+    condition = self._get_condition()
+    async with condition:
+      self.in_flight -= 1
+      condition.notify_all()
+
+
+  def on_success(self):
+    self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+
+
+  def on_overload(self, epoch):
+    """
+    Halves the limit, unless it was already lowered since the request that
+    failed was sent.
+
+    INPUT:
+      epoch: the <epoch> of the limit when the failed request was sent.
+    OUTPUT:
+      None
+    """
+    if epoch < self.epoch:
+      return
+    self.epoch += 1
+    self.limit = max(self.min_limit, self.limit / 2)
@@ -7,6 +7,7 @@ interface with the safe_generate_response function.
 """
 import re
 import datetime
+import json
 import sys
 import ast
 
@@ -16,7 +17,7 @@ from global_methods import *
 from persona.prompt_template.gpt_structure import *
 from persona.prompt_template.print_prompt import *
 
-def get_random_alphanumeric(i=6, j=6): 
+def get_random_alphanumeric(i=6, j=6, rng=random): 
   """
   Returns a random alpha numeric strength that has the length of somewhere
   between i and j. 
@@ -24,11 +25,12 @@ def get_random_alphanumeric(i=6, j=6):
   INPUT: 
     i: min_range for the length
     j: max_range for the length
+    rng: the source of randomness. e.g., persona.rng
   OUTPUT: 
     an alpha numeric str with the length of somewhere between i and j.
   """
-  k = random.randint(i, j)
-  x = ''.join(random.choices(string.ascii_letters + string.digits, k=k))
+  k = rng.randint(i, j)
+  x = ''.join(rng.choices(string.ascii_letters + string.digits, k=k))
   return x
 
 
@@ -188,13 +190,13 @@ def run_gpt_prompt_generate_hourly_schedule(persona,
     if p_f_ds_hourly_org: 
       prior_schedule = "\n"
       for count, i in enumerate(p_f_ds_hourly_org): 
-        prior_schedule += f"[(ID:{get_random_alphanumeric()})" 
+        prior_schedule += f"[(ID:{get_random_alphanumeric(rng=persona.rng)})" 
         prior_schedule += f" {persona.scratch.get_str_curr_date_str()} --"
         prior_schedule += f" {hour_str[count]}] Activity:"
         prior_schedule += f" {persona.scratch.get_str_firstname()}"
         prior_schedule += f" is {i}\n"
 
-    prompt_ending = f"[(ID:{get_random_alphanumeric()})"
+    prompt_ending = f"[(ID:{get_random_alphanumeric(rng=persona.rng)})"
     prompt_ending += f" {persona.scratch.get_str_curr_date_str()}"
     prompt_ending += f" -- {curr_hour_str}] Activity:"
     prompt_ending += f" {persona.scratch.get_str_firstname()} is"
@@ -288,6 +290,96 @@ def run_gpt_prompt_generate_hourly_schedule(persona,
   return output, [output, prompt, gpt_param, prompt_input, fail_safe]
 
 
+def run_gpt_prompt_generate_full_hourly_schedule(persona, 
+                                                 waking_hour_str, 
+                                                 test_input=None, 
+                                                 verbose=False): 
+  """
+  Generates the activities of all of <persona>'s waking hours in a single 
+  request, instead of one request per hour (see 
+  run_gpt_prompt_generate_hourly_schedule). 
+
+  INPUT: 
+    persona: The Persona class instance 
+    waking_hour_str: the list of the hours the persona is awake for, e.g.,
+                     ["07:00 AM", "08:00 AM", ..., "11:00 PM"]
+  OUTPUT: 
+    a list of activities, one for each hour of <waking_hour_str>, or False 
+    if no valid schedule came back. 
+    e.g., ["waking up and completing the morning routine", 
+           "eating breakfast", ...]
+  """
+  def create_prompt_input(persona, waking_hour_str, test_input=None): 
+    if test_input: return test_input
+    intermission_str = f"Here the originally intended hourly breakdown of"
+    intermission_str += f" {persona.scratch.get_str_firstname()}'s schedule today: "
+    for count, i in enumerate(persona.scratch.daily_req): 
+      intermission_str += f"{str(count+1)}) {i}, "
+    intermission_str = intermission_str[:-2]
+
+    numbered_hours = ""
+    for count, i in enumerate(waking_hour_str): 
+      numbered_hours += f"{count+1}. {i}\n"
+
+    prompt_input = [persona.scratch.get_str_iss(),
+                    intermission_str, 
+                    persona.scratch.get_str_firstname(),
+                    waking_hour_str[0], 
+                    numbered_hours.strip(), 
+                    str(len(waking_hour_str))]
+    return prompt_input
+
+  def __chat_func_clean_up(gpt_response, prompt=""): 
+    if type(gpt_response) == type("string"): 
+      try: gpt_response = json.loads(gpt_response)
+      except: gpt_response = ast.literal_eval(gpt_response)
+    first_name = persona.scratch.get_str_firstname()
+    activities = []
+    for i in gpt_response: 
+      i = i.strip()
+      if i.startswith(f"{first_name} is "): 
+        i = i[len(f"{first_name} is "):]
+      if i[-1] == ".": 
+        i = i[:-1]
+      activities += [i.strip()]
+    return activities
+
+  def __chat_func_validate(gpt_response, prompt=""): 
+    # Every waking hour needs exactly one activity, or we cannot tell which 
+    # activity belongs to which hour. 
+    try: 
+      activities = __chat_func_clean_up(gpt_response, prompt)
+      if len(activities) != len(waking_hour_str): 
+        return False
+      return all(activities)
+    except:
+      return False 
+
+  def get_fail_safe(): 
+    return False
+
+  gpt_param = {"engine": "text-davinci-002", "max_tokens": 15, 
+               "temperature": 0, "top_p": 1, "stream": False,
+               "frequency_penalty": 0, "presence_penalty": 0, "stop": None}
+  prompt_template = "persona/prompt_template/v3_ChatGPT/generate_hourly_schedule_full_v1.txt"
+  prompt_input = create_prompt_input(persona, waking_hour_str, test_input)
+  prompt = generate_prompt(prompt_input, prompt_template)
+  example_output = str(["waking up and completing the morning routine", 
+                        "eating breakfast"])
+  special_instruction = (f"The output should ONLY contain a list of "
+                         + f"{len(waking_hour_str)} activities, one for each "
+                         + "hour.")
+  fail_safe = get_fail_safe()
+  output = ChatGPT_safe_generate_response(prompt, example_output, special_instruction, 3, fail_safe,
+                                          __chat_func_validate, __chat_func_clean_up, True)
+
+  if debug or verbose: 
+    print_run_prompts(prompt_template, persona, gpt_param, 
+                      prompt_input, prompt, output)
+
+  return output, [output, prompt, gpt_param, prompt_input, fail_safe]
+
+
 
 
 
@@ -618,8 +710,6 @@ def run_gpt_prompt_action_sector(action_description,
     # output = random.choice(x)
     output = persona.scratch.living_area.split(":")[1]
 
-  print ("DEBUG", random.choice(x), "------", output)
-
   if debug or verbose: 
     print_run_prompts(prompt_template, persona, gpt_param, 
                       prompt_input, prompt, output)
@@ -771,7 +861,7 @@ def run_gpt_prompt_action_game_object(action_description,
 
   x = [i.strip() for i in persona.s_mem.get_str_accessible_arena_game_objects(temp_address).split(",")]
   if output not in x: 
-    output = random.choice(x)
+    output = persona.rng.choice(x)
 
   if debug or verbose: 
     print_run_prompts(prompt_template, persona, gpt_param, 
@@ -1087,6 +1177,136 @@ def run_gpt_prompt_act_obj_event_triple(act_game_object, act_obj_desc, persona,
 
 
 
+def run_gpt_prompt_action_details(action_description, 
+                                  persona, 
+                                  maze, 
+                                  test_input=None, 
+                                  verbose=False): 
+  """
+  Resolves where a new action takes place (its sector, arena and game 
+  object), its emoji and event triple, and the state, emoji and event triple
+  of its game object, all in a single request. This stands in for the chain
+  of run_gpt_prompt_action_sector, _action_arena, _action_game_object, 
+  _pronunciatio, _event_triple, _act_obj_desc and _act_obj_event_triple. 
+
+  INPUT: 
+    action_description: the description of the action (e.g., "sleeping")
+    persona: The Persona class instance 
+    maze: The Maze class instance 
+  OUTPUT: 
+    a dictionary with the "address", "pronunciatio", "event", "obj_desc", 
+    "obj_pronunciatio" and "obj_event" of the action, or False if no valid 
+    response came back (e.g., one that picks a place the persona does not 
+    know about). 
+  """
+  act_world = maze.access_tile(persona.scratch.curr_tile)["world"]
+
+  def get_accessible_tree(persona): 
+    # The sectors, arenas and game objects the persona can pick from, left 
+    # out the other personas' houses and rooms the same way that the 
+    # sector and arena prompts do. 
+    tree = dict()
+    for sector, arenas in persona.s_mem.tree[act_world].items(): 
+      if "'s house" in sector and persona.scratch.last_name not in sector: 
+        continue
+      tree[sector] = dict()
+      for arena, game_objects in arenas.items(): 
+        if "'s room" in arena and persona.scratch.last_name not in arena: 
+          continue
+        tree[sector][arena] = list(game_objects)
+    return tree
+
+  def create_prompt_input(action_description, persona, maze, tree): 
+    prompt_input = [persona.scratch.get_str_name()]
+    prompt_input += [persona.scratch.living_area.split(":")[1]]
+    prompt_input += [maze.access_tile(persona.scratch.curr_tile)["sector"]]
+    prompt_input += [persona.scratch.get_str_daily_plan_req()]
+    prompt_input += [json.dumps(tree)]
+    prompt_input += [action_description]
+    return prompt_input
+
+  def __chat_func_clean_up(gpt_response, prompt=""): 
+    if type(gpt_response) == type("string"): 
+      try: 
+        gpt_response = json.loads(gpt_response)
+      except: 
+        gpt_response = ast.literal_eval(gpt_response.strip())
+
+    # The address has to be in the persona's accessible tree. 
+    sector = gpt_response["sector"].strip()
+    arena = gpt_response["arena"].strip()
+    game_object = gpt_response["game_object"].strip()
+    if tree[sector][arena]: 
+      if game_object not in tree[sector][arena]: 
+        raise ValueError(f"{game_object} is not in {sector}:{arena}")
+    else: 
+      game_object = "<random>"
+
+    def clean_up_pronunciatio(pronunciatio): 
+      pronunciatio = pronunciatio.strip()
+      if not pronunciatio: 
+        raise ValueError("empty emoji")
+      return pronunciatio[:3]
+
+    def clean_up_triple(subject, predicate_object): 
+      predicate, obj = [i.strip() for i in predicate_object]
+      if not predicate or not obj: 
+        raise ValueError("incomplete event triple")
+      return (subject, predicate, obj)
+
+    obj_desc = gpt_response["object_state"].strip()
+    if obj_desc[-1] == ".": obj_desc = obj_desc[:-1]
+
+    return {"address": f"{act_world}:{sector}:{arena}:{game_object}", 
+            "pronunciatio": clean_up_pronunciatio(gpt_response["emoji"]), 
+            "event": clean_up_triple(persona.name, gpt_response["event"]), 
+            "obj_desc": obj_desc, 
+            "obj_pronunciatio": clean_up_pronunciatio(
+                                  gpt_response["object_emoji"]), 
+            "obj_event": clean_up_triple(game_object, 
+                                         gpt_response["object_event"])}
+
+  def __chat_func_validate(gpt_response, prompt=""): 
+    try: 
+      __chat_func_clean_up(gpt_response, prompt)
+      return True
+    except: 
+      return False
+
+  def get_fail_safe(): 
+    return False
+
+  gpt_param = {"engine": "text-davinci-002", "max_tokens": 15, 
+               "temperature": 0, "top_p": 1, "stream": False,
+               "frequency_penalty": 0, "presence_penalty": 0, "stop": None}
+  prompt_template = "persona/prompt_template/v3_ChatGPT/action_details_v1.txt"
+  tree = get_accessible_tree(persona)
+  prompt_input = create_prompt_input(action_description, persona, maze, tree)
+  prompt = generate_prompt(prompt_input, prompt_template)
+  example_output = {"sector": "Oak Hill College", 
+                    "arena": "library", 
+                    "game_object": "library table", 
+                    "emoji": "📚", 
+                    "event": ["is", "studying"], 
+                    "object_state": "being used for studying", 
+                    "object_emoji": "📖", 
+                    "object_event": ["is", "being used"]}
+  special_instruction = ("The output should be a dictionary with the keys "
+                         + "listed in the task, and the sector, arena and "
+                         + "game_object copied exactly from the areas above.")
+  fail_safe = get_fail_safe()
+  output = ChatGPT_safe_generate_response(prompt, example_output, special_instruction, 2, fail_safe,
+                                          __chat_func_validate, __chat_func_clean_up, True)
+
+  if debug or verbose: 
+    print_run_prompts(prompt_template, persona, gpt_param, 
+                      prompt_input, prompt, output)
+
+  return output, [output, prompt, gpt_param, prompt_input, fail_safe]
+
+
+
+
 def run_gpt_prompt_new_decomp_schedule(persona, 
                                        main_act_dur, 
                                        truncated_act_dur, 
@@ -2061,6 +2281,92 @@ def run_gpt_prompt_chat_poignancy(persona, event_description, test_input=None, v
 
 
 
+def run_gpt_prompt_poignancy_batch(persona, items, test_input=None, verbose=False): 
+  """
+  Rates the poignancy of several events, thoughts and conversations for 
+  <persona> in a single request. Items that the response has no valid score
+  for are rated one at a time with run_gpt_prompt_event_poignancy (or 
+  run_gpt_prompt_chat_poignancy for conversations) instead. 
+
+  INPUT: 
+    persona: The Persona class instance 
+    items: a list of (event type, description) tuples, where the event type
+           is "event", "thought" or "chat". 
+  OUTPUT: 
+    a list of int poignancy scores, in the order of <items>. 
+  """
+  def create_prompt_input(persona, items, test_input=None): 
+    numbered_items = ""
+    for count, (event_type, description) in enumerate(items): 
+      label = "Conversation" if event_type == "chat" else "Event"
+      numbered_items += f"{count+1}. {label}: {description}\n"
+    prompt_input = [persona.scratch.name,
+                    persona.scratch.get_str_iss(),
+                    persona.scratch.name,
+                    numbered_items.strip(), 
+                    str(len(items))]
+    return prompt_input
+
+  def __chat_func_clean_up(gpt_response, prompt=""): 
+    # Each score is validated on its own; the ones that are not an int from 
+    # 1 to 10 become None, and are rated one at a time later. 
+    if type(gpt_response) == type("string"): 
+      gpt_response = re.findall(r"-?\d+", gpt_response)
+    scores = []
+    for i in gpt_response: 
+      try: 
+        i = int(i)
+        scores += [i if 1 <= i <= 10 else None]
+      except: 
+        scores += [None]
+    return scores
+
+  def __chat_func_validate(gpt_response, prompt=""): 
+    # We can only tell which score belongs to which item if there is exactly
+    # one score per item. 
+    try: 
+      return len(__chat_func_clean_up(gpt_response, prompt)) == len(items)
+    except:
+      return False 
+
+  def get_fail_safe(): 
+    return 4
+
+  gpt_param = {"engine": "text-davinci-002", "max_tokens": 15, 
+               "temperature": 0, "top_p": 1, "stream": False,
+               "frequency_penalty": 0, "presence_penalty": 0, "stop": None}
+  prompt_template = "persona/prompt_template/v3_ChatGPT/poignancy_batch_v1.txt"
+  prompt_input = create_prompt_input(persona, items)
+  prompt = generate_prompt(prompt_input, prompt_template)
+  example_output = str([5] * len(items))
+  special_instruction = (f"The output should ONLY contain a list of "
+                         + f"{len(items)} integer values on the scale of 1 to "
+                         + "10, one for each item.")
+  fail_safe = get_fail_safe()
+  output = ChatGPT_safe_generate_response(prompt, example_output, special_instruction, 3, fail_safe,
+                                          __chat_func_validate, __chat_func_clean_up, True)
+  if output == False: 
+    output = [None] * len(items)
+
+  # Fall back to single requests for the items without a valid score. 
+  for count, (event_type, description) in enumerate(items): 
+    if output[count] is not None: 
+      continue
+    if event_type == "chat": 
+      single = run_gpt_prompt_chat_poignancy(persona, description)
+    else: 
+      single = run_gpt_prompt_event_poignancy(persona, description)
+    output[count] = single[0] if single else fail_safe
+
+  if debug or verbose: 
+    print_run_prompts(prompt_template, persona, gpt_param, 
+                      prompt_input, prompt, output)
+
+  return output, [output, prompt, gpt_param, prompt_input, fail_safe]
+
+
+
+
 def run_gpt_prompt_focal_pt(persona, statements, n, test_input=None, verbose=False): 
   def create_prompt_input(persona, statements, n, test_input=None): 
     prompt_input = [statements, str(n)]
@@ -28,6 +28,7 @@ framework.
 import json
 import numpy
 import datetime
+import heapq
 import pickle
 import time
 import math
@@ -35,11 +36,14 @@ import os
 import shutil
 import traceback
 
+from concurrent.futures import ThreadPoolExecutor
 from selenium import webdriver
 
 from global_methods import *
 from utils import *
+from default_settings import *
 from maze import *
+from frontend_channel import *
 from persona.persona import *
 
 ##############################################################################
@@ -144,6 +148,68 @@ class ReverieServer:
     # <server_sleep> denotes the amount of time that our while loop rests each
     # cycle; this is to not kill our machine. 
     self.server_sleep = 0.1
+    # <concurrent_personas> lets all personas run their cognitive sequence in
+    # parallel during a step instead of one after another. This is turned on
+    # for a single run with the "run concurrent <step-count>" command. 
+    self.concurrent_personas = False
+    # <persona_workers> is the maximum number of personas that can be moving 
+    # at the same time when <concurrent_personas> is on. 
+    self.persona_workers = persona_workers
+    # <batch_embeddings> embeds everything that the personas are about to 
+    # perceive in a few batched requests at the start of each step, instead 
+    # of one request per event during perceive. 
+    self.batch_embeddings = True
+    # <frontend_channel> is the push channel to the frontend server while a
+    # run is going on (see frontend_channel.py), or None if the files are 
+    # used instead. 
+    self.frontend_channel = None
+    # <headless> runs the simulation without the frontend: the personas are 
+    # moved straight to the tiles the backend sends them to, and the next 
+    # step starts right away instead of waiting for environment/{step}.json.
+    # This is turned on for a single run with the "run headless <step-count>"
+    # command. 
+    self.headless = False
+    # <headless_artifacts> still writes the environment/ and movement/ files
+    # of every step in a headless run, so that it can be replayed (and 
+    # compressed for the demo) like any other. Either way, the environment
+    # file of the step the run stops at is written, so that the simulation 
+    # can be picked up from there. 
+    self.headless_artifacts = True
+    # <pipelined> lets the backend work on the next step while the frontend
+    # is still busy with the current one: the personas are assumed to end up
+    # on the tiles we sent them to, and what they will need there is worked 
+    # out ahead of time (see start_speculation). This is turned on for a 
+    # single run with the "run pipelined <step-count>" command. 
+    self.pipelined = False
+    # <speculation> is the work that was started ahead of time for the next 
+    # step, if any. 
+    self.speculation = None
+    # <speculated_actions> counts the actions that were resolved ahead of 
+    # time and committed, and <discarded_actions> the ones that were thrown 
+    # away because the frontend did not put the persona where we predicted. 
+    self.speculated_actions = 0
+    self.discarded_actions = 0
+    # <skip_idle> runs the cognitive sequence of a persona only on the steps
+    # where it has something to decide, and simply moves the other personas'
+    # time forward (see get_idle_candidates). This is turned on for a single
+    # run with the "run skip <step-count>" command. 
+    self.skip_idle = False
+    # <batch_paths> moves the personas in two phases: all of them decide 
+    # first, and then the paths that they need are searched for together, 
+    # in one pass over the maze (see move_personas_in_two_phases). This is 
+    # turned on for a single run with the "run batched <step-count>" command.
+    self.batch_paths = False
+    # <decision_queue> is a priority queue of the next time each of the idle
+    # personas has to decide something, as (time, persona name) pairs, and 
+    # <decision_times> is that time for each persona that is idle until then.
+    # A pair in the queue that does not match <decision_times> is stale. 
+    self.decision_queue = []
+    self.decision_times = dict()
+    # <skipped_moves> counts the steps of a persona that were skipped. 
+    self.skipped_moves = 0
+    # <simulation_seed> seeds the random choices of the personas (see 
+    # default_settings.py). None leaves them unseeded. 
+    self.simulation_seed = simulation_seed
 
     # SIGNALING THE FRONTEND SERVER: 
     # curr_sim_code.json contains the current simulation code, and
@@ -320,6 +386,39 @@ class ReverieServer:
     # <game_obj_cleanup> is used for that. 
     game_obj_cleanup = dict()
 
+    # The LLM telemetry of this run is saved to the metrics folder once the 
+    # run is over, next to the movement files it produced. 
+    # e.g., {sim_folder}/metrics/llm_0-100.json
+    llm_telemetry.reset()
+    start_step = self.step
+
+    # <headless_env> is the environment of the current step in a headless 
+    # run. It starts out with the tiles the personas are on now. 
+    headless_env = None
+    if self.headless: 
+      headless_env = self.get_headless_env(self.personas_tile)
+
+    # Idle personas are only tracked during a run with <skip_idle>. Every 
+    # persona decides on the first step of a run, as the world may have 
+    # changed in between. 
+    self.decision_queue = []
+    self.decision_times = dict()
+    self.maze.event_changes = dict() if self.skip_idle else None
+
+    # The frontend server hands the steps over through the push channel if 
+    # it can be opened, and through the environment/ and movement/ files 
+    # otherwise. A channel that is still open (e.g., after a run that failed)
+    # is kept. 
+    if (not self.headless and frontend_channel_port 
+        and not self.frontend_channel): 
+      try: 
+        self.frontend_channel = FrontendChannel(self.sim_code, 
+                                                frontend_channel_host, 
+                                                frontend_channel_port)
+      except OSError: 
+        traceback.print_exc()
+        print ("Could not open the frontend channel; using the files only.")
+
     # The main while loop of Reverie. 
     while (True): 
       # Done with this iteration if <int_counter> reaches 0. 
@@ -331,18 +430,41 @@ class ReverieServer:
       # new environment file that matches our step count. That's when we run 
       # the content of this for loop. Otherwise, we just wait. 
       curr_env_file = f"{sim_folder}/environment/{self.step}.json"
-      if check_if_file_exists(curr_env_file):
+      # With the channel, we wait for the environment to be pushed instead of
+      # sleeping between checks for the file. 
+      channel_env = None
+      if self.frontend_channel and not self.headless: 
+        channel_env = self.frontend_channel.wait_for_environment(
+                        self.step, self.server_sleep)
+      if (self.headless or channel_env 
+          or check_if_file_exists(curr_env_file)):
         # If we have an environment file, it means we have a new perception
         # input to our personas. So we first retrieve it.
         try: 
           # Try and save block for robustness of the while loop.
-          with open(curr_env_file) as json_file:
-            new_env = json.load(json_file)
+          if self.headless: 
+            # Without a frontend, the environment is the one we keep here.
+            new_env = headless_env
+            env_retrieved = True
+            if self.headless_artifacts: 
+              with open(curr_env_file, "w") as outfile: 
+                outfile.write(json.dumps(new_env, indent=2))
+          elif channel_env: 
+            new_env = channel_env
             env_retrieved = True
+          else: 
+            with open(curr_env_file) as json_file:
+              new_env = json.load(json_file)
+              env_retrieved = True
         except: 
           pass
       
         if env_retrieved: 
+          # If we started on this step ahead of time, we keep what we can of
+          # that work now that we know where the personas really are. 
+          if self.speculation: 
+            self.commit_speculation(new_env)
+
           # This is where we go through <game_obj_cleanup> to clean up all 
           # object actions that were used in this cylce. 
           for key, val in game_obj_cleanup.items(): 
@@ -382,31 +504,91 @@ class ReverieServer:
                        None, None, None)
               self.maze.remove_event_from_tile(blank, new_tile)
 
+          # With a seed, the random choices of each persona only depend on the
+          # seed, the persona and the step, so a replayed simulation (or one 
+          # that is resumed from a save) makes the same choices. 
+          if self.simulation_seed is not None: 
+            for persona_name, persona in self.personas.items(): 
+              persona.rng.seed(f"{self.simulation_seed}:{persona_name}:"
+                               + f"{self.step}")
+
+          # With <skip_idle>, the personas that have nothing to decide on 
+          # this step are left out of the cognitive sequence. If that is all
+          # of them, and no one is watching, we go straight to the next step 
+          # where someone does. 
+          idle_candidates = set()
+          idle_steps = 1
+          if self.skip_idle: 
+            idle_candidates = self.get_idle_candidates(
+                                self.maze.pop_changed_tiles())
+            if (self.headless and not self.headless_artifacts 
+                and not self.pipelined 
+                and len(idle_candidates) == len(self.personas)): 
+              idle_steps = self.get_idle_steps(int_counter)
+          step_time = (self.curr_time 
+            + datetime.timedelta(seconds=self.sec_per_step * (idle_steps - 1)))
+
+          # Before the personas move, we embed all the events they are about
+          # to perceive in as few requests as possible. perceive then finds 
+          # these embeddings in the shared embedding store. 
+          if self.batch_embeddings: 
+            self.prefetch_embeddings(idle_candidates)
+
           # Then we need to actually have each of the personas perceive and
           # move. The movement for each of the personas comes in the form of
           # x y coordinates where the persona will move towards. e.g., (50, 34)
           # This is where the core brains of the personas are invoked. 
           movements = {"persona": dict(), 
                        "meta": dict()}
+          executions = dict()
+          idle_personas = set()
+          if self.batch_paths: 
+            executions, idle_personas = self.move_personas_in_two_phases(
+                                          idle_candidates, step_time, 
+                                          idle_steps)
+          elif self.concurrent_personas: 
+            executions, idle_personas = self.move_personas_concurrently(
+                                          idle_candidates, step_time, 
+                                          idle_steps)
           for persona_name, persona in self.personas.items(): 
             # <next_tile> is a x,y coordinate. e.g., (58, 9)
             # <pronunciatio> is an emoji. e.g., "\ud83d\udca4"
             # <description> is a string description of the movement. e.g., 
             #   writing her next novel (editing her novel) 
             #   @ double studio:double studio:common room:sofa
-            next_tile, pronunciatio, description = persona.move(
-              self.maze, self.personas, self.personas_tile[persona_name], 
-              self.curr_time)
+            if self.concurrent_personas or self.batch_paths: 
+              next_tile, pronunciatio, description = executions[persona_name]
+            # A persona that moved before this one may have started a 
+            # conversation with it, so whether it can idle is checked again.
+            elif (persona_name in idle_candidates 
+                  and self.can_idle(persona_name)): 
+              next_tile, pronunciatio, description = persona.idle(
+                self.maze, self.personas, self.personas_tile[persona_name], 
+                step_time, idle_steps)
+              idle_personas.add(persona_name)
+            else: 
+              next_tile, pronunciatio, description = persona.move(
+                self.maze, self.personas, self.personas_tile[persona_name], 
+                self.curr_time)
             movements["persona"][persona_name] = {}
             movements["persona"][persona_name]["movement"] = next_tile
             movements["persona"][persona_name]["pronunciatio"] = pronunciatio
             movements["persona"][persona_name]["description"] = description
             movements["persona"][persona_name]["chat"] = (persona
                                                           .scratch.chat)
+            # Speculated actions are only good for the step they were made 
+            # for. 
+            persona.speculated_action = None
+
+          if self.skip_idle: 
+            self.skipped_moves += len(idle_personas) * idle_steps
+            for persona_name in self.personas: 
+              if persona_name not in idle_personas: 
+                self.schedule_decision(persona_name)
 
           # Include the meta information about the current stage in the 
           # movements dictionary. 
-          movements["meta"]["curr_time"] = (self.curr_time 
+          movements["meta"]["curr_time"] = (step_time 
                                              .strftime("%B %d, %Y, %H:%M:%S"))
 
           # We then write the personas' movements to a file that will be sent 
@@ -416,18 +598,568 @@ class ReverieServer:
           #  "persona": {"Klaus Mueller": {"movement": [38, 12]}}, 
           #  "meta": {curr_time: <datetime>}}
           curr_move_file = f"{sim_folder}/movement/{self.step}.json"
-          with open(curr_move_file, "w") as outfile: 
-            outfile.write(json.dumps(movements, indent=2))
+          if not self.headless or self.headless_artifacts: 
+            # The base simulations come without a movement/ folder. 
+            create_folder_if_not_there(curr_move_file)
+            with open(curr_move_file, "w") as outfile: 
+              outfile.write(json.dumps(movements, indent=2))
+          if self.frontend_channel: 
+            self.frontend_channel.put_movement(self.step, movements)
+
+          # In a headless run, the personas simply arrive where we sent them. 
+          if self.headless: 
+            headless_env = self.get_headless_env(
+              {persona_name: movement["movement"] 
+               for persona_name, movement in movements["persona"].items()})
 
           # After this cycle, the world takes one step forward, and the 
           # current time moves by <sec_per_step> amount. 
-          self.step += 1
-          self.curr_time += datetime.timedelta(seconds=self.sec_per_step)
+          self.step += idle_steps
+          self.curr_time += datetime.timedelta(
+                              seconds=self.sec_per_step * idle_steps)
 
-          int_counter -= 1
+          int_counter -= idle_steps
+
+          # While the frontend moves the personas, we get started on the 
+          # next step. 
+          if self.pipelined and int_counter > 0: 
+            self.start_speculation(movements)
           
-      # Sleep so we don't burn our machines. 
-      time.sleep(self.server_sleep)
+      # Sleep so we don't burn our machines. There is nothing to wait for in
+      # a headless run, and the channel already waited for us. 
+      if not (self.headless or self.frontend_channel): 
+        time.sleep(self.server_sleep)
+
+    if self.frontend_channel: 
+      self.frontend_channel.close()
+      self.frontend_channel = None
+
+    if self.headless: 
+      with open(f"{sim_folder}/environment/{self.step}.json", "w") as outfile: 
+        outfile.write(json.dumps(headless_env, indent=2))
+
+    metrics_file = f"{sim_folder}/metrics/llm_{start_step}-{self.step}.json"
+    create_folder_if_not_there(metrics_file)
+    llm_telemetry.save(metrics_file)
+
+
+  # 在角色移动之前，批量计算这一步所有角色感知时需要的嵌入。
+  def prefetch_embeddings(self, skipped=()): 
+    """
+    Collects the texts that every persona's perceive is going to embed at
+    its current tile, and embeds them all with get_embeddings. The vectors 
+    land in the shared embedding store, where perceive (and in turn 
+    AssociativeMemory.add_event and add_chat) picks them up. 
+
+    INPUT
+      skipped: the names of the personas that do not perceive on this step.
+    OUTPUT 
+      None
+    """
+    texts = []
+    for persona_name, persona in self.personas.items(): 
+      if persona_name in skipped: 
+        continue
+      persona.scratch.curr_tile = self.personas_tile[persona_name]
+      texts += get_perceive_embedding_texts(persona, self.maze)
+    if not texts: 
+      return
+
+    try: 
+      get_embeddings(texts)
+    except: 
+      # Nothing is lost if this fails; perceive embeds whatever it is 
+      # missing one text at a time, as it did before. 
+      traceback.print_exc()
+      print ("Batched embedding failed; falling back to single requests.")
+
+
+  # 在没有前端的情况下，生成与前端发送的格式相同的环境信息。
+  def get_headless_env(self, tiles): 
+    """
+    Returns the environment that the frontend would report if the personas 
+    were on <tiles>, for headless runs. 
+
+    INPUT
+      tiles: A dictionary that takes the persona's full name as its keys, and
+             its (x, y) tile as its values. 
+    OUTPUT 
+      The environment, in the form of the environment/{step}.json files. 
+      e.g., {"Isabella Rodriguez": {"maze": "the_ville", "x": 72, "y": 14}}
+    """
+    env = dict()
+    for persona_name, tile in tiles.items(): 
+      env[persona_name] = {"maze": self.maze.maze_name, 
+                           "x": tile[0], 
+                           "y": tile[1]}
+    return env
+
+
+  # 在前端处理当前这一步时，提前为下一步做准备：预测角色的位置，并提前决定即将结束当前行动的角色的下一个行动。
+  def start_speculation(self, movements): 
+    """
+    Starts working on the next step before the frontend reports it. We 
+    predict that every persona ends up on the tile we just sent it to, and 
+    run speculate_action for each persona on that tile in the background: 
+    the embeddings of what it will perceive there are fetched, and if its 
+    action ends at the next step, its next action is resolved. 
+
+    Nothing of the simulation's state changes until commit_speculation. 
+
+    INPUT
+      movements: the movements of the step that was just sent to the 
+                 frontend. 
+    OUTPUT 
+      None
+    """
+    tiles = dict()
+    futures = dict()
+    executor = ThreadPoolExecutor(max_workers=self.persona_workers)
+    for persona_name, persona in self.personas.items(): 
+      tiles[persona_name] = tuple(
+        movements["persona"][persona_name]["movement"])
+      # The stand-ins are made here, before any thread starts, since the 
+      # persona may change once the server moves on. 
+      speculative_persona = SpeculativePersona(persona, 
+                                               tiles[persona_name], 
+                                               self.curr_time)
+      futures[persona_name] = executor.submit(speculate_action, 
+                                              speculative_persona, 
+                                              self.maze)
+    executor.shutdown(wait=False)
+    self.speculation = {"step": self.step, "tiles": tiles, "futures": futures}
+
+
+  # 前端报告角色位置后，只保留预测正确的角色的提前决定的行动。
+  def commit_speculation(self, new_env): 
+    """
+    Waits for the work started by start_speculation, and keeps the next 
+    action of every persona that the frontend put on the tile we predicted. 
+    The actions of the others are thrown away (the embeddings that were 
+    fetched are kept either way, as they are right wherever the persona is).
+
+    INPUT
+      new_env: the environment the frontend reported for the current step.
+    OUTPUT 
+      None
+    """
+    speculation = self.speculation
+    self.speculation = None
+    for persona_name, future in speculation["futures"].items(): 
+      try: 
+        speculated = future.result()
+      except: 
+        traceback.print_exc()
+        print (f"Speculation failed for {persona_name}; it will be redone.")
+        continue
+      if not speculated: 
+        continue
+      new_tile = (new_env[persona_name]["x"], new_env[persona_name]["y"])
+      if (speculation["step"] == self.step 
+          and speculation["tiles"][persona_name] == new_tile): 
+        self.personas[persona_name].speculated_action = speculated
+        self.speculated_actions += 1
+      else: 
+        self.discarded_actions += 1
+
+
+  # 判断角色在这一步是否没有任何需要决定的事情（不走动、不聊天、动作没有结束、不需要反思）。
+  def can_idle(self, persona_name): 
+    """
+    Checks whether the persona's state lets it skip its cognitive sequence:
+    it is staying on its tile, it is not in a conversation, and it is not 
+    about to reflect. Whether its action ends and whether anything happens 
+    around it is up to get_idle_candidates. 
+
+    INPUT
+      persona_name: the full name of the persona. 
+    OUTPUT 
+      Boolean. 
+    """
+    persona = self.personas[persona_name]
+    scratch = persona.scratch
+    if not scratch.curr_time or not scratch.act_address: 
+      return False
+    if (scratch.chatting_with or scratch.chatting_end_time or scratch.chat 
+        or scratch.act_event[1] == "chat with"): 
+      return False
+    # A "<random>" address sends the persona to a new tile whenever it gets
+    # to the end of its path (see execute). 
+    if (not scratch.act_path_set or scratch.planned_path 
+        or "<random>" in scratch.act_address): 
+      return False
+    if tuple(scratch.curr_tile) != tuple(self.personas_tile[persona_name]): 
+      return False
+    # The same conditions as reflection_trigger. 
+    if persona.pending_reflection: 
+      return False
+    if (scratch.importance_trigger_curr <= 0 
+        and persona.a_mem.seq_event + persona.a_mem.seq_thought): 
+      return False
+    return True
+
+
+  # 计算角色下一次需要做决定的时间：当前动作结束的时间，或者新一天开始的时间。
+  def get_decision_time(self, persona): 
+    """
+    Returns the next time at which the persona has to decide something if 
+    nothing happens around it: when its action ends (act_check_finished), or
+    when a new day starts (Persona.move), whichever comes first. 
+
+    INPUT
+      persona: Current <Persona> instance. 
+    OUTPUT 
+      datetime instance. 
+    """
+    curr_time = persona.scratch.curr_time
+    next_day = datetime.datetime.combine(
+                 curr_time.date() + datetime.timedelta(days=1), 
+                 datetime.time())
+    # act_check_finished only compares the time of the day. 
+    end_time = datetime.datetime.combine(
+                 curr_time.date(), 
+                 persona.scratch.act_end_time().time().replace(microsecond=0))
+    if end_time <= curr_time: 
+      end_time += datetime.timedelta(days=1)
+    return min(end_time, next_day)
+
+
+  # 角色运行完认知序列之后，如果它接下来没有需要决定的事情，就把它放进决策队列。
+  def schedule_decision(self, persona_name): 
+    """
+    Queues the next decision time of a persona that just ran its cognitive
+    sequence, if it can idle until then. It can not if it would perceive 
+    something new when it stays where it is. 
+
+    INPUT
+      persona_name: the full name of the persona. 
+    OUTPUT 
+      None
+    """
+    self.decision_times.pop(persona_name, None)
+    persona = self.personas[persona_name]
+    if (not self.can_idle(persona_name) 
+        or perceives_new_events(persona, self.maze)): 
+      return
+    decision_time = self.get_decision_time(persona)
+    self.decision_times[persona_name] = decision_time
+    heapq.heappush(self.decision_queue, (decision_time, persona_name))
+
+
+  # 找出这一步可以跳过认知序列的角色：还没到决策时间，且视野内没有发生变化。
+  def get_idle_candidates(self, changed_tiles): 
+    """
+    Returns the personas that have nothing to decide on the current step: 
+    their decision time is not there yet, and none of the tiles within their
+    vision changed since their last step. The personas that do have 
+    something to decide are taken out of the queue, and run their cognitive
+    sequence on this step. 
+
+    INPUT
+      changed_tiles: the tiles whose events changed since the last step 
+                     (see Maze.pop_changed_tiles). 
+    OUTPUT 
+      a set of persona names. 
+    """
+    while (self.decision_queue 
+           and self.decision_queue[0][0] <= self.curr_time): 
+      decision_time, persona_name = heapq.heappop(self.decision_queue)
+      if self.decision_times.get(persona_name) == decision_time: 
+        del self.decision_times[persona_name]
+
+    idle_candidates = set()
+    for persona_name in list(self.decision_times): 
+      scratch = self.personas[persona_name].scratch
+      x, y = scratch.curr_tile
+      perceived_change = False
+      for tile in changed_tiles: 
+        if (abs(tile[0] - x) <= scratch.vision_r 
+            and abs(tile[1] - y) <= scratch.vision_r): 
+          perceived_change = True
+          break
+      if perceived_change or not self.can_idle(persona_name): 
+        del self.decision_times[persona_name]
+      else: 
+        idle_candidates.add(persona_name)
+    return idle_candidates
+
+
+  # 所有角色都空闲时，计算可以一次性跳过多少步。
+  def get_idle_steps(self, int_counter): 
+    """
+    Returns the number of steps that all personas can idle for from the 
+    current step, at most <int_counter>, when all of them are idle. 
+
+    INPUT
+      int_counter: the number of steps left in this run. 
+    OUTPUT 
+      int. 
+    """
+    decision_time = min(self.decision_times.values())
+    seconds = (decision_time - self.curr_time).total_seconds()
+    return max(1, min(int_counter, math.ceil(seconds / self.sec_per_step)))
+
+
+  # 并发地运行所有角色的认知流程，按固定顺序提交角色之间的对话，然后再依次执行每个角色的行动。
+  def move_personas_concurrently(self, idle_candidates, idle_time, 
+                                 idle_steps): 
+    """
+    Runs the cognitive sequence of every persona (perceive, retrieve, plan,
+    and reflect) in parallel for the current step (see 
+    decide_personas_concurrently), and then executes their plans one after
+    another. 
+
+    The plans are executed after the conversations of the step are 
+    committed, so that the movement of a persona that just started a 
+    conversation already shows it (e.g., its description is the 
+    conversation, and it heads towards its partner), as it does when the 
+    personas are stepped one after another. 
+
+    INPUT
+      idle_candidates: the names of the personas that may idle on this step
+                       (see get_idle_candidates). 
+      idle_time: the time of the last step that the idle personas skip. 
+      idle_steps: the number of steps that the idle personas skip. 
+    OUTPUT 
+      executions: A dictionary that takes the persona's full name as its 
+                  keys, and the (next_tile, pronunciatio, description) triple
+                  returned by Persona.move as its values. 
+      idle_personas: the set of the names of the personas that idled. 
+    """
+    executions = dict()
+    deciding, idle_personas = self.decide_personas_concurrently(
+                                idle_candidates, idle_time, idle_steps, 
+                                executions)
+
+    # A committed conversation replaces the action of both personas, so the
+    # plan to execute is the persona's action address as it is now, not the
+    # one that decide returned. 
+    for persona_name in deciding: 
+      persona = self.personas[persona_name]
+      executions[persona_name] = persona.execute(self.maze, 
+                                                 self.personas, 
+                                                 persona.scratch.act_address)
+    return executions, idle_personas
+
+
+  # 并发地让角色们做出决定，按固定顺序提交它们之间的对话，再检查哪些候选角色仍然可以空闲。
+  def decide_personas_concurrently(self, idle_candidates, idle_time, 
+                                   idle_steps, executions): 
+    """
+    Runs Persona.decide for every persona that is not an idle candidate, in
+    parallel, and idles the candidates that can still idle once that is 
+    done. 
+
+    The maze is not written to while the personas are deciding -- all tile 
+    event updates for the step happen before this is called -- so every 
+    persona sees the same snapshot of the world. Conversations that a persona
+    starts with another persona (see _chat_react) are queued in the
+    persona's <pending_reacts> and committed after everyone has decided, in
+    the order of self.personas, so the outcome does not depend on which 
+    thread happened to finish first. 
+
+    An idle candidate that one of these conversations was started with can 
+    not idle anymore (see can_idle), as when the personas are stepped one 
+    after another. So the candidates are only idled after the commit, and 
+    the ones that can not idle decide in a second round (whose 
+    conversations are committed the same way). 
+
+    INPUT
+      idle_candidates: the names of the personas that may idle on this step
+                       (see get_idle_candidates). 
+      idle_time: the time of the last step that the idle personas skip. 
+      idle_steps: the number of steps that the idle personas skip. 
+      executions: the dictionary that the (next_tile, pronunciatio, 
+                  description) triple of each idle persona is added to. 
+    OUTPUT 
+      deciding: the names of the personas that decided, in the order of 
+                self.personas. Their plans are still to be executed. 
+      idle_personas: the set of the names of the personas that idled. 
+    """
+    # Personas read each other's current tile (e.g., when walking towards a
+    # conversation partner), so we update all of them before anyone moves. 
+    for persona_name, persona in self.personas.items(): 
+      persona.scratch.curr_tile = self.personas_tile[persona_name]
+      persona.pending_reacts = []
+
+    idle_personas = set()
+    try: 
+      self._decide_in_parallel([persona_name for persona_name in self.personas
+                                if persona_name not in idle_candidates])
+
+      late = []
+      for persona_name, persona in self.personas.items(): 
+        if persona_name not in idle_candidates: 
+          continue
+        if self.can_idle(persona_name): 
+          executions[persona_name] = persona.idle(
+            self.maze, self.personas, self.personas_tile[persona_name], 
+            idle_time, idle_steps)
+          idle_personas.add(persona_name)
+        else: 
+          late += [persona_name]
+      self._decide_in_parallel(late)
+    finally: 
+      for persona_name, persona in self.personas.items(): 
+        persona.pending_reacts = None
+
+    deciding = [persona_name for persona_name in self.personas 
+                if persona_name not in idle_personas]
+    return deciding, idle_personas
+
+
+  # 并行地让一组角色做出决定，然后按固定顺序提交它们排队的对话。
+  def _decide_in_parallel(self, persona_names): 
+    # Runs Persona.decide for <persona_names> in parallel, and then commits 
+    # the conversations they queued (see decide_personas_concurrently). 
+    if not persona_names: 
+      return
+    futures = dict()
+    with ThreadPoolExecutor(max_workers=self.persona_workers) as executor: 
+      for persona_name in persona_names: 
+        persona = self.personas[persona_name]
+        futures[persona_name] = executor.submit(persona.decide, 
+                                                self.maze, 
+                                                self.personas, 
+                                                self.personas_tile[persona_name], 
+                                                self.curr_time)
+    for persona_name, future in futures.items(): 
+      future.result()
+
+    # Committing the queued conversations in a deterministic order. 
+    self.commit_pending_reacts(self.personas)
+
+
+  # 分两个阶段移动所有角色：先让每个角色做出决定，再把它们需要的路径放在一起一次性搜索。
+  def move_personas_in_two_phases(self, idle_candidates, idle_time, 
+                                  idle_steps): 
+    """
+    Moves the personas in two phases. First, the personas run their 
+    cognitive sequence up to their plan (see Persona.decide). Then the paths
+    of all personas that need a new one are searched for together (see 
+    execute_personas_in_batch), and every persona takes its step. 
+
+    With <concurrent_personas> on, the personas decide in parallel and their
+    conversations are committed after everyone has decided, as in 
+    move_personas_concurrently. Otherwise, they decide one after another, 
+    and each one sees the world as the personas before it left it, as when 
+    they are stepped with Persona.move: its conversation is committed right 
+    after it decides, and the personas before it take their step before 
+    that (a conversation changes the plans of both personas). So their 
+    paths are only searched for together until someone starts a 
+    conversation. 
+
+    INPUT
+      idle_candidates: the names of the personas that may idle on this step
+                       (see get_idle_candidates). 
+      idle_time: the time of the last step that the idle personas skip. 
+      idle_steps: the number of steps that the idle personas skip. 
+    OUTPUT 
+      executions: A dictionary that takes the persona's full name as its 
+                  keys, and the (next_tile, pronunciatio, description) triple
+                  returned by Persona.move as its values. 
+      idle_personas: the set of the names of the personas that idled. 
+    """
+    executions = dict()
+    if self.concurrent_personas: 
+      deciding, idle_personas = self.decide_personas_concurrently(
+                                  idle_candidates, idle_time, idle_steps, 
+                                  executions)
+      self.execute_personas_in_batch(deciding, executions)
+      return executions, idle_personas
+
+    for persona_name, persona in self.personas.items(): 
+      persona.pending_reacts = []
+
+    idle_personas = set()
+    try: 
+      # <waiting> are the personas that decided, but did not take their 
+      # step yet. 
+      waiting = []
+      for persona_name, persona in self.personas.items(): 
+        # A persona that decided before this one may have started a 
+        # conversation with it, so whether it can idle is checked again.
+        if (persona_name in idle_candidates 
+            and self.can_idle(persona_name)): 
+          executions[persona_name] = persona.idle(
+            self.maze, self.personas, self.personas_tile[persona_name], 
+            idle_time, idle_steps)
+          idle_personas.add(persona_name)
+          continue
+
+        persona.decide(self.maze, self.personas, 
+                       self.personas_tile[persona_name], self.curr_time)
+        if persona.pending_reacts: 
+          self.execute_personas_in_batch(waiting, executions)
+          waiting = []
+          self.commit_pending_reacts([persona_name])
+        waiting += [persona_name]
+      self.execute_personas_in_batch(waiting, executions)
+    finally: 
+      for persona_name, persona in self.personas.items(): 
+        persona.pending_reacts = None
+
+    return executions, idle_personas
+
+
+  # 按顺序把角色们排队的对话写入双方的日程。
+  def commit_pending_reacts(self, persona_names): 
+    """
+    Commits the conversations that the personas queued while deciding (see 
+    _chat_react in plan.py), in the order of <persona_names>, and empties 
+    their queues. 
+
+    INPUT
+      persona_names: the names of the personas whose conversations to 
+                     commit. 
+    OUTPUT 
+      None
+    """
+    for persona_name in persona_names: 
+      persona = self.personas[persona_name]
+      for target_name, convo, inserted_act, inserted_act_dur in (
+                                                    persona.pending_reacts): 
+        commit_chat_react(persona, self.personas[target_name], convo, 
+                          inserted_act, inserted_act_dur)
+      persona.pending_reacts = []
+
+
+  # 为一批已经做出决定的角色一起搜索路径，并让它们各走一步。
+  def execute_personas_in_batch(self, persona_names, executions): 
+    """
+    Executes the plans of personas that have decided what to do. The target
+    tiles are picked in the order of <persona_names>, and the paths that are
+    not found without a search are then all searched for at once (see 
+    batch_path_finder), at most <path_batch_max_tiles> tiles of arrays at a
+    time. 
+
+    A committed conversation replaces the action of both personas, so the 
+    plan that is executed is the persona's action address as it is now, not
+    the one that decide returned. 
+
+    INPUT
+      persona_names: the names of the personas to execute. 
+      executions: the dictionary that the (next_tile, pronunciatio, 
+                  description) triple of each persona is added to. 
+    OUTPUT 
+      None
+    """
+    requests = dict()
+    for persona_name in persona_names: 
+      persona = self.personas[persona_name]
+      request = request_path(persona, self.maze, self.personas, 
+                             persona.scratch.act_address)
+      if request: 
+        requests[persona_name] = request
+    results = batch_path_finder(self.maze.collision_maze, 
+                                list(requests.values()), 
+                                collision_block_id, 
+                                path_batch_max_tiles)
+    for persona_name, (closest_target_tile, path) in zip(requests, results):
+      set_planned_path(self.personas[persona_name], path)
+    for persona_name in persona_names: 
+      executions[persona_name] = step_on_path(self.personas[persona_name], 
+                                              self.maze)
 
 
   # 打开交互式命令行界面，允许用户通过命令操作仿真。
@@ -483,7 +1215,19 @@ class ReverieServer:
         elif sim_command[:3].lower() == "run": 
           # Runs the number of steps specified in the prompt.
           # Example: run 1000
+          # Any words between "run" and the step count are run options. 
+          # Example: run concurrent 1000
+          # Example: run concurrent pipelined 1000
+          # Example: run headless 1000
+          # Example: run headless skip 1000
+          # Example: run batched 1000
           int_count = int(sim_command.split()[-1])
+          run_options = [i.lower() for i in sim_command.split()[1:-1]]
+          self.concurrent_personas = "concurrent" in run_options
+          self.pipelined = "pipelined" in run_options
+          self.headless = "headless" in run_options
+          self.skip_idle = "skip" in run_options
+          self.batch_paths = "batched" in run_options
           rs.start_server(int_count)
 
         elif ("print persona schedule" 
@@ -577,6 +1321,16 @@ class ReverieServer:
           for i in self.maze.access_tile(cooordinate)["events"]: 
             ret_str += f"{i}\n"
 
+        elif ("print llm telemetry" 
+              in sim_command.lower()): 
+          # Print the LLM calls of the last run by run_gpt_prompt function,
+          # with the ones that took the most time first. 
+          # Ex: print llm telemetry
+          ret_str += llm_telemetry.get_str_summary()
+          ret_str += (f"coalesced requests: {llm_client.coalesced}, " 
+                      + f"retried requests: {llm_client.retries}, "
+                      + f"overloads: {llm_client.overloads}\n")
+
         elif ("print tile details" 
               in sim_command.lower()): 
           # Print the tile details of the tile specified in the prompt 
@@ -0,0 +1,131 @@
+"""
+File: test_llm_cache.py
+Description: Checks the expiry, eviction and read-only mode of the LLM
+response cache (persona/prompt_template/llm_cache.py).
+
+Run it from this folder:
+  python -m unittest test_llm_cache
+"""
+import os
+import shutil
+import tempfile
+import unittest
+
+from unittest import mock
+
+from persona.prompt_template import llm_cache
+from persona.prompt_template.llm_cache import LLMResponseCache
+
+
+class LLMResponseCacheTest(unittest.TestCase):
+  def setUp(self):
+    self.folder = tempfile.mkdtemp()
+    self.db_file = os.path.join(self.folder, "llm_cache.sqlite")
+    self.caches = []
+    # The cache reads the time through time.time, which we move by hand.
+    self.now = 1000.0
+    patcher = mock.patch.object(llm_cache.time, "time",
+                                side_effect=lambda: self.now)
+    patcher.start()
+    self.addCleanup(patcher.stop)
+
+
+  def tearDown(self):
+    for cache in self.caches:
+      cache.close()
+    shutil.rmtree(self.folder, ignore_errors=True)
+
+
+  def open_cache(self, **kwargs):
+    cache = LLMResponseCache(self.db_file, **kwargs)
+    self.caches += [cache]
+    return cache
+
+
+  def test_get_and_put(self):
+    cache = self.open_cache()
+    self.assertIsNone(cache.get("gpt-4", "prompt", {"temperature": 0}))
+    cache.put("gpt-4", "prompt", {"temperature": 0}, "response")
+    self.assertEqual(cache.get("gpt-4", "prompt", {"temperature": 0}),
+                     "response")
+    # The model and the parameters are part of the key.
+    self.assertIsNone(cache.get("gpt-3.5-turbo", "prompt",
+                                {"temperature": 0}))
+    self.assertIsNone(cache.get("gpt-4", "prompt", {"temperature": 1}))
+    self.assertEqual((cache.hits, cache.misses), (1, 3))
+
+
+  def test_entries_expire_after_ttl(self):
+    cache = self.open_cache(ttl=60)
+    cache.put("gpt-4", "prompt", None, "response")
+    self.now += 59
+    self.assertEqual(cache.get("gpt-4", "prompt", None), "response")
+    # A hit does not extend the life of an entry.
+    self.now += 2
+    self.assertIsNone(cache.get("gpt-4", "prompt", None))
+    self.assertEqual(cache._size, 0)
+
+
+  def test_least_recently_used_entries_are_evicted(self):
+    # Room for three entries of 100 bytes.
+    cache = self.open_cache(max_size_mb=350 / (1024 * 1024))
+    for i in range(3):
+      self.now += 1
+      cache.put("gpt-4", f"prompt {i}", None, "x" * 92)
+    # Using the first entry makes the second the least recently used.
+    self.now += 1
+    self.assertIsNotNone(cache.get("gpt-4", "prompt 0", None))
+    self.now += 1
+    cache.put("gpt-4", "prompt 3", None, "x" * 92)
+
+    self.assertIsNotNone(cache.get("gpt-4", "prompt 0", None))
+    self.assertIsNone(cache.get("gpt-4", "prompt 1", None))
+    self.assertIsNotNone(cache.get("gpt-4", "prompt 2", None))
+    self.assertIsNotNone(cache.get("gpt-4", "prompt 3", None))
+    self.assertLessEqual(cache._size, cache.max_size)
+
+
+  def test_last_use_is_written_in_batches(self):
+    cache = self.open_cache()
+    cache.put("gpt-4", "prompt", None, "response")
+    key = cache.get_key("gpt-4", "prompt", None)
+
+    def get_last_used():
+      return cache._conn.execute(
+               "SELECT last_used FROM responses WHERE key = ?",
+               (key,)).fetchone()[0]
+
+    self.now += 10
+    cache.get("gpt-4", "prompt", None)
+    self.assertEqual(get_last_used(), 1000.0)
+    cache.flush()
+    self.assertEqual(get_last_used(), 1010.0)
+
+    with mock.patch.object(llm_cache, "TOUCH_BATCH_SIZE", 1):
+      self.now += 10
+      cache.get("gpt-4", "prompt", None)
+    self.assertEqual(get_last_used(), 1020.0)
+
+
+  def test_read_only(self):
+    # A read-only cache without a file is empty, and stays that way.
+    cache = self.open_cache(read_only=True)
+    cache.put("gpt-4", "prompt", None, "response")
+    self.assertIsNone(cache.get("gpt-4", "prompt", None))
+    self.assertFalse(os.path.exists(self.db_file))
+
+    writer = self.open_cache(ttl=60)
+    writer.put("gpt-4", "prompt", None, "response")
+    writer.flush()
+
+    # Expired entries are not served, but not deleted either.
+    cache = self.open_cache(read_only=True, ttl=60)
+    self.assertEqual(cache.get("gpt-4", "prompt", None), "response")
+    self.now += 61
+    self.assertIsNone(cache.get("gpt-4", "prompt", None))
+    self.now -= 61
+    self.assertEqual(writer.get("gpt-4", "prompt", None), "response")
+
+
+if __name__ == '__main__':
+  unittest.main()
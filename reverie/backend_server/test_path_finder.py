@@ -0,0 +1,229 @@
+"""
+File: test_path_finder.py
+Description: Checks the path finders of path_finder.py, the distance fields
+that the maze keeps, and the navigator against each other on the_ville.
+
+This loads the_ville from env_matrix, so it needs a utils.py like the rest of
+the backend. Run it from this folder:
+  python -m unittest test_path_finder
+"""
+import contextlib
+import io
+import random
+import types
+import unittest
+
+from unittest import mock
+
+from utils import *
+from path_finder import *
+from maze import Maze
+from navigator import Navigator
+from persona.cognitive_modules.execute import request_path
+
+import maze as maze_module
+
+
+class PathFinderTest(unittest.TestCase):
+  @classmethod
+  def setUpClass(cls):
+    cls.maze = Maze("the_ville")
+    cls.collision_maze = cls.maze.collision_maze
+    cls.rng = random.Random(0)
+    # <free_tiles> are the tiles that can be walked on, in (x, y) form, of 
+    # the largest part of the map that can be walked through (a few tiles 
+    # are walled in). 
+    free_tiles = [(x, y) for y in range(cls.maze.maze_height)
+                  for x in range(cls.maze.maze_width)
+                  if cls.collision_maze[y][x] != collision_block_id]
+    cls.free_tiles = []
+    while len(cls.free_tiles) < len(free_tiles) // 2:
+      start = cls.rng.choice(free_tiles)
+      field = distance_field(cls.collision_maze, [(start[1], start[0])],
+                             collision_block_id)
+      cls.free_tiles = [(x, y) for x, y in free_tiles
+                        if field[y * cls.maze.maze_width + x] != -1]
+    # <walled_in_tiles> are the tiles that can be walked on, but not be 
+    # reached from <free_tiles>. 
+    cls.walled_in_tiles = sorted(set(free_tiles) - set(cls.free_tiles))
+
+
+  def sample_tiles(self, count):
+    return [self.rng.choice(self.free_tiles) for _ in range(count)]
+
+
+  def assert_valid_path(self, path, start, end):
+    self.assertEqual(path[0], start)
+    self.assertEqual(path[-1], end)
+    for (x1, y1), (x2, y2) in zip(path, path[1:]):
+      self.assertEqual(abs(x1 - x2) + abs(y1 - y2), 1)
+      self.assertNotEqual(self.collision_maze[y2][x2], collision_block_id)
+
+
+  def test_a_star_matches_wavefront(self):
+    # path_finder_v2 gives up after 150 steps, so only the walks it finishes
+    # are compared. These are in (row, col) form.
+    compared = 0
+    while compared < 8:
+      start, end = [(y, x) for x, y in self.sample_tiles(2)]
+      expected = path_finder_v2(self.collision_maze, start, end,
+                                collision_block_id)
+      if expected[0] != start:
+        continue
+      path = path_finder_v3(self.collision_maze, start, end,
+                            collision_block_id)
+      self.assertEqual(len(path), len(expected))
+      self.assertEqual(path, expected)
+      compared += 1
+
+
+  def test_long_and_unreachable_paths(self):
+    # Corner to corner is far longer than path_finder_v2 can go.
+    start = min(self.free_tiles, key=lambda i: i[0] + i[1])
+    end = max(self.free_tiles, key=lambda i: i[0] + i[1])
+    path = path_finder(self.collision_maze, start, end, collision_block_id)
+    self.assertGreater(len(path), 150)
+    self.assert_valid_path(path, start, end)
+
+    blocked = next((x, y) for y in range(self.maze.maze_height)
+                   for x in range(self.maze.maze_width)
+                   if self.collision_maze[y][x] == collision_block_id)
+    self.assertEqual(path_finder(self.collision_maze, start, blocked,
+                                 collision_block_id), [])
+    self.assertEqual(path_finder_multi(self.collision_maze, start, [blocked],
+                                       collision_block_id), (None, []))
+
+
+  def test_multi_takes_the_closest_end(self):
+    for _ in range(5):
+      start = self.sample_tiles(1)[0]
+      ends = self.sample_tiles(4)
+      end, path = path_finder_multi(self.collision_maze, start, ends,
+                                    collision_block_id)
+      lengths = [len(path_finder(self.collision_maze, start, i,
+                                 collision_block_id)) for i in ends]
+      self.assertEqual(len(path), min(lengths))
+      self.assertEqual(end, ends[lengths.index(min(lengths))])
+      self.assert_valid_path(path, start, end)
+
+
+  def test_distance_field_matches_search(self):
+    for _ in range(5):
+      start = self.sample_tiles(1)[0]
+      ends = self.sample_tiles(3)
+      field = distance_field(self.collision_maze,
+                             [(i[1], i[0]) for i in ends],
+                             collision_block_id)
+      path = path_from_distance_field(self.collision_maze, field,
+                                      (start[1], start[0]))
+      path = [(i[1], i[0]) for i in path]
+      end, expected = path_finder_multi(self.collision_maze, start, ends,
+                                        collision_block_id)
+      self.assertEqual(len(path), len(expected))
+      self.assert_valid_path(path, start, path[-1])
+      self.assertIn(path[-1], ends)
+
+
+  def test_batch_matches_multi(self):
+    requests = [(self.sample_tiles(1)[0], self.sample_tiles(3))
+                for _ in range(12)]
+    expected = [path_finder_multi(self.collision_maze, start, ends,
+                                  collision_block_id)
+                for start, ends in requests]
+    self.assertEqual(batch_path_finder(self.collision_maze, requests,
+                                       collision_block_id), expected)
+    # In chunks of 5 requests.
+    max_tiles = 5 * self.maze.maze_width * self.maze.maze_height
+    self.assertEqual(batch_path_finder(self.collision_maze, requests,
+                                       collision_block_id, max_tiles),
+                     expected)
+
+
+  def test_distance_fields_are_kept_by_address(self):
+    # Addresses of more than 4 tiles, at least two of which can be walked 
+    # to. 
+    free_tiles = set(self.free_tiles)
+    addresses = [i for i, tiles in self.maze.address_tiles.items()
+                 if len(tiles) > 4 and len(tiles & free_tiles) >= 2][:3]
+    self.maze.distance_fields.clear()
+    with mock.patch.object(maze_module, "distance_field_cache_size", 2):
+      first = self.maze.get_distance_field(addresses[0])
+      self.assertIs(self.maze.get_distance_field(addresses[0]), first)
+      self.maze.get_distance_field(addresses[1])
+      # Using the first one again makes the second the least recently used.
+      self.maze.get_distance_field(addresses[0])
+      self.maze.get_distance_field(addresses[2])
+    self.assertEqual(list(self.maze.distance_fields),
+                     [addresses[0], addresses[2]])
+
+    start = self.sample_tiles(1)[0]
+    path = self.maze.get_path_to_address(start, addresses[0])
+    end, expected = path_finder_multi(self.collision_maze, start,
+                                      list(self.maze.address_tiles[
+                                             addresses[0]]),
+                                      collision_block_id)
+    self.assertEqual(len(path), len(expected))
+    self.assertIn(path[-1], self.maze.address_tiles[addresses[0]])
+
+    # Leaving out the tile it walked to gives a path to the closest of the
+    # others, and the field of the address is still the only one kept.
+    excluded_tile = path[-1]
+    path = self.maze.get_path_to_address(start, addresses[0], 
+                                         [excluded_tile])
+    others = self.maze.address_tiles[addresses[0]] - {excluded_tile}
+    end, expected = path_finder_multi(self.collision_maze, start, 
+                                      list(others), collision_block_id)
+    self.assertEqual(len(path), len(expected))
+    self.assertIn(path[-1], others)
+    self.assertEqual(list(self.maze.distance_fields),
+                     [addresses[2], addresses[0]])
+
+
+  def test_navigator_route(self):
+    navigator = Navigator(self.maze, collision_block_id)
+    for _ in range(3):
+      start = self.sample_tiles(1)[0]
+      ends = self.sample_tiles(2)
+      end, waypoints = navigator.find_route(start, ends)
+      self.assertIn(end, ends)
+      self.assertEqual(waypoints[0], start)
+      self.assertEqual(waypoints[-1], end)
+
+      path = [start]
+      leg, waypoints = navigator.extend_path(start, waypoints[1:])
+      while leg:
+        path += leg
+        if not waypoints:
+          break
+        leg, waypoints = navigator.extend_path(path[-1], waypoints)
+      self.assert_valid_path(path, start, end)
+      shortest = path_finder(self.collision_maze, start, end,
+                             collision_block_id)
+      self.assertGreaterEqual(len(path), len(shortest))
+
+
+  def test_navigator_unreachable_target(self):
+    navigator = Navigator(self.maze, collision_block_id)
+    start = self.sample_tiles(1)[0]
+    walled_in = self.walled_in_tiles[0]
+    self.assertEqual(navigator.find_route(start, [walled_in]), (None, []))
+
+    # execute then falls back to searching the whole map, instead of taking
+    # the empty route as a path. 
+    persona = types.SimpleNamespace(
+                name="test", 
+                rng=random.Random(0), 
+                scratch=types.SimpleNamespace(curr_tile=start, 
+                                              act_path_set=False, 
+                                              planned_path=[], 
+                                              planned_waypoints=[]))
+    plan = f"<waiting> {walled_in[0]} {walled_in[1]}"
+    with mock.patch.object(self.maze, "navigator", navigator): 
+      with contextlib.redirect_stdout(io.StringIO()): 
+        request = request_path(persona, self.maze, dict(), plan)
+    self.assertEqual(request, (start, [[walled_in[0], walled_in[1]]]))
+    self.assertFalse(persona.scratch.act_path_set)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,226 @@
+"""
+File: test_plan.py
+Description: Checks the shortcuts that persona/cognitive_modules/plan.py takes
+to plan with fewer requests, with the responses of the model given by hand.
+
+This loads the_ville and a persona of the base simulation, so it needs a
+utils.py like the rest of the backend. Run it from this folder:
+  python -m unittest test_plan
+"""
+import contextlib
+import datetime
+import io
+import json
+import unittest
+
+from unittest import mock
+
+from utils import *
+from maze import Maze
+from persona.persona import Persona
+from persona.prompt_template import gpt_structure
+
+import persona.cognitive_modules.plan as plan_module
+
+BASE_SIM = "base_the_ville_isabella_maria_klaus"
+PERSONA_NAME = "Isabella Rodriguez"
+
+
+class PlanTest(unittest.TestCase):
+  @classmethod
+  def setUpClass(cls):
+    cls.maze = Maze("the_ville")
+
+
+  def setUp(self):
+    folder = f"{fs_storage}/{BASE_SIM}/personas/{PERSONA_NAME}"
+    self.persona = Persona(PERSONA_NAME, folder)
+    living_area = self.persona.scratch.living_area
+    self.persona.scratch.curr_tile = min(self.maze.address_tiles[living_area])
+    self.persona.scratch.curr_time = datetime.datetime(2023, 2, 13)
+    # The model answers with <self.responses>, one per request, and nothing
+    # is read from or written to the response cache.
+    self.responses = []
+    self.requests = []
+
+    async def request(prompt):
+      self.requests += [prompt]
+      return self.responses.pop(0)
+
+    for name, value in [("ChatGPT_request_async", request),
+                        ("get_cached_response", lambda *args: None),
+                        ("cache_response", lambda *args: None)]:
+      patcher = mock.patch.object(gpt_structure, name, value)
+      patcher.start()
+      self.addCleanup(patcher.stop)
+
+
+  def respond(self, output):
+    self.responses += [json.dumps({"output": output})]
+
+
+class ActionDetailsTest(PlanTest):
+  def setUp(self):
+    super().setUp()
+    # An address in the persona's own apartment, which it always knows.
+    _, self.sector, self.arena = self.persona.scratch.living_area.split(":")
+    self.game_object = sorted(self.persona.s_mem.tree["the Ville"]
+                                [self.sector][self.arena])[0]
+
+
+  def get_output(self, **changes):
+    output = {"sector": self.sector,
+              "arena": self.arena,
+              "game_object": self.game_object,
+              "emoji": "😴💤🛏️✨",
+              "event": ["is", "sleeping"],
+              "object_state": "being slept in.",
+              "object_emoji": "🛏️",
+              "object_event": ["is", "being slept in"]}
+    output.update(changes)
+    return output
+
+
+  def resolve(self, act_desp):
+    with contextlib.redirect_stdout(io.StringIO()):
+      return plan_module.generate_action_details(act_desp, self.persona,
+                                                 self.maze)
+
+
+  def test_parses_a_valid_response(self):
+    self.respond(self.get_output())
+    details = self.resolve("sleeping")
+    self.assertEqual(len(self.requests), 1)
+    self.assertEqual(details, {
+      "address": f"the Ville:{self.sector}:{self.arena}:{self.game_object}",
+      "pronunciatio": "😴💤🛏",
+      "event": (PERSONA_NAME, "is", "sleeping"),
+      "obj_desc": "being slept in",
+      "obj_pronunciatio": "🛏️",
+      "obj_event": (self.game_object, "is", "being slept in")})
+
+
+  def test_retries_an_address_the_persona_does_not_know(self):
+    self.respond(self.get_output(game_object="spaceship"))
+    self.respond(self.get_output())
+    details = self.resolve("sleeping")
+    self.assertEqual(len(self.requests), 2)
+    self.assertEqual(details["address"],
+      f"the Ville:{self.sector}:{self.arena}:{self.game_object}")
+
+    # Other personas' houses are left out of what it can pick from, and all
+    # of the response has to be valid.
+    self.persona.s_mem.tree["the Ville"]["Moreno family's house"] = {
+      "kitchen": ["stove"]}
+    self.respond(self.get_output(sector="Moreno family's house",
+                                 arena="kitchen", game_object="stove"))
+    self.respond(self.get_output(event=["is"]))
+    self.assertFalse(self.resolve("sleeping"))
+    self.assertEqual(len(self.requests), 4)
+
+
+  def test_falls_back_to_the_chain(self):
+    self.respond(self.get_output(sector="the Moon"))
+    self.respond(self.get_output(emoji=""))
+    chain = {
+      "generate_action_sector": self.sector,
+      "generate_action_arena": self.arena,
+      "generate_action_game_object": self.game_object,
+      "generate_action_pronunciatio": "😴",
+      "generate_action_event_triple": (PERSONA_NAME, "is", "sleeping"),
+      "generate_act_obj_desc": "being slept in",
+      "generate_act_obj_event_triple": (self.game_object, "is", "used")}
+    with contextlib.ExitStack() as stack:
+      stack.enter_context(mock.patch.object(
+        plan_module, "combined_action_resolution", True))
+      for name, value in chain.items():
+        stack.enter_context(mock.patch.object(
+          plan_module, name, mock.Mock(return_value=value)))
+      with contextlib.redirect_stdout(io.StringIO()):
+        details = plan_module.resolve_action_details("sleeping",
+                                                     self.persona, self.maze)
+    self.assertEqual(len(self.requests), 2)
+    self.assertEqual(details, {
+      "address": f"the Ville:{self.sector}:{self.arena}:{self.game_object}",
+      "pronunciatio": "😴",
+      "event": (PERSONA_NAME, "is", "sleeping"),
+      "obj_desc": "being slept in",
+      "obj_pronunciatio": "😴",
+      "obj_event": (self.game_object, "is", "used")})
+
+
+class HourlyScheduleTest(PlanTest):
+  def setUp(self):
+    super().setUp()
+    # The hours that are generated one at a time, with the activities of 
+    # the hours before them. 
+    self.hourly_requests = []
+
+    def generate_hour(persona, curr_hour_str, n_m1_activity, hour_str):
+      self.hourly_requests += [(curr_hour_str, list(n_m1_activity))]
+      return f"activity at {curr_hour_str}", []
+
+    patcher = mock.patch.object(plan_module,
+                                "run_gpt_prompt_generate_hourly_schedule",
+                                generate_hour)
+    patcher.start()
+    self.addCleanup(patcher.stop)
+    patcher = mock.patch.object(plan_module, "one_shot_hourly_schedule", True)
+    patcher.start()
+    self.addCleanup(patcher.stop)
+
+
+  def generate(self, wake_up_hour):
+    with contextlib.redirect_stdout(io.StringIO()):
+      return plan_module.generate_hourly_schedule(self.persona, wake_up_hour)
+
+
+  def test_regenerates_only_the_repeated_hours(self):
+    # Four different activities, one short of what is diverse enough. 
+    self.respond(["Isabella is waking up."] + ["painting"] * 15
+                 + ["eating dinner", "sleeping"])
+    schedule = self.generate(6)
+    self.assertEqual(len(self.requests), 1)
+
+    # The first hour of painting is kept, and the hours of painting after it
+    # are generated again, each one following those before it. 
+    regenerated = [i for i, _ in self.hourly_requests]
+    self.assertEqual(regenerated, ["08:00 AM", "09:00 AM", "10:00 AM", 
+                                   "11:00 AM", "12:00 PM", "01:00 PM", 
+                                   "02:00 PM", "03:00 PM", "04:00 PM", 
+                                   "05:00 PM", "06:00 PM", "07:00 PM", 
+                                   "08:00 PM", "09:00 PM"])
+    self.assertEqual(self.hourly_requests[1][1], 
+                     ["sleeping"] * 6 + ["waking up", "painting", 
+                                         "activity at 08:00 AM"])
+    self.assertEqual(schedule, 
+                     [["sleeping", 360], ["waking up", 60], 
+                      ["painting", 60]] 
+                     + [[f"activity at {i}", 60] for i in regenerated]
+                     + [["eating dinner", 60], ["sleeping", 60]])
+
+
+  def test_diverse_schedule_is_kept(self):
+    activities = ["waking up", "eating breakfast", "painting", 
+                  "eating lunch", "painting", "eating dinner"]
+    self.respond(activities * 3)
+    schedule = self.generate(6)
+    self.assertEqual(len(self.requests), 1)
+    self.assertEqual(self.hourly_requests, [])
+    self.assertEqual(schedule, [["sleeping", 360]] 
+                               + [[i, 60] for i in activities * 3])
+
+
+  def test_invalid_schedule_falls_back_to_one_hour_at_a_time(self):
+    # Every waking hour needs exactly one activity. 
+    for _ in range(3):
+      self.respond(["waking up", "painting"])
+    schedule = self.generate(6)
+    self.assertEqual(len(self.requests), 3)
+    self.assertEqual(len(self.hourly_requests), 18)
+    self.assertEqual(schedule[0], ["sleeping", 360])
+    self.assertEqual(len(schedule), 19)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,61 @@
+"""
+File: test_prompt_registry.py
+Description: Checks that the compiled prompt templates of
+persona/prompt_template/prompt_registry.py fill in the same prompts as the
+original string replacement.
+
+Run it from this folder:
+  python -m unittest test_prompt_registry
+"""
+import os
+import unittest
+
+from persona.prompt_template.prompt_registry import *
+
+
+def fill_by_replacement(text, curr_input):
+  # How generate_prompt filled in templates before the registry.
+  for count, i in enumerate(curr_input):
+    text = text.replace(f"!<INPUT {count}>!", i)
+  if COMMENT_BLOCK_MARKER in text:
+    text = text.split(COMMENT_BLOCK_MARKER)[1]
+  return text.strip()
+
+
+class PromptRegistryTest(unittest.TestCase):
+  def test_fill(self):
+    text = ("Variables: !<INPUT 0>!\n"
+            + f"{COMMENT_BLOCK_MARKER}\n"
+            + "Name: !<INPUT 0>!\nAge: !<INPUT 1>!, !<INPUT 0>!.\n")
+    template = PromptTemplate("template.txt", text)
+    self.assertEqual(template.input_count, 2)
+    self.assertEqual(template.fill(["Isabella", "34"]),
+                     "Name: Isabella\nAge: 34, Isabella.")
+    # An input that looks like a placeholder is not filled in again.
+    self.assertEqual(template.fill(["!<INPUT 1>!", "34"]),
+                     "Name: !<INPUT 1>!\nAge: 34, !<INPUT 1>!.")
+    with self.assertRaises(ValueError):
+      template.fill(["Isabella"])
+
+
+  def test_templates_match_replacement(self):
+    registry = PromptRegistry()
+    self.assertTrue(registry.templates)
+    for template_file, template in registry.templates.items():
+      with open(template_file, "r") as f:
+        text = f.read()
+      curr_input = [f"<input {i}>" for i in range(template.input_count)]
+      self.assertEqual(template.fill(curr_input),
+                       fill_by_replacement(text, curr_input), template_file)
+
+
+  def test_templates_are_loaded_once(self):
+    registry = PromptRegistry()
+    template_file = next(iter(registry.templates))
+    relative_file = os.path.relpath(template_file)
+    self.assertIs(registry.get(relative_file),
+                  registry.templates[template_file])
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,150 @@
+"""
+File: test_rate_limiter.py
+Description: Checks the token buckets, the adaptive concurrency limit and the
+backoff of persona/prompt_template/rate_limiter.py.
+
+Run it from this folder:
+  python -m unittest test_rate_limiter
+"""
+import asyncio
+import random
+import unittest
+
+from unittest import mock
+
+from persona.prompt_template import rate_limiter
+from persona.prompt_template.rate_limiter import *
+
+
+class TokenBucketTest(unittest.TestCase):
+  def setUp(self):
+    # The bucket reads the time through time.monotonic, which we move by
+    # hand, and waits through asyncio.sleep, which only records the wait.
+    self.now = 0.0
+    self.waits = []
+    patcher = mock.patch.object(rate_limiter.time, "monotonic",
+                                side_effect=lambda: self.now)
+    patcher.start()
+    self.addCleanup(patcher.stop)
+
+
+  def acquire(self, bucket, amount=1):
+    async def sleep(seconds):
+      self.waits += [seconds]
+
+    with mock.patch.object(rate_limiter.asyncio, "sleep", sleep):
+      asyncio.run(bucket.acquire(amount))
+
+
+  def test_bursts_up_to_capacity(self):
+    bucket = TokenBucket(60, capacity=3)
+    for _ in range(3):
+      self.acquire(bucket)
+    self.assertEqual(self.waits, [])
+    # The fourth request waits for one token, at one token per second.
+    self.acquire(bucket)
+    self.assertEqual(self.waits, [1.0])
+
+
+  def test_refills_over_time(self):
+    bucket = TokenBucket(60, capacity=3)
+    self.acquire(bucket, 3)
+    self.now += 2
+    self.acquire(bucket, 2)
+    self.assertEqual(self.waits, [])
+    # It never holds more than its capacity.
+    self.now += 60
+    self.acquire(bucket, 3)
+    self.acquire(bucket, 1)
+    self.assertEqual(self.waits, [1.0])
+
+
+  def test_callers_are_served_in_order(self):
+    bucket = TokenBucket(60, capacity=1)
+    for _ in range(4):
+      self.acquire(bucket)
+    # Each caller reserves its token right away, so the ones behind it wait
+    # longer.
+    self.assertEqual(self.waits, [1.0, 2.0, 3.0])
+
+
+  def test_large_amounts_are_capped(self):
+    # A request larger than the bucket waits for a full bucket instead of
+    # forever.
+    bucket = TokenBucket(600, capacity=100)
+    self.acquire(bucket, 100)
+    self.acquire(bucket, 1000)
+    self.assertEqual(self.waits, [10.0])
+
+
+class AdaptiveConcurrencyTest(unittest.TestCase):
+  def test_overload_halves_the_limit_once_per_epoch(self):
+    concurrency = AdaptiveConcurrency(16)
+    epoch = concurrency.epoch
+    concurrency.on_overload(epoch)
+    self.assertEqual(concurrency.limit, 8)
+    # Errors of requests sent before the decrease do not lower it again.
+    concurrency.on_overload(epoch)
+    self.assertEqual(concurrency.limit, 8)
+    concurrency.on_overload(concurrency.epoch)
+    self.assertEqual(concurrency.limit, 4)
+
+
+  def test_limit_stays_within_bounds(self):
+    concurrency = AdaptiveConcurrency(4, min_limit=2)
+    for _ in range(5):
+      concurrency.on_overload(concurrency.epoch)
+    self.assertEqual(concurrency.limit, 2)
+    for _ in range(100):
+      concurrency.on_success()
+    self.assertEqual(concurrency.limit, 4)
+
+
+  def test_successes_grow_the_limit_by_one_per_window(self):
+    concurrency = AdaptiveConcurrency(16)
+    concurrency.on_overload(concurrency.epoch)
+    concurrency.on_overload(concurrency.epoch)
+    self.assertEqual(concurrency.limit, 4)
+    # <limit> successes in a row grow the limit by about one.
+    for _ in range(4):
+      concurrency.on_success()
+    self.assertEqual(int(concurrency.limit), 4)
+    self.assertAlmostEqual(concurrency.limit, 5, delta=0.2)
+
+
+  def test_limits_the_requests_in_flight(self):
+    concurrency = AdaptiveConcurrency(2)
+    counts = {"in_flight": 0, "most": 0}
+
+    async def request():
+      async with concurrency:
+        counts["in_flight"] += 1
+        counts["most"] = max(counts["most"], counts["in_flight"])
+        await asyncio.sleep(0)
+        counts["in_flight"] -= 1
+
+    async def main():
+      await asyncio.gather(*[request() for _ in range(6)])
+
+    asyncio.run(main())
+    self.assertEqual(counts["most"], 2)
+    self.assertEqual(concurrency.in_flight, 0)
+
+
+class BackoffTest(unittest.TestCase):
+  def test_backoff_is_capped_and_jittered(self):
+    rng = random.Random(0)
+    for attempt in range(10):
+      waits = [get_backoff(attempt, base=1.0, maximum=8.0, rng=rng)
+               for _ in range(50)]
+      self.assertTrue(all(0 <= i <= min(8.0, 2 ** attempt) for i in waits))
+      self.assertGreater(len(set(waits)), 1)
+
+
+  def test_estimate_tokens(self):
+    self.assertEqual(estimate_tokens("abcdefgh"), 3)
+    self.assertEqual(estimate_tokens(["abcdefgh", "abcd"]), 5)
+
+
+if __name__ == '__main__':
+  unittest.main()
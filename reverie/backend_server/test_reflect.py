@@ -0,0 +1,140 @@
+"""
+File: test_reflect.py
+Description: Checks that a reflection running in the background (see
+background_reflection in persona/cognitive_modules/reflect.py) works on a
+snapshot of the persona, and that its thoughts are merged into the persona's
+memory at the step after it is done, or when the persona is saved.
+
+This loads a persona of the base simulation, so it needs a utils.py like the
+rest of the backend. Run it from this folder:
+  python -m unittest test_reflect
+"""
+import contextlib
+import datetime
+import io
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from unittest import mock
+
+from utils import *
+from persona.persona import Persona
+
+import persona.cognitive_modules.reflect as reflect_module
+
+BASE_SIM = "base_the_ville_isabella_maria_klaus"
+PERSONA_NAME = "Isabella Rodriguez"
+
+
+class BackgroundReflectionTest(unittest.TestCase):
+  def setUp(self):
+    folder = f"{fs_storage}/{BASE_SIM}/personas/{PERSONA_NAME}"
+    self.persona = Persona(PERSONA_NAME, folder)
+    self.start_time = datetime.datetime(2023, 2, 13, 8)
+    self.persona.scratch.curr_time = self.start_time
+    self.persona.scratch.act_start_time = self.start_time
+    self.add_event("is", "painting")
+
+    # The reflection waits for <self.done> and then gives a single thought.
+    # It marks the nodes it sees as accessed, the way retrieving them does.
+    self.done = threading.Event()
+    self.reflected = []
+
+    def generate_reflection(snapshot):
+      self.reflected += [snapshot]
+      self.assertTrue(self.done.wait(10))
+      for node in snapshot.a_mem.id_to_node.values():
+        node.last_accessed = snapshot.scratch.curr_time
+      thought = f"{PERSONA_NAME} likes to paint"
+      return [(snapshot.scratch.curr_time, None, PERSONA_NAME, "likes",
+               "painting", thought, {"painting"}, 5, (thought, [0.0]),
+               ["node_1"])]
+
+    for name, value in [("generate_reflection", generate_reflection),
+                        ("background_reflection", True)]:
+      patcher = mock.patch.object(reflect_module, name, value)
+      patcher.start()
+      self.addCleanup(patcher.stop)
+    self.addCleanup(self.done.set)
+
+
+  def add_event(self, p, o):
+    description = f"{PERSONA_NAME} {p} {o}"
+    self.persona.a_mem.add_event(self.persona.scratch.curr_time, None,
+                                 PERSONA_NAME, p, o, description, {o}, 5,
+                                 (description, [0.0]), [])
+
+
+  def step(self, minutes=1):
+    # Moves the persona on, and runs its reflection module.
+    self.persona.scratch.curr_time += datetime.timedelta(minutes=minutes)
+    with contextlib.redirect_stdout(io.StringIO()):
+      reflect_module.reflect(self.persona)
+
+
+  def start_reflection(self):
+    self.persona.scratch.importance_trigger_curr = 0
+    self.step()
+    self.assertIsNotNone(self.persona.pending_reflection)
+    self.assertEqual(self.persona.scratch.importance_trigger_curr,
+                     self.persona.scratch.importance_trigger_max)
+    snapshot, future = self.persona.pending_reflection
+    return snapshot, future
+
+
+  def test_thoughts_are_merged_at_the_step_after_it_is_done(self):
+    snapshot, future = self.start_reflection()
+    started = self.persona.scratch.curr_time
+
+    # The persona keeps moving (and even wants to reflect again) while the
+    # reflection runs, without changing the snapshot or starting another
+    # reflection.
+    self.add_event("is", "cleaning")
+    self.persona.scratch.importance_trigger_curr = 0
+    self.step()
+    self.assertEqual(self.persona.pending_reflection, (snapshot, future))
+    self.assertEqual(len(snapshot.a_mem.seq_event), 1)
+    self.assertEqual(snapshot.scratch.curr_time, started)
+    self.assertEqual(self.persona.a_mem.seq_thought, [])
+
+    self.done.set()
+    future.result()
+    self.step()
+    [thought] = self.persona.a_mem.seq_thought
+    self.assertEqual(thought.description, f"{PERSONA_NAME} likes to paint")
+    self.assertEqual(thought.created, started)
+    # The nodes the reflection accessed in its snapshot are marked as
+    # accessed here too, and the ones it did not see are left alone.
+    nodes = self.persona.a_mem.id_to_node
+    self.assertEqual(nodes["node_1"].last_accessed, started)
+    self.assertEqual(nodes["node_2"].last_accessed, nodes["node_2"].created)
+
+    # Once it is merged, the trigger that fired in the meantime starts the
+    # next reflection, on a snapshot that has the new thought.
+    self.assertNotEqual(self.persona.pending_reflection, (snapshot, future))
+    next_snapshot, next_future = self.persona.pending_reflection
+    next_future.result()
+    self.assertEqual(len(self.reflected), 2)
+    self.assertEqual(len(next_snapshot.a_mem.seq_thought), 1)
+
+
+  def test_save_waits_for_the_reflection(self):
+    self.start_reflection()
+    save_folder = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, save_folder, ignore_errors=True)
+    os.mkdir(f"{save_folder}/associative_memory")
+
+    timer = threading.Timer(0.1, self.done.set)
+    timer.start()
+    self.persona.save(save_folder)
+    timer.join()
+    self.assertIsNone(self.persona.pending_reflection)
+    with open(f"{save_folder}/associative_memory/nodes.json") as f:
+      self.assertIn(f"{PERSONA_NAME} likes to paint", f.read())
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,76 @@
+"""
+File: test_reproducibility.py
+Description: Checks that a seeded simulation takes the exact same steps every
+time it is run, with the personas (and their action prompts) on threads.
+
+This runs the base simulation for real, so it needs a utils.py that uses the
+local LLM stand-in (llm_backend = "local") and sets a simulation_seed; it is
+skipped otherwise. Run it from this folder:
+  python -m unittest test_reproducibility
+"""
+import contextlib
+import io
+import os
+import shutil
+import unittest
+
+from unittest import mock
+
+from utils import *
+from default_settings import *
+from reverie import ReverieServer
+
+import persona.cognitive_modules.plan as plan_module
+
+BASE_SIM = "base_the_ville_isabella_maria_klaus"
+# The first conversation of the base simulation starts a little before
+# step 3000, and the prompts it takes are the ones that used to depend on
+# the order of sets of memory nodes.
+STEPS = 3000
+
+
+@unittest.skipUnless(llm_backend == "local" and simulation_seed is not None,
+                     "needs the local LLM stand-in and a simulation_seed")
+class ReproducibilityTest(unittest.TestCase):
+  def setUp(self):
+    self.sim_codes = []
+
+
+  def tearDown(self):
+    for sim_code in self.sim_codes:
+      shutil.rmtree(f"{fs_storage}/{sim_code}", ignore_errors=True)
+
+
+  def run_simulation(self, sim_code):
+    """
+    Runs the base simulation headless for STEPS steps, with concurrent
+    personas, and returns its movement files as {file name: content}.
+    """
+    self.sim_codes += [sim_code]
+    shutil.rmtree(f"{fs_storage}/{sim_code}", ignore_errors=True)
+    rs = ReverieServer(BASE_SIM, sim_code)
+    rs.concurrent_personas = True
+    rs.headless = True
+    with contextlib.redirect_stdout(io.StringIO()):
+      with mock.patch.object(plan_module, "parallel_action_prompts", True):
+        rs.start_server(STEPS)
+
+    movement_folder = f"{fs_storage}/{sim_code}/movement"
+    movements = dict()
+    for file_name in os.listdir(movement_folder):
+      with open(f"{movement_folder}/{file_name}") as movement_file:
+        movements[file_name] = movement_file.read()
+    return movements
+
+
+  def test_seeded_runs_are_identical(self):
+    first = self.run_simulation("test_reproducibility_1")
+    second = self.run_simulation("test_reproducibility_2")
+    self.assertEqual(len(first), STEPS)
+    self.assertEqual(sorted(first), sorted(second))
+    for file_name in sorted(first, key=lambda i: int(i.split(".")[0])):
+      self.assertEqual(first[file_name], second[file_name], file_name)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,162 @@
+"""
+File: test_reverie.py
+Description: Checks how the server of reverie.py carries work over between
+steps: the actions it works out ahead of time in a pipelined run (see
+start_speculation), and the personas it lets idle (see get_idle_candidates).
+
+This forks the base simulation, so it needs a utils.py like the rest of the
+backend. Run it from this folder:
+  python -m unittest test_reverie
+"""
+import contextlib
+import datetime
+import io
+import shutil
+import unittest
+
+from unittest import mock
+
+from utils import *
+
+import reverie as reverie_module
+
+BASE_SIM = "base_the_ville_isabella_maria_klaus"
+SIM_CODE = "test_reverie"
+
+
+class ReverieTest(unittest.TestCase):
+  def setUp(self):
+    shutil.rmtree(f"{fs_storage}/{SIM_CODE}", ignore_errors=True)
+    self.addCleanup(shutil.rmtree, f"{fs_storage}/{SIM_CODE}",
+                    ignore_errors=True)
+    self.rs = reverie_module.ReverieServer(BASE_SIM, SIM_CODE)
+    self.persona_names = sorted(self.rs.personas)
+
+
+class SpeculationTest(ReverieTest):
+  def speculate(self, speculated):
+    """
+    Starts a speculation in which every persona is predicted to stay on its
+    tile, and the next action of each persona is speculated[persona name].
+    """
+    def speculate_action(speculative_persona, maze):
+      action = speculated[speculative_persona.name]
+      if isinstance(action, Exception):
+        raise action
+      return action
+
+    movements = {"persona": dict()}
+    for persona_name, tile in self.rs.personas_tile.items():
+      movements["persona"][persona_name] = {"movement": list(tile)}
+    with mock.patch.object(reverie_module, "speculate_action",
+                           speculate_action):
+      self.rs.start_speculation(movements)
+
+
+  def get_env(self, moved=()):
+    # The environment the frontend reports, with the personas of <moved> one
+    # tile to the right of where they were predicted to be.
+    env = dict()
+    for persona_name, (x, y) in self.rs.personas_tile.items():
+      if persona_name in moved:
+        x += 1
+      env[persona_name] = {"maze": self.rs.maze.maze_name, "x": x, "y": y}
+    return env
+
+
+  def test_only_actions_on_the_predicted_tile_are_committed(self):
+    first, second, third = self.persona_names
+    self.speculate({first: "first action", second: "second action",
+                    third: None})
+    self.rs.commit_speculation(self.get_env(moved=[second, third]))
+    self.assertIsNone(self.rs.speculation)
+    self.assertEqual(self.rs.personas[first].speculated_action,
+                     "first action")
+    self.assertIsNone(self.rs.personas[second].speculated_action)
+    self.assertIsNone(self.rs.personas[third].speculated_action)
+    self.assertEqual(self.rs.speculated_actions, 1)
+    self.assertEqual(self.rs.discarded_actions, 1)
+
+
+  def test_actions_of_another_step_are_discarded(self):
+    first, second, third = self.persona_names
+    self.speculate({first: "first action", second: RuntimeError("failed"),
+                    third: "third action"})
+    self.rs.step += 1
+    with contextlib.redirect_stdout(io.StringIO()):
+      with contextlib.redirect_stderr(io.StringIO()):
+        self.rs.commit_speculation(self.get_env())
+    for persona in self.rs.personas.values():
+      self.assertIsNone(persona.speculated_action)
+    self.assertEqual(self.rs.speculated_actions, 0)
+    self.assertEqual(self.rs.discarded_actions, 2)
+
+
+class IdleTest(ReverieTest):
+  def setUp(self):
+    super().setUp()
+    # Every persona sleeps where it stands, the i-th one for i + 1 hours, 
+    # and (as far as this test is concerned) would not perceive anything new
+    # from there. 
+    for count, persona_name in enumerate(self.persona_names): 
+      scratch = self.rs.personas[persona_name].scratch
+      scratch.curr_time = self.rs.curr_time
+      scratch.curr_tile = self.rs.personas_tile[persona_name]
+      scratch.act_address = f"{scratch.living_area}:bed"
+      scratch.act_start_time = self.rs.curr_time
+      scratch.act_duration = 60 * (count + 1)
+      scratch.act_event = (persona_name, "is", "sleeping")
+      scratch.act_path_set = True
+    patcher = mock.patch.object(reverie_module, "perceives_new_events", 
+                                lambda persona, maze: False)
+    patcher.start()
+    self.addCleanup(patcher.stop)
+    for persona_name in self.persona_names: 
+      self.rs.schedule_decision(persona_name)
+
+
+  def test_personas_idle_until_their_action_ends(self):
+    first, second, third = self.persona_names
+    self.assertEqual(self.rs.get_idle_candidates(set()), 
+                     set(self.persona_names))
+    # Until the first action ends, at 10 seconds a step. 
+    self.assertEqual(self.rs.get_idle_steps(1000), 360)
+    self.assertEqual(self.rs.get_idle_steps(100), 100)
+
+    self.rs.curr_time += datetime.timedelta(hours=1)
+    self.assertEqual(self.rs.get_idle_candidates(set()), {second, third})
+    self.assertEqual(self.rs.get_idle_steps(1000), 360)
+
+    # A persona that is no longer idle is not a candidate either. 
+    self.rs.personas[second].scratch.planned_path = [(0, 0)]
+    self.assertEqual(self.rs.get_idle_candidates(set()), {third})
+
+
+  def test_changed_tile_in_vision(self):
+    first, second, third = self.persona_names
+    scratch = self.rs.personas[first].scratch
+    x, y = scratch.curr_tile
+    # The others are too far away to see the tiles around the first one. 
+    for persona_name in [second, third]: 
+      other_x, other_y = self.rs.personas_tile[persona_name]
+      self.assertGreater(max(abs(other_x - x), abs(other_y - y)), 
+                         2 * scratch.vision_r + 1)
+    # A tile just outside of its vision changes, and then one just within.
+    outside = (x + scratch.vision_r + 1, y)
+    self.assertEqual(self.rs.get_idle_candidates({outside}), 
+                     set(self.persona_names))
+    inside = (x + scratch.vision_r, y - scratch.vision_r)
+    self.assertEqual(self.rs.get_idle_candidates({inside}), {second, third})
+
+    # It stays out of the idle personas until it is scheduled again, and the
+    # others can now only idle until the second action ends. 
+    self.assertEqual(self.rs.get_idle_candidates(set()), {second, third})
+    self.assertEqual(self.rs.get_idle_steps(1000), 720)
+    self.rs.schedule_decision(first)
+    self.assertEqual(self.rs.get_idle_candidates(set()), 
+                     set(self.persona_names))
+    self.assertEqual(self.rs.get_idle_steps(1000), 360)
+
+
+if __name__ == '__main__':
+  unittest.main()